@@ -3,13 +3,30 @@
 d2vdのHTTPサーバクラス。Bottleのラッパクラスとして実装。
 """
 
-from bottle import Bottle
+from bottle import Bottle, ServerAdapter
 from bottle import static_file
-from bottle import get, post, request, template
+from bottle import get, post, request, response, template
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIServer
+import gzip
 import json
 
+try:
+    import orjson
+except ImportError:  # orjsonは任意（インストールされていない場合は標準のjsonを使う）
+    orjson = None
+
+# これより小さいレスポンスは圧縮しない（圧縮しても小さくならず、時間だけかかる）
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 5
+# サーバの種類（--server）
+#   wsgiref: Bottleの既定のサーバ（1スレッド。開発用）
+#   threaded: 標準ライブラリのWSGIサーバを、workers個のスレッドで処理するようにしたもの
+#   gunicorn: workers個のプロセス（読み込み済みのモデルをfork()で共有する。gunicornが必要）
+SERVERS = ("wsgiref", "threaded", "gunicorn")
+
 class BottleServer:
-    def __init__(self, model, host, port, reloader = False):
+    def __init__(self, model, host, port, reloader = False, server = "wsgiref", workers = 1):
         """
         クラスの初期化。引数の保持および、ルートの設定。
         """
@@ -17,6 +34,8 @@ class BottleServer:
         self._host = host
         self._port = port
         self._reloader = reloader
+        self._server = server
+        self._workers = workers
         self._app  = Bottle()
         self._route()
 
@@ -27,6 +46,7 @@ class BottleServer:
         self._app.route('/search', method="GET", callback=self._search)
         self._app.route('/search_words', method="GET", callback=self._search_words)
         self._app.route('/newpaper/<description>', callback=self._newpaper)
+        self._app.route('/model_stats', callback=self._model_stats)
         self._app.route('/semantic/dist/:path#.+#', name='semantic/dist', callback=self._semantic)
         self._app.route('/tabulator/dist/:path#.+#', name='tabulator/dist', callback=self._tabulator)
         self._app.route('/javascript/<script>', callback=self._tsne)
@@ -36,7 +56,13 @@ class BottleServer:
         """
         Bottleサーバの開始。
         """
-        self._app.run(host=self._host, port=self._port, reloader = self._reloader)
+        if self._server == "threaded":
+          self._app.run(host=self._host, port=self._port, reloader = self._reloader,
+                        server_class=thread_pool_server_class(self._workers))
+        elif self._server == "gunicorn":
+          self._app.run(server=GunicornServer, host=self._host, port=self._port, workers=self._workers)
+        else:
+          self._app.run(host=self._host, port=self._port, reloader = self._reloader)
 
     def _search(self):
         """
@@ -75,16 +101,30 @@ class BottleServer:
           output_types = request.query.output_types.split(" ")
         print(output_types)
         model_type = request.query.model_type
-        result = self._model.search(positive_words, negative_words, outline_area, output_types, model_type)
+        # search_mode=hybrid: キーワードで候補を絞り込んでからベクトルで採点する
+        search_mode = request.query.search_mode or "vector"
+        # include_vectors=1: 入力・結果のベクトル（base64のfloat16）も返す（画面では使わないため、既定では返さない）
+        include_vectors = request.query.include_vectors == "1"
+        result = self._model.search(positive_words, negative_words, outline_area, output_types, model_type, search_mode, include_vectors)
         print(result["message"])
-        return json.dumps(result)
+        return json_response(result)
 
     def _newpaper(self, description):
         """
         指定された文章と類似の情報をモデルから検索。
+        ?mode=fast の場合は単語ベクトルの平均で高速に推論する。
         """
-        result = self._model.search_paper(description)
-        return json.dumps(result)
+        mode = request.query.mode or "infer"
+        if mode not in ("infer", "fast"):
+          mode = "infer"
+        result = self._model.search_paper(description, mode)
+        return json_response(result)
+
+    def _model_stats(self):
+        """
+        モデルのキャッシュの状態（読み込み回数、ヒット数、保持しているモデル）を返す。
+        """
+        return json_response(self._model.model_cache.stats())
 
     # Semantic UI & Tabulator resources
     def _semantic(self, path):
@@ -126,3 +166,65 @@ class BottleServer:
         params["output_formats"] = output_formats
         params["model_type"] = model_type
         return params
+
+def dumps_json(result):
+    """
+    JSONのバイト列に変換。orjsonがあればそれを使う（標準のjsonより速い）。
+    """
+    if orjson is not None:
+        return orjson.dumps(result, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(result, ensure_ascii=False).encode("utf-8")
+
+def json_response(result):
+    """
+    JSONのレスポンス。クライアントがgzipを受け付ける場合は圧縮して返す。
+    """
+    body = dumps_json(result)
+    response.content_type = "application/json; charset=UTF-8"
+    response.set_header("Vary", "Accept-Encoding")
+    if len(body) >= GZIP_MIN_BYTES and "gzip" in request.headers.get("Accept-Encoding", ""):
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        response.set_header("Content-Encoding", "gzip")
+    return body
+
+def thread_pool_server_class(workers):
+    """
+    決まった数のスレッドでリクエストを処理する、標準ライブラリのWSGIサーバのクラスを作る。
+    /newpaperの推論に時間がかかっている間も、他のリクエストを別のスレッドで処理できる。
+    """
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="d2vd")
+
+    class ThreadPoolWSGIServer(WSGIServer):
+        request_queue_size = 128
+
+        def process_request(self, request, client_address):
+            executor.submit(self.process_request_thread, request, client_address)
+
+        def process_request_thread(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    return ThreadPoolWSGIServer
+
+class GunicornServer(ServerAdapter):
+    """
+    gunicornで複数のプロセスを動かすサーバ。
+    Bottle付属のものはd2vdのコマンドライン引数をgunicornの引数として解析してしまうため、設定を直接渡す。
+    """
+    def run(self, handler):
+        from gunicorn.app.base import BaseApplication
+        options = dict(self.options, bind="%s:%d" % (self.host, self.port))
+
+        class Application(BaseApplication):
+            def load_config(self):
+                for key, value in options.items():
+                    self.cfg.set(key, value)
+
+            def load(self):
+                return handler
+
+        Application().run()
@@ -2,8 +2,9 @@
 """
 d2vdのメイン処理。引数を解析してBottleサーバーを立ち上げる。
 $ python d2vd.py --model モデル名  --port ポート
+本番用: $ python d2vd.py --model モデル名 --server threaded --workers 8
 """
-from bottle_server import BottleServer
+from bottle_server import BottleServer, SERVERS
 from ipsj_model import IpsjModel
 from argparse import ArgumentParser
 
@@ -13,10 +14,12 @@ def main_proc(args):
     '''
     # Loading Model
     print("Loading model: " + args.model_name)
-    model = IpsjModel(args.model_name)
+    max_model_bytes = args.max_model_mb * 1024 * 1024 if args.max_model_mb else None
+    model = IpsjModel(args.model_name, search_index=args.search_index, vector_store=args.vector_store, slim=args.slim,
+                      max_models=args.max_models, max_model_bytes=max_model_bytes)
 
     # Start Bottle server
-    bottle_server = BottleServer(model=model, host='0.0.0.0', port=args.port)
+    bottle_server = BottleServer(model=model, host='0.0.0.0', port=args.port, server=args.server, workers=args.workers)
     bottle_server.start()
 
 def parse_args():
@@ -28,9 +31,30 @@ def parse_args():
     parser.add_argument("--port", dest="port",
                     default=57007, type=int,
                     help="port number of server")
+    parser.add_argument("--server", dest="server",
+                    default="wsgiref", choices=SERVERS,
+                    help="WSGI server (wsgiref: single thread for development, threaded: thread pool, gunicorn: processes)")
+    parser.add_argument("--workers", dest="workers",
+                    default=8, type=int,
+                    help="threads (threaded) or processes (gunicorn) handling requests")
     parser.add_argument("--model", dest="model_name",
                     default="d2v_ipsj_desc", type=str,
                     help="prefix of model files to be stored")
+    parser.add_argument("--index", dest="search_index",
+                    default="exact", choices=["exact", "ivf"],
+                    help="doc vector search method (exact or approximate ivf index per tag type)")
+    parser.add_argument("--vector-store", dest="vector_store",
+                    default=None, choices=["float16", "int8"],
+                    help="search doc vectors stored in reduced precision (<model>.<dtype>.npz)")
+    parser.add_argument("--slim", dest="slim",
+                    action="store_true",
+                    help="load inference-only models (<model>.slim.npz)")
+    parser.add_argument("--max-models", dest="max_models",
+                    default=2, type=int,
+                    help="number of models kept in memory (2 keeps both DM and DBOW)")
+    parser.add_argument("--max-model-mb", dest="max_model_mb",
+                    default=None, type=int,
+                    help="memory cap in MB for the arrays of the models kept in memory")
 
     return parser.parse_args()
 
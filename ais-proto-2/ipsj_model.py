@@ -2,27 +2,53 @@
 # coding: UTF-8
 
 import random
+import base64
 import gensim
 from gensim.models.doc2vec import Doc2Vec
 import sys
 import os
 import re
 import shlex
-import MeCab
 import json
 import numpy as np
 import copy
 import traceback
 
+import repo_root  # api/をimportできるようにする
+from api.doc2vec.search_engine import VectorSearchEngine
+from api.doc2vec import ann_index
+from api.doc2vec import quantized_store
+from api.doc2vec import slim_model
+from api.doc2vec import fast_infer
+from api.doc2vec import projection
+from api.doc2vec import sparse_engine
+from api.utils import tokenizer
+from model_cache import ModelCache, LoadedModel
+
 # IPSJ papers DB model (generated by Doc2Vec)
 class IpsjModel:
-  def __init__(self, model_name):
+  # ハイブリッド検索（キーワードで候補を絞り込んでからベクトルで採点する）の設定
+  KEYWORD_INDEX_PATH = "./keyword_index.npz"  # built from ./json/id_*.json if missing or stale
+  KEYWORD_FIELDS = ("biblio_location", "biblio_publisher")
+  HYBRID_MAX_CANDIDATES = 5000  # candidates scored by cosine similarity
+  HYBRID_VECTOR_WEIGHT = 0.7    # fused = w * cosine + (1 - w) * keyword score
+
+  def __init__(self, model_name, search_index = "exact", vector_store = None, slim = False, max_models = 2, max_model_bytes = None):
     self.models = {
       "model_dm":   "./" + model_name + "_1.model",
       "model_dbow": "./" + model_name + "_0.model"
     };
-    self.current_model = "model_dm"  # DM model (not DBOW model)
-    self.model = self.load_model(self.models[self.current_model])
+    if slim:
+      # 推論用に学習用の状態を除いたモデル（python -m api.doc2vec.slim_model で作る）を使う
+      self.models = {key: slim_model.slim_path(path) for key, path in self.models.items()}
+    self.current_model = "model_dm"  # default model (DM, not DBOW) when model_type is not given
+    self.search_index = search_index  # "exact" or "ivf"
+    self.vector_store = vector_store  # None (float32), "float16" or "int8"
+    # 読み込んだモデルを保持するキャッシュ（既定ではDMとDBOWの両方を保持し、切り替えても読み込み直さない）
+    self.model_cache = ModelCache(self.load_named_model, max_models, max_model_bytes)
+    self.model_cache.get(self.current_model)
+    self.keyword_index = None  # loaded on the first hybrid search
+    self.keyword_rows = {}     # model path -> (keyword index document -> row of the engine)
     self.output_types = {
       'author': 'P',
       'org': 'O',
@@ -34,14 +60,53 @@ class IpsjModel:
       'filename': 'FILE'
     };
 
+  # 既定のモデル（model_typeを指定しない検索で使う）
+  # 属性を読むたびにヒット数が増えると/model_statsの値が実際のリクエスト数と合わなくなるため、数えない
+  @property
+  def model(self):
+    return self.model_cache.get(self.current_model, count = False).model
+
+  @property
+  def engine(self):
+    return self.model_cache.get(self.current_model, count = False).engine
+
+  # ModelCacheから呼ばれ、名前（model_dm/model_dbow）のモデルと検索エンジンを読み込む
+  def load_named_model(self, name):
+    model_file = self.models[name]
+    model = self.load_model(model_file)
+    engine = self.build_engine(model, model_file)
+    # 結果の2次元の座標（モデルの隣に保存したもの。モデルが更新されていれば変わった行だけ求め直す）
+    tags, vectors = projection.model_tags(model)
+    model_projection = projection.load_or_build(projection.projection_path(model_file), tags, vectors)
+    arrays = [getattr(model.wv, "vectors", None), getattr(model.trainables, "syn1neg", None)]
+    nbytes = sum(array.nbytes for array in arrays if array is not None)
+    nbytes += engine.nbytes + model_projection.nbytes
+    return LoadedModel(name, model_file, model, engine, model_projection, nbytes)
+
   def load_model(self, model_file):
     print("### load model from %s" % model_file)
-    model = Doc2Vec.load(model_file)
+    # 精度を落とした文書ベクトルで検索する場合は、モデルの配列をメモリマップで読み込み、
+    # float32の文書ベクトル全体をメモリに読み込まないようにする
+    model = slim_model.load_model(model_file, mmap = "r" if self.vector_store else None)
     return model
 
-  def vectorize(self, results, words, outline_area = ""):
-    wordvecs = self.model.wv
-    docvecs = self.model.docvecs
+  def build_engine(self, model, model_file):
+    # 文書ベクトルの検索エンジン。ivfの場合はモデルの隣に保存した種類ごとの近似最近傍探索のインデックスを使う
+    # vector_storeを指定した場合は、モデルの隣に保存した精度を落とした文書ベクトル（なければ作る）で検索する
+    if self.vector_store:
+      engine = quantized_store.load_or_export(model, model_file, self.vector_store)
+    else:
+      engine = VectorSearchEngine.from_docvecs(model.docvecs)
+    # タグの種類ごとに連続した行に並べ替え、種類を指定した検索はその範囲だけを調べる
+    engine.group_by(tag_type)
+    if self.search_index == "ivf":
+      # 検索は種類を指定して行う（search_groups）ため、全体ではなく行数の多い種類ごとにインデックスを作る
+      ann_index.load_or_build_groups(model_file, engine)
+    return engine
+
+  def vectorize(self, loaded, results, words, outline_area = ""):
+    wordvecs = loaded.model.wv
+    docvecs = loaded.model.docvecs
     vectors = []
     for word in words:
       if word in docvecs:
@@ -67,7 +132,7 @@ class IpsjModel:
     print("OUTLINE: " + outline_area)
     if len(outline_area) > 0:
       lexemes = self.parse_text2(outline_area)
-      outlne_vector =  self.model.infer_vector(lexemes, alpha=0.1, min_alpha=0.0001, steps=5)
+      outlne_vector =  loaded.model.infer_vector(lexemes, alpha=0.1, min_alpha=0.0001, steps=5)
       results["input"].append(self.set_input_item("[outline]", outlne_vector))
       vectors.append(outlne_vector)
     return(vectors)
@@ -106,19 +171,21 @@ class IpsjModel:
       message += str(result_num) + " items of positive(" + positive_string + "), negative(" + negative_string + ")"
     return message
 
-  # Search similar words
+  # Select the model of this request (LoadedModel)
+  # モデルはキャッシュから取り出すだけで、self.model/self.engineは書き換えない（並行するリクエストに影響しない）
   def select_model(self, model_type):
     if model_type and len(model_type) > 0:
-      if not self.current_model == model_type:
-        self.current_model = model_type
-        self.model = self.load_model(self.models["model_" + model_type])
-    return(self.model)
+      return self.model_cache.get("model_" + model_type)
+    return self.model_cache.get(self.current_model)
 
   # Search similar words
-  def search(self, positive_words, negative_words, outline_area, output_types, model_type):
+  # search_mode: "vector" (cosine similarity over all doc vectors) or
+  #              "hybrid" (keyword prefilter, then cosine similarity of the candidates only)
+  # include_vectors: add "vector" (base64 of little-endian float16) to the input and result items
+  # The input and result items always have "x" and "y" (precomputed 2-D coordinates, see set_coordinates)
+  def search(self, positive_words, negative_words, outline_area, output_types, model_type, search_mode = "vector", include_vectors = False):
     max_count = 100
-    min_count = 20
-    model = self.select_model(model_type)
+    loaded = self.select_model(model_type)
 
     current_output = [self.output_types[type] for type in output_types]
     positive_words = shlex.split(positive_words.replace("　", " "))
@@ -126,21 +193,24 @@ class IpsjModel:
     # results = {"message": [], "data": [], "label": [], "title": [], "description": [], "similarity": [], "vector": []}
     results = {"message": [], "data": None, "input": []}
     try:
-      positive_vecs = self.vectorize(results, positive_words, outline_area)
-      negative_vecs = self.vectorize(results, negative_words)
+      positive_vecs = self.vectorize(loaded, results, positive_words, outline_area)
+      negative_vecs = self.vectorize(loaded, results, negative_words)
       #print(results["input"])
       #vecs = self.merge_vecs(positive_vecs, negative_vecs)
       #nominates = self.model.docvecs.similar_by_vector(vecs, topn=max_count)
       #print(positive_words)
       #print(negative_words)
       if len(positive_vecs) > 0 or len(negative_vecs) > 0:
-        results["data"] = self.get_result_items(current_output, positive_vecs, negative_vecs, max_count)
+        if search_mode == "hybrid":
+          results["data"] = self.get_hybrid_items(loaded, results, current_output, positive_words, positive_vecs, negative_vecs, max_count)
+        if results["data"] is None:
+          results["data"] = self.get_result_items(loaded, current_output, positive_vecs, negative_vecs, max_count)
+        self.set_coordinates(loaded, results, positive_vecs + negative_vecs)
+        if include_vectors:
+          docvecs = loaded.model.docvecs
+          self.set_vectors(results["input"], positive_vecs + negative_vecs)
+          self.set_vectors(results["data"], [docvecs[item["label"]] for item in results["data"]])
         result_num = len(results["data"])
-        if result_num < min_count:
-          extended_results = self.get_result_items_2(current_output, positive_vecs, negative_vecs, max_count)
-          results["data"].extend(extended_results)
-          results["data"] = self.unique_result(results["data"])
-          result_num = len(results["data"])
         results["message"].insert(0, self.construct_message(result_num, positive_words, negative_words, outline_area))
         results["rc"] = True
       else:
@@ -155,84 +225,111 @@ class IpsjModel:
     # print(results)
     return results
 
-  # 通常の方法で見つからなかった場合の処理
-  def get_result_items_2(self, current_output, positive_vecs, negative_vecs, max_count):
-    # print(current_output)
-    result_items = []
-    output_type_tags = {
-      "Y":   ["Y:1973", "Y:2017"],
-      "SIG": ["SIG", "SIG-end"]
-    }
-    for output_tag in current_output:
-      if output_tag in output_type_tags:
-        doctags =  self.model.docvecs.doctags
-        if not output_type_tags[output_tag][1] in doctags:
-          print("NG!!")
-        c_start = doctags[output_type_tags[output_tag][0]].offset
-        c_end = doctags[output_type_tags[output_tag][1]].offset
-        nominates =  self.model.docvecs.most_similar(positive=positive_vecs, negative=negative_vecs, topn=max_count, clip_start=c_start, clip_end=c_end)
-
-        for nominate in nominates:
-          similarity = nominate[1]
-          if similarity > 0.9999 and nominate[0][0:3] != "ID:":  # skip if the same vector
-              continue
-          result_item = self.set_result_item(nominate)
-          result_items.append(result_item)
-
-    return result_items
-
-  def unique_result(self, result_items):
-    # 重複の削除
-    result_uniq = []
-    for result_item in result_items:
-      if not result_item["label"] in [ item["label"] for item in result_uniq]:
-        result_uniq.append(result_item)
-        if not "similarity" in result_item:
-          print("ERROR: No similarity in result_item")
-          print(result_item)
-          quit()
-    return sorted(result_uniq, key=lambda item: -item["similarity"])
-
-  def get_result_items(self, current_output, positive_vecs, negative_vecs, max_count):
-    nominates = self.model.docvecs.most_similar(positive=positive_vecs, negative=negative_vecs, topn=max_count)
-    # nominates = self.model.docvecs.most_similar(positive=positive_words, negative=negative_words, topn=max_count)
-    # print(len(nominates))
+  # 検索対象の種類（P/O/SIG/Y/M/ID）の行だけを検索する
+  # 文書ベクトルは読み込み時に種類ごとに連続した行に並べてある（build_engine）ため、
+  # 種類ごとの範囲を検索するだけで、種類の中での正確な上位max_count件が求まる
+  def get_result_items(self, loaded, current_output, positive_vecs, negative_vecs, max_count):
+    # 入力と同じベクトル（入力した著者や研究会自身）は除くため、その数だけ多めに求める
+    topn = max_count + len(positive_vecs) + len(negative_vecs)
+    nominates = loaded.engine.most_similar(positive=positive_vecs, negative=negative_vecs, topn=topn, groups=current_output)
 
     result_items = []
     for nominate in nominates:
       similarity = nominate[1]
       if similarity > 0.9999 and nominate[0][0:3] != "ID:":  # skip if the same vector
         continue
-      current_elems = nominate[0].split(":")
-      item_type = current_elems[0]
-      if(item_type in current_output and len(current_elems) == 2):
-        result_item = self.set_result_item(nominate)
-        result_items.append(result_item)
+      result_item = self.set_result_item(loaded, nominate)
+      result_items.append(result_item)
+    return result_items[:max_count]
+
+  # キーワードの転置インデックスで候補を絞り込み、候補の文書ベクトルだけをコサイン類似度で採点する
+  # 候補は論文/記事（ID）の行だけのため、検索対象が論文/記事だけの場合に使う
+  # 他の種類（著者など）も検索対象にしている場合や、候補がない場合はNoneを返す（ベクトルで全ての種類を検索する）
+  def get_hybrid_items(self, loaded, results, current_output, positive_words, positive_vecs, negative_vecs, max_count):
+    if set(current_output) != {"ID"}:
+      results["message"].append("Hybrid: only for article output, searched all vectors")
+      return None
+    keyword_index, keyword_rows = self.get_keyword_index(loaded)
+    keyword_scores = keyword_index.scores(self.keyword_terms(positive_words))
+    candidates = np.flatnonzero((keyword_scores > 0.0) & (keyword_rows >= 0))
+    if len(candidates) == 0:
+      results["message"].append("Hybrid: no keyword match, searched all vectors")
+      return None
+    if len(candidates) > self.HYBRID_MAX_CANDIDATES:
+      best = np.argpartition(-keyword_scores[candidates], self.HYBRID_MAX_CANDIDATES - 1)
+      candidates = candidates[best[:self.HYBRID_MAX_CANDIDATES]]
+
+    engine = loaded.engine
+    query = engine.query_vector(positive_vecs, negative_vecs)
+    rows = keyword_rows[candidates]
+    similarities = engine.rows_scores(query[np.newaxis, :], rows)[0]
+    fused = self.HYBRID_VECTOR_WEIGHT * similarities + (1.0 - self.HYBRID_VECTOR_WEIGHT) * keyword_scores[candidates]
+    results["message"].append("Hybrid: scored %d of %d vectors (%.2f%%)" % (len(rows), len(engine), 100.0 * len(rows) / len(engine)))
+
+    result_items = []
+    for i in np.argsort(-fused)[:max_count]:
+      result_item = self.set_result_item(loaded, (engine.tags[rows[i]], float(fused[i])))
+      result_item["vector_similarity"] = float(similarities[i])
+      result_item["keyword_score"] = float(keyword_scores[candidates[i]])
+      result_items.append(result_item)
     return result_items
 
-  def set_result_item(self, nominate):
+  # キーワードの転置インデックス（本の語彙素と所在・出版社）と、その文書から検索エンジンの行への対応
+  # （複数のスレッドが同時に作った場合も同じ内容になるため、ロックはしない）
+  def get_keyword_index(self, loaded):
+    if self.keyword_index is None:
+      self.keyword_index = sparse_engine.load_or_build(self.KEYWORD_INDEX_PATH, "./json", self.KEYWORD_FIELDS)
+    keyword_rows = self.keyword_rows.get(loaded.path)
+    if keyword_rows is None:
+      tag_index = loaded.engine.tag_index
+      keyword_rows = np.array([tag_index.get(tag, -1) for tag in self.keyword_index.tags], dtype=np.int64)
+      self.keyword_rows[loaded.path] = keyword_rows
+    return self.keyword_index, keyword_rows
+
+  # 入力した単語（"P:著者"などの接頭辞を除いたものも）と、その語彙素
+  def keyword_terms(self, words):
+    terms = []
+    for word in words:
+      terms.append(word)
+      terms.append(word.split(":")[-1])
+      terms.extend(self.parse_text2(word))
+    return terms
+
+  def set_result_item(self, loaded, nominate):
       result_item = {}
       result_item["label"] = nominate[0]
-      doctags =  self.model.docvecs.doctags
+      doctags =  loaded.model.docvecs.doctags
       result_item["count"] = doctags[nominate[0]].doc_count
       explanation = self.get_explanation(nominate)
       result_item["title"] = explanation[0]
       result_item["similarity"] = explanation[1]
       result_item["description"] = explanation[2]
       result_item["data"] = nominate[1]
-      vec = list(self.model.docvecs[nominate[0]])
-      vec = [float(x) for x in vec]
-      result_item["vector"] = vec
       return result_item
 
   def set_input_item(self, word, vector):
       input_item = {}
       input_item["label"] = word
-      vec = list(vector)
-      vec = [float(x) for x in vec]
-      input_item["vector"] = vec
       return input_item
 
+  # 入力・結果の項目にベクトルを付ける（include_vectorsを指定した場合のみ）
+  # 要素ごとにfloatのリストに変換するとJSONが大きく（200次元×100件で約100KB）、変換にも時間がかかるため、
+  # float16（リトルエンディアン）のバイト列をbase64にした文字列にする（1件あたり約540文字）
+  def set_vectors(self, items, vectors):
+      for item, vector in zip(items, vectors):
+        item["vector"] = encode_vector(vector)
+
+  # 入力・結果の項目に2次元の座標（x, y）を付ける。画面ではベクトルを受け取ってt-SNEで配置する代わりにこれを使う
+  # 結果の座標は読み込み時に求めておいたもの、入力（単語や概要のベクトル）は同じ主成分に射影したもの
+  def set_coordinates(self, loaded, results, input_vecs):
+      items = results["input"] + results["data"]
+      coordinates = loaded.projection.coordinates_of([item["label"] for item in results["data"]])
+      if len(input_vecs) > 0:
+        coordinates = np.vstack([loaded.projection.transform(np.array(input_vecs)), coordinates])
+      for item, (x, y) in zip(items, coordinates):
+        item["x"] = round(float(x), 4)
+        item["y"] = round(float(y), 4)
+
   # Search similar words
   def search_words(self, word_string):
     count = 10
@@ -263,17 +360,13 @@ class IpsjModel:
   def search_docs(self, doc_string):
     docs = shlex.split(doc_string)
     count = 10
-    max_count = 1000
     doc = docs[0]
     results = {"message": "", "data": [], "label": [], "title": [], "description": []}
     try:
       print([doc])
-      nominates = self.model.docvecs.most_similar(positive=[doc], topn=max_count)
-      words = doc.split(":")
-      nominates = [x for x in nominates if(str(x[0]).find(words[0]) == 0)]
+      # 入力と同じ種類のタグだけを検索する
+      nominates = self.engine.most_similar(positive=[doc], topn=count, groups=[tag_type(doc)])
       print(len(nominates))
-      if len(nominates) > count:
-        nominates = nominates[0:count]
       for (i, item) in enumerate(nominates):
         if(i == 0):
           results["message"] = "Most similar " + str(len(nominates)) + " categories of " + doc
@@ -318,16 +411,19 @@ class IpsjModel:
     return explanation
 
   # Search similar studies of specified paper absstruct
-  def search_paper(self, description):
+  # mode: "infer" (gensim infer_vector) or "fast" (IDF-weighted average of word vectors)
+  def search_paper(self, description, mode = "infer"):
     lexemes = self.parse_text2(description)
-    vector =  self.model.infer_vector(lexemes, alpha=0.1, min_alpha=0.0001, steps=5)
-    doctags =  self.model.docvecs.doctags
+    loaded = self.select_model(None)
+    vector = fast_infer.infer_vector(loaded.model, lexemes, mode, alpha=0.1, min_alpha=0.0001, steps=5)
+    doctags =  loaded.model.docvecs.doctags
     #print(doctags["SIG"])
     #print(doctags["SIG-end"])
     #c_start = doctags["SIG"].offset
     #c_end = doctags["SIG-end"].offset
     # nominates =  self.model.docvecs.most_similar(positive=[vector], topn=20, clip_start=c_start, clip_end=c_end)
-    nominates =  self.model.docvecs.most_similar(positive=[vector], topn=20, clip_start=0, clip_end=None)
+    # 全ての種類の範囲を検索してまとめる（ivfの場合は種類ごとのインデックスを使う）
+    nominates =  loaded.engine.search_groups(vector, list(loaded.engine.groups), topn=20)
     results = {"message": "", "data": [], "label": [], "title": [], "description": []}
     for (i, item) in enumerate(nominates):
       if(i == 0):
@@ -348,26 +444,19 @@ class IpsjModel:
 
   # Parse text using MeCab
   def parse_text2(self, text):
-    if not text:
-      return [];
-    text = self.concat_text(text)
-    mt = MeCab.Tagger('mecab-ipadic-neologd')
-    # print(text)
-    lines = mt.parse(text).split("\n")
-    # print(lines)
-    lexemes = []
-    for line in lines:
-      print(line)
-      if line == "EOS" or line == "":
-        continue
-      words = re.split(r"[,\t]", line)
-      if words[7][0:5] == "代表表記：":
-        lexemes.append(words[7][6:])
-      elif words[5] != "*":
-        lexemes.append(words[5])
-      else:
-        lexemes.append(words[0])
-    return lexemes
+    return tokenizer.parse_base_forms(self.concat_text(text))
+
+# Vector as base64 of little-endian float16 (decode: np.frombuffer(base64.b64decode(s), "<f2"))
+def encode_vector(vector):
+  return base64.b64encode(np.asarray(vector, dtype="<f2").tobytes()).decode("ascii")
+
+# Type of a doc tag ("P:name" -> "P", "ID:123" -> "ID"), None for tags without a type
+# (e.g. "SIG", "SIG-end" in 0_dummy.json)
+def tag_type(tag):
+  elems = str(tag).split(":")
+  if len(elems) == 2:
+    return elems[0]
+  return None
 
 # Main procedure
 def main_proc(options, argv):
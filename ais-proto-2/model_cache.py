@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# coding: UTF-8
+
+import threading
+from collections import OrderedDict, namedtuple
+
+# 読み込み済みのモデルと検索エンジン（と文書ベクトルの2次元の座標）の組。リクエストの間は同じものを使い続ける（書き換えない）
+LoadedModel = namedtuple("LoadedModel", ["name", "path", "model", "engine", "projection", "nbytes"])
+
+# 名前付きのモデル（model_dm, model_dbowなど）を読み込んだまま保持するLRUキャッシュ
+# 以前はmodel_typeが変わるたびにディスクから読み込み直し、IpsjModelのmodel/engineを書き換えていた
+# ・保持するモデル数（max_models）と合計の配列サイズ（max_bytes）を超えたら、最後に使われたのが古いものから捨てる
+# ・同じモデルを複数のスレッドが同時に読み込まないよう、モデルごとのロックで読み込む
+# ・読み込み回数・ヒット数・破棄数を数える（stats()）
+class ModelCache:
+  def __init__(self, loader, max_models = 2, max_bytes = None):
+    self.loader = loader  # loader(name) -> LoadedModel
+    self.max_models = max_models
+    self.max_bytes = max_bytes
+    self._models = OrderedDict()
+    self._lock = threading.Lock()
+    self._loading_locks = {}
+    self._counters = {"loads": 0, "hits": 0, "evictions": 0}
+
+  # count = Falseの場合はヒット数に数えない（既定のモデルの属性を読むだけの場合など）
+  def get(self, name, count = True):
+    with self._lock:
+      loaded = self._models.get(name)
+      if loaded is not None:
+        self._models.move_to_end(name)
+        if count:
+          self._counters["hits"] += 1
+        return loaded
+      loading_lock = self._loading_locks.setdefault(name, threading.Lock())
+
+    with loading_lock:
+      # 他のスレッドが先に読み込んでいる可能性があるため、ロック内で再確認する
+      with self._lock:
+        loaded = self._models.get(name)
+        if loaded is not None:
+          self._models.move_to_end(name)
+          if count:
+            self._counters["hits"] += 1
+          return loaded
+      loaded = self.loader(name)
+      with self._lock:
+        self._models[name] = loaded
+        self._counters["loads"] += 1
+        self._evict()
+    return loaded
+
+  def stats(self):
+    with self._lock:
+      stats = dict(self._counters)
+      stats["models"] = list(self._models)
+      stats["bytes"] = sum(loaded.nbytes for loaded in self._models.values())
+    return stats
+
+  def _evict(self):
+    # 捨てたモデルも、それを使っている最中のリクエストが終わるまでは参照が残るため、そのまま使える
+    while len(self._models) > 1:
+      total_bytes = sum(loaded.nbytes for loaded in self._models.values())
+      over_count = self.max_models is not None and len(self._models) > self.max_models
+      over_bytes = self.max_bytes is not None and total_bytes > self.max_bytes
+      if not (over_count or over_bytes):
+        break
+      name = next(iter(self._models))
+      del self._models[name]
+      self._counters["evictions"] += 1
+      print("### evicted model %s" % name)
@@ -2,15 +2,16 @@
 # coding: UTF-8
 
 import sys
-import re
 import json
-import MeCab
 import pandas as pd
 import glob
 import pprint
 from get_google_biblio_data import get_biblio_isbns
 from get_google_biblio_data import get_df_biblio
 
+import repo_root  # api/をimportできるようにする
+from api.utils.tokenizer import parse_text
+
 # Main procedure
 def main(argv):
     biblio_dir = "./google_biblio_data"  
@@ -76,36 +77,15 @@ def get_biblio_string(biblio_info, col_name):
 
 def get_segmented_text(book_summary):
     # 単語分割している
-    mecab_tag = MeCab.Tagger('mecab-ipadic-neologd')
     lexemes = []
     for item_summary in book_summary["items"]:
         # 分割された単語＝語彙素に分ける
         if "description" in item_summary:
-            lexemes += parse_text(item_summary["description"], mecab_tag)
+            lexemes += parse_text(item_summary["description"])
         else:
-            lexemes += parse_text(item_summary["title"], mecab_tag)
+            lexemes += parse_text(item_summary["title"])
             if "subtitle" in item_summary:
-                lexemes += parse_text(item_summary["subtitle"], mecab_tag)
-    return lexemes
-
-def parse_text(text, mecab_tag):
-    lexemes = []
-    text = text.replace("　", " ")
-    for line in mecab_tag.parse(text).split("\n"):
-        # print(line)
-        if line == "EOS" or line == "":
-            continue
-        words = re.split(r"[,\t]", line)
-        #print(words)
-        # 助詞が重要ではない
-        if words[2] == "サ変接続" and words[7] == "*":
-            pass # print("zz " + line)
-        elif words[2] == "記号" or words[1] == "記号":
-            pass
-        elif words[1] == "助詞":
-            pass
-        else:
-            lexemes.append(words[0])
+                lexemes += parse_text(item_summary["subtitle"])
     return lexemes
 
 def get_book_summary(filename):
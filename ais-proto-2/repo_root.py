@@ -0,0 +1,12 @@
+#!/usr/bin/python
+# coding: UTF-8
+
+# api/配下の共通モジュール（検索エンジン、形態素解析など）を使うため、リポジトリのルートをパスに追加する
+# ais-proto-2のスクリプトは、apiをimportする前にこのモジュールをimportする（import repo_root）
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+if ROOT not in sys.path:
+  sys.path.append(ROOT)
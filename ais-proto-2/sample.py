@@ -10,7 +10,6 @@ import glob
 import collections
 import pandas as pd
 import requests
-import MeCab
 #import mojimoji
 import re
 import html
@@ -20,6 +19,9 @@ import datetime
 import os
 import time
 
+import repo_root  # api/をimportできるようにする
+from api.utils import tokenizer
+
 # Main procedure
 def main(argv):
   root_dir = "./xml"
@@ -88,7 +90,7 @@ def get_text2(tag):
 def generate_random_string():
   return ["*" + ''.join([random.choice(string.ascii_letters + string.digits) for i in range(10)]) for j in range(100)]
 
-def convert_json(file, index_hash, mecab_tag):
+def convert_json(file, index_hash):
   xml_f = open(file, 'r')
   xml_content = xml_f.read()
   xml_f.close()
@@ -107,7 +109,7 @@ def convert_json(file, index_hash, mecab_tag):
         info["description"] = get_text(record_body, "description")
         info["index"] = str(index_hash.ix[info["set"], "StringIndex"])
         info["keywords"] = get_keywords(info, record_body)
-        info["lexemes"] = parse_text(info, mecab_tag)
+        info["lexemes"] = parse_text(info)
         puts_json(info)
 
 def get_keywords(info, record_body):
@@ -138,10 +140,10 @@ def add_keywords(keywords, record_body, key_name, prefix):
     nominate = prefix + re.sub(r",\s*", "", nominates)
     keywords.append(nominate)
 
-def parse_text(info, mecab_tag):
+def parse_text(info):
   lexemes = []
-  lexemes += parse_text2(info["title"], mecab_tag)
-  lexemes += parse_text2(info["description"], mecab_tag)
+  lexemes += parse_text2(info["title"])
+  lexemes += parse_text2(info["description"])
   return lexemes
 
 def concat_text(item):
@@ -150,33 +152,13 @@ def concat_text(item):
   else:
     return item
 
-def parse_text2(text, mecab_tag):
+def parse_text2(text):
   if not text:
     return [];
   #text = mojimoji.han_to_zen(concat_text(text), digit=False)
   #text = mojimoji.zen_to_han(text, kana=False, ascii=False)
-  text = concat_text(text).replace("　", " ")
-  # print(text)
-  lines = mecab_tag.parse(text).split("\n")
-  # print(lines)
-  lexemes = []
-  for line in lines:
-    # print(line)
-    if line == "EOS" or line == "":
-      continue
-    words = re.split(r"[,\t]", line)
-    if words[2] == "サ変接続" and words[7] == "*":
-      pass # print("zz " + line)
-    elif words[2] == "記号" or words[1] == "記号":
-      pass
-    #elif words[7][0:5] == "代表表記：":
-    #  lexemes.append(words[7][6:])
-    #elif words[5] != "*":
-    #  lexemes.append(words[5])
-    else:
-      lexemes.append(words[0])
-  # print(lexemes)
-  return lexemes
+  # 助詞は残す
+  return tokenizer.parse_text(concat_text(text), drop_particles=False)
 
 # 解析結果をJSON出力
 def puts_json(info):
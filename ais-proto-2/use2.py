@@ -12,16 +12,17 @@ import readline
 import re
 import shlex
 from optparse import OptionParser
-import MeCab
 import json
 
+import repo_root  # api/をimportできるようにする
+from api.utils.tokenizer import parse_text
+
 # Main procedure
 def main_proc(options, argv):
 
   # random.seed(options.random_seed)
   model = Doc2Vec.load(options.model_file)
   
-  mt = MeCab.Tagger('mecab-ipadic-neologd')
   text = "ダークネットでは，DDoS 攻撃，DNS アンプ攻撃などの大規模な攻撃を行うための事前活動や新しいマルウェアの出現によるスキャン活動などのトラフィックが観測される事例が数多く報告されている．また，近年，官公庁・政府機関・企業などを狙った標的型攻撃や新たな攻撃手法である水飲み場型攻撃などのサイバー攻撃は，今まで以上に高度化・巧妙化している．本論文においては，日本における NICTER と世界規模の NORSE，二つのダークネット観測網のトラフィックデータの相関分析を行い，両者のダークネットトラフィックに相関関係があることがわかった．"
   text = "米ファイザーが、開発中の新型コロナウイルスの飲み薬について言及した重症化リスクを9割低減させたとする最終試験結果を公表また、「オミクロン株に対しても有効性が維持できる可能性がある」とした"
   text = ""
@@ -33,7 +34,7 @@ def main_proc(options, argv):
   text = "イギリス王室に使える身として大陸に単身赴任し、もう何カ月も家族の顔も見ることが"
   text = "消される天安門事件の記憶。香港の大学、親中派が圧力。香港の大学で、民主化を求める学生らが北京で武力弾圧された1989年の天安門事件"
  
-  lexemes = parse_text(text, mt)
+  lexemes = parse_text(text)
   print(lexemes)
  
   # モデルを使うときではなく、新しい文章のベクトルを図るもの
@@ -58,26 +59,6 @@ def main_proc(options, argv):
   
   # atexit.register(readline.write_history_file, histfile)
 
-def parse_text(text, mecab_tag):
-    lexemes = []
-    text = text.replace("　", " ")
-    for line in mecab_tag.parse(text).split("\n"):
-        # print(line)
-        if line == "EOS" or line == "":
-            continue
-        words = re.split(r"[,\t]", line)
-        #print(words)
-        # 助詞が重要ではない
-        if words[2] == "サ変接続" and words[7] == "*":
-            pass # print("zz " + line)
-        elif words[2] == "記号" or words[1] == "記号":
-            pass
-        elif words[1] == "助詞":
-            pass
-        else:
-            lexemes.append(words[0])
-    return lexemes
-
 # Get explanation from JSON text (out of Doc2Vec model)
 def get_explanation(nominate):
   print(nominate)
@@ -0,0 +1,89 @@
+# 近似最近傍探索（IVF）インデックスのベンチマーク
+# 完全一致のコサイン類似度検索に対する recall@k と、1クエリあたりの検索時間（p50/p99）を計測する
+# $ python -m api.benchmarks.ann_search --sizes 10000 100000 1000000
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from api.doc2vec.ann_index import IvfIndex
+from api.doc2vec.search_engine import VectorSearchEngine, normalize_rows
+
+
+def make_vectors(count, dim, seed):
+    # 実際の文書ベクトルに近づけるため、いくつかの話題（クラスタ）の周りに散らばるベクトルを作る
+    random = np.random.RandomState(seed)
+    topics = random.randn(max(1, count // 1000), dim).astype(np.float32)
+    vectors = topics[random.randint(0, len(topics), count)]
+    vectors += 0.8 * random.randn(count, dim).astype(np.float32)
+    return vectors
+
+
+def percentile_ms(latencies, q):
+    return float(np.percentile(latencies, q)) * 1000
+
+
+def run(count, args):
+    vectors = make_vectors(count, args.dim, args.seed)
+    tags = ["ID:%d" % i for i in range(count)]
+    engine = VectorSearchEngine(tags, vectors)
+    # クエリは登録済みのベクトルに少しノイズを加えたもの
+    random = np.random.RandomState(args.seed + 1)
+    queries = normalize_rows(
+        vectors[random.choice(count, args.queries)]
+        + 0.3 * random.randn(args.queries, args.dim).astype(np.float32)
+    )
+
+    started = time.perf_counter()
+    index = IvfIndex.build(engine, nprobe=args.nprobe)
+    build_seconds = time.perf_counter() - started
+
+    exact_latencies = []
+    exact_results = []
+    for query in queries:
+        started = time.perf_counter()
+        exact_results.append(engine.search(query, args.topn, exact=True))
+        exact_latencies.append(time.perf_counter() - started)
+
+    engine.attach_index(index)
+    ann_latencies = []
+    hits = 0
+    for query, expected in zip(queries, exact_results):
+        started = time.perf_counter()
+        found = engine.search(query, args.topn)
+        ann_latencies.append(time.perf_counter() - started)
+        hits += len({tag for tag, _ in found} & {tag for tag, _ in expected})
+
+    print(
+        "%9d vectors | nlist=%5d nprobe=%3d build=%6.1fs | recall@%d=%.3f | "
+        "exact p50=%7.2fms p99=%7.2fms | ivf p50=%7.2fms p99=%7.2fms"
+        % (
+            count,
+            index.nlist,
+            args.nprobe,
+            build_seconds,
+            args.topn,
+            hits / (len(queries) * args.topn),
+            percentile_ms(exact_latencies, 50),
+            percentile_ms(exact_latencies, 99),
+            percentile_ms(ann_latencies, 50),
+            percentile_ms(ann_latencies, 99),
+        )
+    )
+
+
+def parse_args():
+    parser = ArgumentParser(description="recall/latency benchmark of the IVF doc vector index")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--dim", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--topn", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    for count in args.sizes:
+        run(count, args)
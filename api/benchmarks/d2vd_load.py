@@ -0,0 +1,104 @@
+# d2vd（ais-proto-2/d2vd.py）の負荷試験
+# 起動済みのd2vdに、同時に複数のクライアントから/search_wordsと/newpaperのリクエストを送り、
+# 同時接続数ごとのスループット（req/s）・レイテンシ（p50/p95）・受信したバイト数を表示する
+# --server wsgiref（1スレッド）と --server threaded / gunicorn の違いを比べるのに使う
+# エラーになったリクエストがあった場合は終了コード1で終わる
+# $ python d2vd.py --model d2v_ipsj_desc --server threaded --workers 8  （ais-proto-2で起動しておく）
+# $ python -m api.benchmarks.d2vd_load --url http://localhost:57007 --concurrency 1 4 16
+import gzip
+import sys
+import time
+import urllib.parse
+import urllib.request
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+WORDS = ["機械学習", "深層学習", "自然言語処理", "画像認識", "データベース", "ネットワーク", "セキュリティ"]
+DESCRIPTIONS = [
+    "本研究では深層学習を用いた文書分類の手法を提案し、評価実験によりその有効性を示す。",
+    "分散データベースにおけるトランザクション処理の性能を改善する手法について述べる。",
+]
+
+
+def make_urls(base_url, count, newpaper_ratio, seed):
+    # /search_wordsと/newpaperを、newpaper_ratioの割合で混ぜたリクエストのURL
+    random = np.random.RandomState(seed)
+    urls = []
+    for _ in range(count):
+        if random.random_sample() < newpaper_ratio:
+            description = DESCRIPTIONS[random.randint(len(DESCRIPTIONS))]
+            urls.append(base_url + "/newpaper/" + urllib.parse.quote(description))
+        else:
+            words = random.choice(WORDS, size=2, replace=False)
+            query = urllib.parse.urlencode({"positive_words": " ".join(words), "negative_words": ""})
+            urls.append(base_url + "/search_words?" + query)
+    return urls
+
+
+def fetch(url, accept_gzip, timeout):
+    headers = {"Accept-Encoding": "gzip"} if accept_gzip else {}
+    started = time.perf_counter()
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout) as r:
+        body = r.read()
+        if r.headers.get("Content-Encoding") == "gzip":
+            gzip.decompress(body)
+    return time.perf_counter() - started, len(body)
+
+
+def run(urls, concurrency, accept_gzip, timeout):
+    latencies = []
+    received = 0
+    errors = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(fetch, url, accept_gzip, timeout) for url in urls]
+        for future in futures:
+            try:
+                latency, size = future.result()
+            except Exception as e:
+                errors += 1
+                print("### request failed: %s" % e)
+                continue
+            latencies.append(latency)
+            received += size
+    elapsed = time.perf_counter() - started
+    return latencies, received, errors, elapsed
+
+
+def parse_args():
+    parser = ArgumentParser(description="concurrent load test for d2vd (/search_words, /newpaper)")
+    parser.add_argument("--url", default="http://localhost:57007")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--newpaper-ratio", dest="newpaper_ratio", type=float, default=0.2)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    urls = make_urls(args.url.rstrip("/"), args.requests, args.newpaper_ratio, args.seed)
+    failed = False
+    for concurrency in args.concurrency:
+        for accept_gzip in (False, True):
+            latencies, received, errors, elapsed = run(urls, concurrency, accept_gzip, args.timeout)
+            failed = failed or errors > 0
+            p50, p95 = np.percentile(latencies, [50, 95]) * 1000 if latencies else (0.0, 0.0)
+            print(
+                "### concurrency %2d, gzip %-5s: %.1f req/s, p50 %.1f ms, p95 %.1f ms, "
+                "%.1f KB/request, %d errors"
+                % (
+                    concurrency,
+                    accept_gzip,
+                    len(latencies) / elapsed,
+                    p50,
+                    p95,
+                    received / max(len(latencies), 1) / 1024,
+                    errors,
+                )
+            )
+    if failed:
+        sys.exit(1)
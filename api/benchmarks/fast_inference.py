@@ -0,0 +1,79 @@
+# 推論方法（infer_vector / 単語ベクトルの平均）のベンチマーク
+# 同じニュースの語彙素から両方の方法でベクトルを求め、
+# ・1件あたりの推論時間
+# ・推論したベクトルで検索した上位topn件の一致率（infer_vectorの結果との重なりと、1位の一致率）
+# を表示する。ニュースはデモ用のニュース、または --news で指定したスナップショット（*.json/*.jsonl.gz）を使う
+# $ python -m api.benchmarks.fast_inference --topn 10 --repeat 5
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+import api.crawling.get_from_s3 as crawling
+import api.doc2vec.predict_similar_book as doc2vec
+from api.crawling.news_snapshot import load_news_file
+from api.doc2vec import fast_infer
+from api.doc2vec import model_registry
+from api.utils import tokenizer
+
+
+def load_lexemes(news_path):
+    if news_path:
+        news_data = load_news_file(news_path)
+        news_list = crawling.convert_news_to_correct_schema(news_data, len(news_data), "")
+    else:
+        news_list = crawling.make_news_for_demo()
+    lexemes_list = [
+        tokenizer.parse_text(news["title"] + news["summary"])[: doc2vec.MAX_LEXEMES]
+        for news in news_list
+    ]
+    return [lexemes for lexemes in lexemes_list if lexemes]
+
+
+def infer_all(model, lexemes_list, mode, repeat):
+    # repeat回のうち最も速かった時間で比べる（初回のfastは単語ベクトルの正規化を含むため除く）
+    params = doc2vec.infer_vector_params()
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        vectors = [fast_infer.infer_vector(model, lexemes, mode, **params) for lexemes in lexemes_list]
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return np.array(vectors), best
+
+
+def parse_args():
+    parser = ArgumentParser(description="infer_vector vs IDF-weighted word vector average")
+    parser.add_argument("--news", default=None, help="news snapshot file (default: demo news)")
+    parser.add_argument("--topn", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    model = model_registry.get_model()
+    engine = model_registry.get_search_engine()
+    lexemes_list = load_lexemes(args.news)
+    fast_infer.get_encoder(model)
+
+    results = {}
+    for mode in fast_infer.MODES:
+        vectors, seconds = infer_all(model, lexemes_list, mode, args.repeat)
+        results[mode] = engine.search(vectors, topn=args.topn)
+        print(
+            "### %-5s %d news: %.2f ms/news"
+            % (mode, len(lexemes_list), seconds / len(lexemes_list) * 1000)
+        )
+
+    overlaps = []
+    top1 = []
+    for expected_row, actual_row in zip(results["infer"], results["fast"]):
+        expected_tags = [tag for tag, _ in expected_row]
+        actual_tags = [tag for tag, _ in actual_row]
+        overlaps.append(len(set(expected_tags) & set(actual_tags)) / len(expected_tags))
+        top1.append(expected_tags[0] == actual_tags[0])
+    print(
+        "### fast vs infer: overlap@%d %.3f, top1 %.3f"
+        % (args.topn, float(np.mean(overlaps)), float(np.mean(top1)))
+    )
@@ -0,0 +1,83 @@
+# ais-proto-2のハイブリッド検索（search_mode="hybrid"）の確認
+# 一時ディレクトリに小さなDoc2Vecモデル（論文/記事ID:と著者P:のタグ）とjson/id_*.jsonを作り、IpsjModel.searchで
+# ・検索対象が論文/記事だけの場合は、キーワードで絞り込んだ候補（keyword_scoreを持つ結果）を返すこと
+# ・論文/記事と著者など複数の種類を検索対象にした場合は、著者の結果も返すこと（論文/記事だけにならないこと）
+# を確かめ、満たさない場合は終了コード1で終了する（gensimが必要）
+# $ python -m api.benchmarks.hybrid_output_check
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+AIS_PROTO_DIR = os.path.join(REPO_ROOT, "ais-proto-2")
+MODEL_NAME = "d2v_check"
+# MeCabで分割されない（語彙素がそのままの形になる）語
+WORDS = "経済 政治 歴史 科学 文学 音楽 宇宙 医学 数学 哲学 料理 旅行 写真 映画 建築 法律".split()
+
+
+def make_corpus(books, authors, seed):
+    # 本ごとに、ランダムな語と著者ごとに決まった語から説明文を作る（著者のタグも同じ文書に付ける）
+    random = np.random.RandomState(seed)
+    corpus = []
+    for i in range(books):
+        author = "著者%d" % (i % authors)
+        words = [WORDS[j] for j in random.randint(0, len(WORDS), 20)] + [WORDS[i % authors]] * 5
+        corpus.append(("%d" % i, author, words))
+    return corpus
+
+
+def write_files(directory, corpus):
+    from gensim.models.doc2vec import Doc2Vec, TaggedDocument
+
+    os.makedirs(os.path.join(directory, "json"))
+    for isbn, author, words in corpus:
+        with open(os.path.join(directory, "json", "id_%s.json" % isbn), "w", encoding="utf-8") as f:
+            json.dump({"title": "book " + isbn, "keywords": ["P:" + author], "lexemes": words}, f)
+    documents = [TaggedDocument(words, ["ID:" + isbn, "P:" + author]) for isbn, author, words in corpus]
+    for dm in (0, 1):
+        model = Doc2Vec(documents, dm=dm, vector_size=16, min_count=1, epochs=5, workers=1, seed=1)
+        model.save(os.path.join(directory, "%s_%d.model" % (MODEL_NAME, dm)))
+
+
+def search(model, output_types):
+    return model.search(WORDS[0] + " " + WORDS[1], "", "", output_types, "", search_mode="hybrid")
+
+
+def check(directory):
+    sys.path.insert(0, AIS_PROTO_DIR)
+    from ipsj_model import IpsjModel
+
+    # モデル・json・キーワードのインデックスは作業ディレクトリからの相対パスで読み書きする
+    os.chdir(directory)
+    model = IpsjModel(MODEL_NAME)
+    failures = []
+
+    results = search(model, ["article"])
+    labels = [item["label"] for item in results["data"]]
+    if not results["rc"] or not labels or not all("keyword_score" in item for item in results["data"]):
+        failures.append("article only: expected keyword-filtered results, got %s" % results["message"])
+    if any(not label.startswith("ID:") for label in labels):
+        failures.append("article only: unexpected labels %s" % labels[:5])
+
+    results = search(model, ["article", "author"])
+    labels = [item["label"] for item in results["data"]]
+    if not any(label.startswith("P:") for label in labels):
+        failures.append("article + author: no author results %s" % labels[:5])
+    if not any(label.startswith("ID:") for label in labels):
+        failures.append("article + author: no article results %s" % labels[:5])
+    return failures
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        write_files(directory, make_corpus(books=200, authors=10, seed=0))
+        failures = check(directory)
+        os.chdir(REPO_ROOT)
+    for failure in failures:
+        print("### " + failure)
+    print("### hybrid output: %s" % ("FAILED" if failures else "ok"))
+    if failures:
+        sys.exit(1)
@@ -0,0 +1,114 @@
+# APIの起動時のimport時間のベンチマーク
+# python -X importtime でモジュールを新しいプロセスで何回かimportし、累積時間の中央値と遅いモジュールを表示する
+# 以下の場合は終了コード1で終わる（CIや手元で起動の遅れに気づけるようにする）
+# ・gensim, MeCab, boto3などの重いモジュールがimportの時点で読み込まれている
+# ・累積時間の中央値が --budget-ms を超えている
+# ・--baseline で保存した前回の結果より --tolerance 以上遅くなっている
+# $ python -m api.benchmarks.import_time --module api.main --repeat 5 --budget-ms 1500
+import json
+import os
+import statistics
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+# 最初に使うときやモデルの読み込み時にimportするモジュール（起動時に読み込まれてはいけない）
+LAZY_MODULES = [
+    "gensim",
+    "MeCab",
+    "boto3",
+    "botocore",
+    "readline",
+    "optparse",
+    "firebase_admin",
+    "smart_open",
+    "scipy",
+]
+REPOSITORY_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+
+
+def measure(module):
+    # 1回分の (累積時間[us], {モジュール名: 累積時間[us]}) を返す
+    # インタプリタの起動時に読み込まれるモジュール（siteなど）は除く
+    cumulative = importtime(f"import {module}")
+    for name in importtime("pass"):
+        cumulative.pop(name, None)
+    return cumulative[module], cumulative
+
+
+def importtime(statement):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=REPOSITORY_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{statement} failed:\n{result.stderr[-2000:]}")
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        # "import time:  self [us] | cumulative | imported package"（名前の前の空白は入れ子の深さ）
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        cumulative[name.strip()] = int(cumulative_us)
+    return cumulative
+
+
+def parse_args():
+    parser = ArgumentParser(description="import time of the API entry point")
+    parser.add_argument("--module", default="api.main")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget-ms", dest="budget_ms", type=float, default=None)
+    parser.add_argument("--baseline", default=None, help="json file written by --save-baseline")
+    parser.add_argument("--save-baseline", dest="save_baseline", default=None)
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline"
+    )
+    parser.add_argument("--top", type=int, default=15)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    totals = []
+    for _ in range(args.repeat):
+        total, cumulative = measure(args.module)
+        totals.append(total)
+    median_ms = statistics.median(totals) / 1000
+    print(
+        "import %s: median %.1f ms (%s)"
+        % (args.module, median_ms, ", ".join("%.1f" % (total / 1000) for total in totals))
+    )
+
+    print("slowest modules (cumulative, last run):")
+    for name, us in sorted(cumulative.items(), key=lambda item: -item[1])[: args.top]:
+        print("  %8.1f ms  %s" % (us / 1000, name))
+
+    ok = True
+    loaded = sorted(name for name in cumulative if name.split(".")[0] in LAZY_MODULES)
+    if loaded:
+        print("FAIL: imported at startup: %s" % ", ".join(loaded[: args.top]))
+        ok = False
+    if args.budget_ms is not None and median_ms > args.budget_ms:
+        print("FAIL: %.1f ms exceeds the budget of %.1f ms" % (median_ms, args.budget_ms))
+        ok = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline_ms = json.load(f)[args.module]
+        if median_ms > baseline_ms * (1 + args.tolerance):
+            print(
+                "FAIL: %.1f ms is slower than the baseline %.1f ms by more than %d%%"
+                % (median_ms, baseline_ms, args.tolerance * 100)
+            )
+            ok = False
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.save_baseline):
+            with open(args.save_baseline) as f:
+                baseline = json.load(f)
+        baseline[args.module] = median_ms
+        with open(args.save_baseline, "w") as f:
+            json.dump(baseline, f, indent=4)
+    print("OK" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,133 @@
+# ベンチマーク・動作確認用のローカルのS3の代わり
+# get_from_s3が使うboto3のS3クライアントのメソッド（get_object, put_object, list_objects_v2）だけを実装する
+# list_objects_v2はDelimiterを指定するとS3と同じくCommonPrefixesでまとめて返し、StartAfterより後のキーだけを返す
+# rootを指定した場合はオブジェクトをファイルとして保存し、get_objectではファイルをストリームで読む
+import io
+import os
+import time
+from types import SimpleNamespace
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class LocalBody:
+    # botocoreのStreamingBodyと同じく、少しずつ読み出せるbody
+    def __init__(self, stream):
+        self._stream = stream
+
+    def read(self, amt=None):
+        return self._stream.read() if amt is None else self._stream.read(amt)
+
+    def iter_chunks(self, chunk_size=1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self._stream.close()
+
+
+class LocalS3Client:
+    # boto3のクライアントと同じく、client.exceptions.NoSuchKeyで捕まえられるようにする
+    exceptions = SimpleNamespace(NoSuchKey=NoSuchKey)
+
+    def __init__(self, root=None, latency=0.0):
+        # latency: 1回の呼び出しにかかる時間（秒）。ネットワークの往復時間の代わり
+        self.root = root
+        self.latency = latency
+        # key -> (本体のbytesまたはファイルパス, LastModified)
+        self.objects = {}
+        self.calls = Counter()
+        self._sorted_keys = None
+
+    def put_object(self, Bucket, Key, Body, LastModified=None, **kwargs):
+        self.calls["put_object"] += 1
+        if hasattr(Body, "read"):
+            Body = Body.read()
+        if self.root:
+            path = os.path.join(self.root, Bucket, Key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(Body)
+            Body = path
+        self.objects[Key] = (Body, LastModified or datetime.now(timezone.utc))
+        self._sorted_keys = None
+        return {}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self.calls["get_object"] += 1
+        time.sleep(self.latency)
+        if Key not in self.objects:
+            raise NoSuchKey(Key)
+        body, _ = self.objects[Key]
+        stream = open(body, "rb") if self.root else io.BytesIO(body)
+        return {"Body": LocalBody(stream)}
+
+    def list_objects_v2(
+        self,
+        Bucket,
+        Prefix="",
+        ContinuationToken=None,
+        MaxKeys=1000,
+        Delimiter=None,
+        StartAfter="",
+        **kwargs
+    ):
+        self.calls["list_objects_v2"] += 1
+        time.sleep(self.latency)
+        if self._sorted_keys is None:
+            self._sorted_keys = sorted(self.objects)
+        keys = []
+        for key in self._sorted_keys:
+            if not key.startswith(Prefix) or key <= StartAfter:
+                continue
+            if Delimiter and Delimiter in key[len(Prefix):]:
+                # 区切り文字までを接頭辞としてまとめる
+                key = key[: key.index(Delimiter, len(Prefix)) + len(Delimiter)]
+                if keys and keys[-1] == key:
+                    continue
+            keys.append(key)
+        start = int(ContinuationToken or 0)
+        page = keys[start:start + MaxKeys]
+        response = {
+            "Contents": [
+                {"Key": key, "LastModified": self.objects[key][1], "Size": 0}
+                for key in page
+                if key in self.objects
+            ],
+            "CommonPrefixes": [{"Prefix": key} for key in page if key not in self.objects],
+            "KeyCount": len(page),
+            "IsTruncated": start + MaxKeys < len(keys),
+        }
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = str(start + MaxKeys)
+        return response
+
+
+def fill_news_objects(client, bucket, count, body=b"{}"):
+    # count個のニュースのオブジェクトを作る。キーの順と更新日時の順は一致しない
+    base = datetime(2022, 1, 1, tzinfo=timezone.utc)
+    newest_key = None
+    for i in range(count):
+        key = "news_%08d.json" % ((i * 7919) % count)
+        client.put_object(Bucket=bucket, Key=key, Body=body, LastModified=base + timedelta(minutes=i))
+        newest_key = key
+    return newest_key
+
+
+def fill_snapshot_objects(client, bucket, count, body=b""):
+    # 10分ごとにクローリングした想定で、count個のnews/YYYY/MM/DD/HHMMSS.jsonl.gzを作る
+    base = datetime(2022, 1, 1, tzinfo=timezone.utc)
+    newest_key = None
+    for i in range(count):
+        crawled_at = base + timedelta(minutes=10 * i)
+        key = crawled_at.strftime("news/%Y/%m/%d/%H%M%S.jsonl.gz")
+        client.put_object(Bucket=bucket, Key=key, Body=body, LastModified=crawled_at)
+        newest_key = key
+    return newest_key
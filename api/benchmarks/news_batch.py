@@ -0,0 +1,45 @@
+# /news-similar-books の推論パイプラインのベンチマーク
+# 推論スレッド数を1からNまで変えて、1秒あたりに処理できるリクエスト数を計測する
+# （1リクエスト = デモ用ニュース全件の形態素解析・推論・類似度計算・結果の組み立て）
+# $ python -m api.benchmarks.news_batch --max-workers 8 --seconds 10
+import os
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+
+import api.crawling.get_from_s3 as crawling
+import api.doc2vec.predict_similar_book as doc2vec
+from api.doc2vec import model_registry
+
+
+def measure(news_list, workers, seconds):
+    requests = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        started = time.perf_counter()
+        while time.perf_counter() - started < seconds:
+            doc2vec.predict_similar_books_by_news_list(news_list, executor=executor)
+            requests += 1
+        elapsed = time.perf_counter() - started
+    return requests / elapsed
+
+
+def parse_args():
+    parser = ArgumentParser(description="requests/sec of the batched news inference pipeline")
+    parser.add_argument("--max-workers", dest="max_workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    news_list = crawling.make_news_for_demo()
+    # モデルの読み込みは計測に含めない
+    model_registry.get_search_engine()
+    baseline = None
+    for workers in range(1, args.max_workers + 1):
+        requests_per_sec = measure(news_list, workers, args.seconds)
+        baseline = baseline or requests_per_sec
+        print(
+            "workers=%2d: %7.2f requests/sec (x%.2f), %d news per request"
+            % (workers, requests_per_sec, requests_per_sec / baseline, len(news_list))
+        )
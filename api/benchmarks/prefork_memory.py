@@ -0,0 +1,68 @@
+# pre-fork方式（api.serve）でのメモリ共有の確認
+# uvicornやモデルの代わりに、マスターで文書ベクトルの行列と同じ大きさの配列を作ってからワーカーをfork()し、
+# 各ワーカーが行列全体を読む検索を行った後のRSS・共有・固有メモリを表示する
+# 比較として、各ワーカーが自分で行列を作る（ワーカーごとにモデルを読み込む）場合も表示する
+# 共有できている場合は、ワーカーのPrivateが小さく、合計のPSSがワーカー数に比例して増えない
+# $ python -m api.benchmarks.prefork_memory --workers 4 --docs 200000 --dim 300
+import gc
+import os
+import signal
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from api import serve
+from api.doc2vec.search_engine import normalize_rows, top_k
+
+
+def make_matrix(docs, dim):
+    rng = np.random.default_rng(0)
+    return normalize_rows(rng.standard_normal((docs, dim), dtype=np.float32))
+
+
+def search_forever(matrix, docs, dim):
+    # 行列全体を読む検索を何回か行い、その後は終了させられるまで待つ
+    if matrix is None:
+        matrix = make_matrix(docs, dim)
+    rng = np.random.default_rng(os.getpid())
+    for _ in range(5):
+        queries = normalize_rows(rng.standard_normal((1, dim), dtype=np.float32))
+        top_k(queries @ matrix.T, 10)
+    while True:
+        time.sleep(1)
+
+
+def run(label, matrix, args):
+    print(f"### {label}")
+    pids = [
+        serve.fork_worker(search_forever, matrix, args.docs, args.dim) for _ in range(args.workers)
+    ]
+    time.sleep(args.wait)
+    serve.print_memory_report([("master", os.getpid())] + [("worker", pid) for pid in pids])
+    for pid in pids:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+
+
+def parse_args():
+    parser = ArgumentParser(
+        description="copy-on-write sharing of a preloaded matrix across forked workers"
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--docs", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=300)
+    parser.add_argument("--wait", type=float, default=5.0, help="seconds to let the workers search")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    matrix_mb = args.docs * args.dim * 4 / 2**20
+    print("### matrix: %d x %d float32 = %.1f MB" % (args.docs, args.dim, matrix_mb))
+    run("each worker builds its own matrix", None, args)
+
+    matrix = make_matrix(args.docs, args.dim)
+    gc.collect()
+    gc.freeze()
+    run("matrix preloaded in the master and shared", matrix, args)
@@ -0,0 +1,34 @@
+# 精度を落とした文書ベクトル（quantized_store）のベンチマーク
+# モデルがなくても試せるように、話題の周りに散らばる合成ベクトルでfloat32の検索と比べ、
+# メモリの削減量・上位k件の一致率・1クエリあたりの検索時間を表示する
+# 実際のモデルでは python -m api.doc2vec.quantized_store <モデル> で同じレポートが出る
+# $ python -m api.benchmarks.quantized_search --sizes 10000 100000 --dim 200
+from argparse import ArgumentParser
+
+from api.benchmarks.ann_search import make_vectors
+from api.doc2vec import quantized_store
+from api.doc2vec.search_engine import VectorSearchEngine
+
+
+def parse_args():
+    parser = ArgumentParser(description="float16 / int8 doc vectors vs float32")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--dim", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--topn", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    for count in args.sizes:
+        vectors = make_vectors(count, args.dim, args.seed)
+        tags = ["ID:%d" % i for i in range(count)]
+        reference = VectorSearchEngine(tags, vectors)
+        queries = quantized_store.sample_queries(reference.matrix, args.queries, seed=args.seed + 1)
+        for dtype in quantized_store.DTYPES:
+            engine = quantized_store.QuantizedSearchEngine.from_matrix(tags, reference.matrix, dtype)
+            quantized_store.print_report(
+                quantized_store.accuracy_report(reference, engine, queries, args.topn)
+            )
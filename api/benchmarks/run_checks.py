@@ -0,0 +1,48 @@
+# モデルやサーバーを用意しなくても実行できる動作確認（期待と異なる場合に終了コード1で終わるもの）をまとめて実行する
+# 1つでも失敗した場合は終了コード1で終わる（slim_model_check・hybrid_output_checkはgensimとMeCabが必要）
+# $ python -m api.benchmarks.run_checks
+# $ python -m api.benchmarks.run_checks slim_model_check
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+
+CHECKS = (
+    "s3_latest_lookup",
+    "s3_history",
+    "slim_model_check",
+    "hybrid_output_check",
+)
+
+
+def run(name):
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-m", "api.benchmarks." + name],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+    )
+    seconds = time.perf_counter() - started
+    if completed.returncode != 0:
+        # 失敗した場合だけ、確認の出力を表示する
+        print(completed.stdout)
+    print("### %-20s %s (%.1f sec)" % (name, "ok" if completed.returncode == 0 else "FAILED", seconds))
+    return completed.returncode == 0
+
+
+def parse_args():
+    parser = ArgumentParser(description="run the self-checking scripts in api/benchmarks")
+    parser.add_argument("checks", nargs="*", help="checks to run (default: all of %s)" % ", ".join(CHECKS))
+    args = parser.parse_args()
+    unknown = [name for name in args.checks if name not in CHECKS]
+    if unknown:
+        parser.error("unknown checks: %s" % ", ".join(unknown))
+    args.checks = args.checks or list(CHECKS)
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = [run(name) for name in args.checks]
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,86 @@
+# 期間を指定したニュースの取得（get_from_s3.list_snapshot_keys, fetch_news_range）の動作確認とベンチマーク
+# 1回の呼び出しにlatency秒かかるローカルのS3の代わりに、days日分のスナップショットを置き、
+# ・1つずつ順にダウンロードした場合と、並列にダウンロードした場合の時間
+# ・同じURLのニュースが最新の1件だけになっているか、新しい順に返っているか
+# を確認する。期待と異なる場合は終了コード1で終わる
+# $ python -m api.benchmarks.s3_history --days 7 --per-day 1 --latency 0.2
+import sys
+import time
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+
+import api.crawling.get_from_s3 as crawling
+from api.benchmarks.local_s3 import LocalS3Client
+from api.crawling import news_snapshot
+
+
+def fill_history(client, until, days, per_day, news_per_snapshot):
+    # 連続するスナップショットでは、半分のニュースが前回と同じURLになるようにする
+    crawled_at = until - timedelta(days=days) + timedelta(minutes=1)
+    step = timedelta(days=1) / per_day
+    num = 0
+    while crawled_at <= until:
+        news_dict = {}
+        for i in range(news_per_snapshot):
+            url = "http://www.news24.jp/articles/%09d.html" % (num * news_per_snapshot // 2 + i)
+            news_dict[f"news{i}"] = {"title": "タイトル", "summary": "要約", "link": url}
+        key = news_snapshot.snapshot_key(crawled_at)
+        client.put_object(
+            Bucket=crawling.s3_bucket, Key=key, Body=news_snapshot.encode_snapshot(news_dict, "gz")
+        )
+        crawled_at += step
+        num += 1
+
+
+def parse_args():
+    parser = ArgumentParser(description="concurrent fetch of a range of news snapshots")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--per-day", dest="per_day", type=int, default=1)
+    parser.add_argument("--news", type=int, default=20, help="news per snapshot")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per S3 call")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    client = LocalS3Client(latency=args.latency)
+    until = datetime(2022, 1, 8, 12, 0, 0)
+    fill_history(client, until, args.days, args.per_day, args.news)
+
+    since = until - timedelta(days=args.days)
+    started = time.perf_counter()
+    keys = crawling.list_snapshot_keys(since, until, client)
+    list_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for key in keys:
+        crawling.read_snapshot_news(key, client)
+    sequential_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batches = list(crawling.fetch_news_range(keys, client))
+    concurrent_seconds = time.perf_counter() - started
+
+    urls = [news["url"] for news_list in batches for news in news_list]
+    crawled_at = [news_list[0]["crawled_at"] for news_list in batches]
+    print(
+        "%d snapshots (%d news, %d unique) | list %.2fs | sequential %.2fs | concurrent %.2fs (1 fetch = %.2fs)"
+        % (
+            len(keys),
+            len(keys) * args.news,
+            len(urls),
+            list_seconds,
+            sequential_seconds,
+            concurrent_seconds,
+            args.latency,
+        )
+    )
+    ok = (
+        len(keys) == args.days * args.per_day
+        and len(urls) == len(set(urls))
+        and len(urls) == (len(keys) + 1) * args.news // 2
+        and keys == sorted(keys, reverse=True)
+        and len(crawled_at) == len(keys)
+    )
+    print("OK" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,93 @@
+# 最新のニュースのキーを探す処理（get_from_s3.resolve_latest_news_key）の動作確認とベンチマーク
+# 10万個のオブジェクトを持つローカルのS3の代わりに対して、
+# ・ポインタ（latest.json）がない場合に、1000件を超えてページングして最新のキーを見つけられるか
+# ・ポインタがある場合に、より新しいスナップショットがないかの確認（一覧の取得1回）だけで最新のキーを返せるか
+# ・ポインタがあるバケットに、ポインタを更新せずにクローラーがスナップショットを書き込んだ場合に、新しいキーを返すか
+# ・クローラーと同じ処理（write_snapshot, upload_news_snapshot）でアップロードした場合に、ポインタが更新されるか
+# ・TTLの間は、S3に問い合わせずにキャッシュを返すか
+# ・日付で分けたキー（news/YYYY/MM/DD/HHMMSS.jsonl.gz）の場合に、接頭辞ごとの一覧の取得だけで最新のキーを見つけられるか
+# を確認し、それぞれにかかった時間とS3の呼び出し回数を表示する。期待と異なる場合は終了コード1で終わる
+# $ python -m api.benchmarks.s3_latest_lookup --objects 100000
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+
+import api.crawling.get_from_s3 as crawling
+from api.benchmarks.local_s3 import LocalS3Client, fill_news_objects, fill_snapshot_objects
+from api.crawling.news_snapshot import encode_snapshot, snapshot_key, write_snapshot
+
+
+def resolve(client, label, expected_key):
+    client.calls.clear()
+    started = time.perf_counter()
+    key = crawling.resolve_latest_news_key(client)
+    elapsed = time.perf_counter() - started
+    ok = key == expected_key
+    print(
+        "%-22s %s key=%s %.1fms calls=%s"
+        % (label, "OK  " if ok else "FAIL", key, elapsed * 1000, dict(client.calls))
+    )
+    return ok
+
+
+def clear_cache():
+    crawling._latest_cache.update(key=None, expires_at=0.0)
+
+
+def parse_args():
+    parser = ArgumentParser(description="latest news object lookup against a local S3 stand-in")
+    parser.add_argument("--objects", type=int, default=100000)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    client = LocalS3Client()
+    newest_key = fill_news_objects(client, crawling.s3_bucket, args.objects)
+
+    results = []
+    clear_cache()
+    results.append(resolve(client, "scan (no pointer)", newest_key))
+    results.append(resolve(client, "cached (within TTL)", newest_key))
+
+    crawling.publish_latest_pointer(newest_key, client)
+    clear_cache()
+    results.append(resolve(client, "pointer", newest_key))
+    results.append(client.calls["list_objects_v2"] == 1)
+
+    # 以前の形式のオブジェクトと新しい形式のスナップショットが混在するバケット
+    client = LocalS3Client()
+    fill_news_objects(client, crawling.s3_bucket, args.objects)
+    newest_key = fill_snapshot_objects(client, crawling.s3_bucket, args.objects)
+    clear_cache()
+    results.append(resolve(client, "prefix (no pointer)", newest_key))
+    # 年・月・日の接頭辞と、その日のオブジェクトの一覧（1日144個）の4回で済む
+    results.append(client.calls["list_objects_v2"] == 4)
+
+    crawling.publish_latest_pointer(newest_key, client)
+    clear_cache()
+    results.append(resolve(client, "snapshot pointer", newest_key))
+    results.append(client.calls["list_objects_v2"] == 1)
+
+    # ポインタを書いた後に、ポインタを更新しない書き込み（クローラーのファイルの同期など）で新しいスナップショットが増えた場合
+    crawled_at = datetime.strptime(newest_key[: -len(".jsonl.gz")], "news/%Y/%m/%d/%H%M%S")
+    crawled_key = snapshot_key(crawled_at + timedelta(minutes=10))
+    news = {"news0": {"title": "t", "summary": "s", "link": "https://example.com/0"}}
+    client.put_object(Bucket=crawling.s3_bucket, Key=crawled_key, Body=encode_snapshot(news, "gz"))
+    clear_cache()
+    results.append(resolve(client, "stale pointer", crawled_key))
+
+    # crawling-news/run.py・get_from_json_file.convert_news_to_jsonと同じく、ファイルに書いてからアップロードする
+    uploaded_key = snapshot_key(crawled_at + timedelta(minutes=20))
+    with tempfile.TemporaryDirectory() as root:
+        file_path = os.path.join(root, uploaded_key)
+        write_snapshot(file_path, news)
+        crawling.upload_news_snapshot(file_path, uploaded_key, client)
+    clear_cache()
+    results.append(resolve(client, "crawler upload", uploaded_key))
+    results.append(crawling.read_latest_pointer(client) == uploaded_key)
+
+    sys.exit(0 if all(results) else 1)
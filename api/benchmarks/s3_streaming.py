@@ -0,0 +1,128 @@
+# S3からのニュースの読み込みのベンチマーク
+# ファイルに保存するローカルのS3の代わりに1MB〜100MBのニュースのオブジェクトを置き、
+# ・以前の方法: 毎回Sessionからresourceを作り、bodyを全て読んでからjson.loads
+# ・現在の方法: 共有のクライアントで、limit件を読んだところで打ち切る逐次読み込み
+# の時間とメモリの最大使用量を比べる
+# また、同じニュースを圧縮したJSON Lines（news/YYYY/MM/DD/HHMMSS.jsonl.gz/.zst）で置いた場合の
+# オブジェクトのサイズ（転送量）と、limit件を読む時間を表示する
+# $ python -m api.benchmarks.s3_streaming --sizes-mb 1 10 100 --limit 10
+import json
+import random
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+from boto3.session import Session
+
+import api.crawling.get_from_s3 as crawling
+from api.benchmarks.local_s3 import LocalS3Client
+from api.crawling import news_snapshot
+
+
+def make_news_dict(size_mb):
+    # ConvertNewsDataと同じ形式（indent=4）で、おおよそsize_mbのニュースのJSONを作る
+    # 実際のニュースに近い圧縮率になるよう、要約は文字をランダムに並べて作る
+    rng = random.Random(0)
+    chars = "日本政府経済内閣発表会見国際社会首相野党選挙対策大統領物価上昇見込む調査結果、。"
+    news_dict = {}
+    num = 0
+    size = 0
+    while size < size_mb * 1024 * 1024:
+        news = {
+            "title": "ニュースのタイトル%d　1/6 15:03更新" % num,
+            "summary": "".join(rng.choice(chars) for _ in range(120)),
+            "link": "http://www.news24.jp/articles/2022/01/06/%09d.html" % num,
+        }
+        news_dict[f"news{num}"] = news
+        size += len(json.dumps(news, ensure_ascii=False).encode("utf-8")) + 40
+        num += 1
+    return news_dict
+
+
+def measure(func):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def read_whole(client, key, limit):
+    body = client.get_object(Bucket=crawling.s3_bucket, Key=key)["Body"].read()
+    news_data = json.loads(body.decode("utf-8"))
+    return {f"news{num}": news_data[f"news{num}"] for num in range(limit)}
+
+
+def client_creation(repeat):
+    # 以前はリクエストごとにresourceを作っていた。共有クライアントは2回目以降は作らない
+    started = time.perf_counter()
+    for _ in range(repeat):
+        Session(region_name="ap-northeast-1").resource("s3")
+    per_request = (time.perf_counter() - started) / repeat
+    started = time.perf_counter()
+    for _ in range(repeat):
+        crawling.get_s3_client()
+    shared = (time.perf_counter() - started) / repeat
+    print("client per request: %.2fms, shared client: %.4fms" % (per_request * 1000, shared * 1000))
+
+
+def parse_args():
+    parser = ArgumentParser(description="whole-body vs streaming read of news objects")
+    parser.add_argument("--sizes-mb", dest="sizes_mb", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--limit", type=int, default=10)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    client_creation(10)
+    with tempfile.TemporaryDirectory() as root:
+        client = LocalS3Client(root)
+        for size_mb in args.sizes_mb:
+            key = f"news_{size_mb}mb.json"
+            news_dict = make_news_dict(size_mb)
+            body = json.dumps(news_dict, indent=4, ensure_ascii=False).encode("utf-8")
+            client.put_object(Bucket=crawling.s3_bucket, Key=key, Body=body)
+
+            whole, whole_seconds, whole_peak = measure(lambda: read_whole(client, key, args.limit))
+            streamed, stream_seconds, stream_peak = measure(
+                lambda: crawling.read_news_object(client, key, args.limit)
+            )
+            assert whole == streamed
+            print(
+                "%4d MB: whole body %8.1fms peak %7.1f MB | streaming %6.1fms peak %5.2f MB"
+                % (
+                    size_mb,
+                    whole_seconds * 1000,
+                    whole_peak / 1024 / 1024,
+                    stream_seconds * 1000,
+                    stream_peak / 1024 / 1024,
+                )
+            )
+
+            compressions = ["gz"] + (["zst"] if news_snapshot.zstandard is not None else [])
+            for compression in compressions:
+                snapshot_key = "news/2022/01/%02d/000000%s" % (size_mb % 28 + 1, news_snapshot.EXTENSIONS[compression])
+                started = time.perf_counter()
+                snapshot = news_snapshot.encode_snapshot(news_dict, compression)
+                encode_seconds = time.perf_counter() - started
+                client.put_object(Bucket=crawling.s3_bucket, Key=snapshot_key, Body=snapshot)
+                items, seconds, peak = measure(
+                    lambda: crawling.read_news_object(client, snapshot_key, args.limit)
+                )
+                assert items == streamed
+                print(
+                    "         jsonl.%-3s %7.2f MB (%4.1f%% of json, encode %6.1fms) | streaming %6.1fms peak %5.2f MB"
+                    % (
+                        compression,
+                        len(snapshot) / 1024 / 1024,
+                        len(snapshot) / len(body) * 100,
+                        encode_seconds * 1000,
+                        seconds * 1000,
+                        peak / 1024 / 1024,
+                    )
+                )
+            del news_dict, body
@@ -0,0 +1,183 @@
+# 推論用のモデル（slim_model）の確認
+# 元のモデルと推論用のファイルを読み込み、
+# ・ファイルの大きさと読み込み時間
+# ・語彙（単語の順番、ダウンサンプリングの閾値（ダウンサンプリングしない単語を含む）、出現回数）が一致するか
+# ・同じ乱数の状態から推論したベクトルが許容誤差内で一致するか
+# ・推論したベクトルで検索した上位topn件が一致するか
+# ・以前の形式（出現回数がなく、閾値をuint32で保存したファイル）も同じ語彙として読み込めるか
+# を表示し、一致しない場合は終了コード1で終了する
+# モデルを指定しない場合は、一時ディレクトリで小さなモデルを学習して確かめる（api.benchmarks.run_checksから実行する）
+# 推論用のファイルがない場合は python -m api.doc2vec.slim_model <モデル> で作る
+# $ python -m api.benchmarks.slim_model_check
+# $ python -m api.benchmarks.slim_model_check api/doc2vec/d2v_ipsj_desc_0.model --docs 200
+import json
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from api.doc2vec import fast_infer
+from api.doc2vec import slim_model
+
+
+def timed(func):
+    started = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - started
+
+
+def sample_docs(model, count, length, seed):
+    # 語彙からランダムに選んだ単語の列を、ニュースや論文の説明文の代わりに使う
+    random = np.random.RandomState(seed)
+    words = model.wv.index2word
+    return [
+        [words[i] for i in random.randint(0, len(words), length)] for _ in range(count)
+    ]
+
+
+def infer(model, doc, seed):
+    # infer_vectorはmodel.randomで初期値を決めるため、推論の前に同じ状態に戻す
+    model.random = np.random.RandomState(seed)
+    return model.infer_vector(doc, alpha=0.1, min_alpha=0.0001, steps=5)
+
+
+def train_model(directory, seed=0):
+    # Zipf分布の単語で小さなモデルを学習する（頻出語はダウンサンプリングされ、まれな語はされない）
+    from gensim.models.doc2vec import Doc2Vec, TaggedDocument
+
+    random = np.random.RandomState(seed)
+    documents = [
+        TaggedDocument(
+            ["語%d" % i for i in np.minimum(random.zipf(1.3, 40), 2000)], ["ID:%d" % num]
+        )
+        for num in range(300)
+    ]
+    model = Doc2Vec(
+        documents, dm=1, vector_size=16, min_count=1, sample=1e-3, epochs=3, workers=1, seed=seed
+    )
+    model_path = os.path.join(directory, "d2v_check_1.model")
+    model.save(model_path)
+    return model_path
+
+
+def check_vocab(full, slim, counts=True):
+    # 単語ごとに行番号・sample_int（ダウンサンプリングしない単語は2**32）・出現回数を比べる
+    failures = []
+    if full.wv.index2word != slim.wv.index2word:
+        return ["vocab: word order differs"]
+    for word in full.wv.index2word:
+        expected = full.wv.vocab[word]
+        actual = slim.wv.vocab[word]
+        if (expected.index, expected.sample_int) != (actual.index, actual.sample_int):
+            failures.append(
+                "vocab: %s index/sample_int %s != %s"
+                % (word, (expected.index, expected.sample_int), (actual.index, actual.sample_int))
+            )
+        elif counts and expected.count != actual.count:
+            failures.append("vocab: %s count %d != %d" % (word, expected.count, actual.count))
+    return failures
+
+
+def check_inference(full, slim, docs, length, topn, atol, seed):
+    failures = []
+    max_error = 0.0
+    for num, doc in enumerate(sample_docs(full, docs, length, seed)):
+        expected = infer(full, doc, seed + num)
+        actual = infer(slim, doc, seed + num)
+        max_error = max(max_error, float(np.abs(expected - actual).max()))
+        expected_tags = [tag for tag, _ in full.docvecs.most_similar([expected], topn=topn)]
+        actual_tags = [tag for tag, _ in slim.docvecs.most_similar([actual], topn=topn)]
+        if not np.allclose(expected, actual, atol=atol) or expected_tags != actual_tags:
+            failures.append("inference: doc %d differs" % num)
+    print(
+        "### %d docs: %d mismatches, max vector error %.2e (atol %.0e)"
+        % (docs, len(failures), max_error, atol)
+    )
+    return failures
+
+
+def write_legacy(path, legacy_path):
+    # 出現回数を保存する前の形式（countsがなく、sample_intsがuint32で2**32が0になっている）のファイルを作る
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data.files if name != "counts"}
+    arrays["sample_ints"] = arrays["sample_ints"].astype(np.uint32)
+    with open(legacy_path, "wb") as f:
+        np.savez(f, **arrays)
+    for name in slim_model.MAPPED_ARRAYS:
+        os.symlink(os.path.abspath(slim_model.array_path(path, name)), slim_model.array_path(legacy_path, name))
+
+
+def check_legacy(full, path, directory):
+    # 以前の形式でも語彙（sample_int）と推論は同じで、出現回数がないためIDFの重み付けが無効になること
+    legacy_path = os.path.join(directory, "legacy" + slim_model.SUFFIX)
+    write_legacy(path, legacy_path)
+    legacy = slim_model.load(legacy_path)
+    failures = check_vocab(full, legacy, counts=False)
+    if any(legacy.wv.vocab[word].count for word in legacy.wv.index2word):
+        failures.append("legacy: word counts should be 0")
+    if not np.all(fast_infer.WordAverageEncoder.from_model(legacy).idf == 1.0):
+        failures.append("legacy: IDF weights should be uniform")
+    failures += check_inference(full, legacy, 20, 30, 10, 1e-5, 0)
+    return ["legacy " + failure for failure in failures]
+
+
+def run(model_path, args):
+    from gensim.models.doc2vec import Doc2Vec
+
+    path = slim_model.slim_path(model_path)
+    full, full_seconds = timed(lambda: Doc2Vec.load(model_path))
+    if not os.path.exists(path):
+        slim_model.export(full, path)
+        print(f"### wrote {path}")
+    slim, slim_seconds = timed(lambda: slim_model.load(path, mmap=args.mmap))
+    print(
+        "### full %.1f MB loaded in %.2f sec | slim %.1f MB loaded in %.2f sec"
+        % (
+            slim_model.model_files_bytes(model_path) / 2**20,
+            full_seconds,
+            slim_model.slim_files_bytes(path) / 2**20,
+            slim_seconds,
+        )
+    )
+
+    sample_ints = [full.wv.vocab[word].sample_int for word in full.wv.index2word]
+    print(
+        "### %d words (%d never downsampled)"
+        % (len(sample_ints), sample_ints.count(slim_model.ALWAYS_KEEP))
+    )
+    failures = check_vocab(full, slim)
+    failures += check_inference(full, slim, args.docs, args.length, args.topn, args.atol, args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        failures += check_legacy(full, path, directory)
+    return failures
+
+
+def parse_args():
+    parser = ArgumentParser(description="compare a slim Doc2Vec artifact with the full model")
+    parser.add_argument(
+        "model_path", nargs="?", help="Doc2Vec model file (default: train a small model)"
+    )
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--length", type=int, default=30)
+    parser.add_argument("--topn", type=int, default=10)
+    parser.add_argument("--atol", type=float, default=1e-5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mmap", default=None, help="load the slim arrays with mmap_mode (e.g. r)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.model_path:
+        failures = run(args.model_path, args)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            failures = run(train_model(directory, args.seed), args)
+    for failure in failures[:20]:
+        print("### " + failure)
+    print("### slim model: %s" % ("FAILED (%d)" % len(failures) if failures else "ok"))
+    if failures:
+        sys.exit(1)
@@ -0,0 +1,114 @@
+# BM25の検索エンジン（sparse_engine）とDoc2Vecの比較のベンチマーク
+# ・起動: インデックス（npz）の読み込み時間と、gensimをimportしていないこと
+# ・検索: 1クエリあたりの時間（BM25はクエリの語彙素の検索、Doc2Vecは推論と文書ベクトルの検索）
+# を表示する。--json-dirを指定しない場合は、Zipf分布の語彙素で作った合成の本で計測する
+# --doc2vecを指定した場合は、DOC2VEC_MODEL_PATHのモデルの読み込み・推論・検索も同じクエリで計測する
+# $ python -m api.benchmarks.sparse_search --books 100000 --queries 200
+# $ python -m api.benchmarks.sparse_search --json-dir api/json --doc2vec
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from api.doc2vec import sparse_engine
+
+
+def make_documents(count, vocabulary, length, seed):
+    # 語彙素の出現頻度が実際の文章に近くなるよう、Zipf分布で語彙素を選ぶ
+    random = np.random.RandomState(seed)
+    documents = []
+    for _ in range(count):
+        ids = np.minimum(random.zipf(1.3, random.randint(length // 2, length * 2)), vocabulary)
+        documents.append(["語%d" % i for i in ids])
+    return documents
+
+
+def timed(func):
+    started = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - started
+
+
+def per_query_ms(func, queries):
+    # 1件ずつ検索した場合の1件あたりの時間
+    started = time.perf_counter()
+    for query in queries:
+        func(query)
+    return (time.perf_counter() - started) / len(queries) * 1000
+
+
+def measure_doc2vec(queries, topn):
+    from api.doc2vec import fast_infer
+    from api.doc2vec import model_registry
+    import api.doc2vec.predict_similar_book as doc2vec
+
+    model, seconds = timed(model_registry.get_model)
+    engine = model_registry.get_search_engine()
+    print("### doc2vec: model loaded in %.2f sec" % seconds)
+    params = doc2vec.infer_vector_params()
+    fast_infer.get_encoder(model)
+    for mode in fast_infer.MODES:
+        latency = per_query_ms(
+            lambda lexemes: engine.search(
+                fast_infer.infer_vector(model, lexemes, mode, **params), topn=topn
+            ),
+            queries,
+        )
+        print("### doc2vec (%s): %.3f ms/query" % (mode, latency))
+
+
+def parse_args():
+    parser = ArgumentParser(description="BM25 sparse index vs Doc2Vec: cold start and latency")
+    parser.add_argument("--json-dir", dest="json_dir", default=None, help="id_*.json directory")
+    parser.add_argument("--books", type=int, default=100000)
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("--length", type=int, default=60)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--topn", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--doc2vec", action="store_true", help="also measure the Doc2Vec model")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.json_dir:
+        engine, build_seconds = timed(lambda: sparse_engine.build_engine(args.json_dir))
+        from api.utils import tokenizer
+        import api.crawling.get_from_s3 as crawling
+
+        queries = [
+            tokenizer.parse_text(news["title"] + news["summary"])[:30]
+            for news in crawling.make_news_for_demo()
+        ]
+    else:
+        documents = make_documents(args.books, args.vocabulary, args.length, args.seed)
+        tags = ["ID:%d" % i for i in range(len(documents))]
+        engine, build_seconds = timed(
+            lambda: sparse_engine.SparseSearchEngine.from_documents(tags, documents)
+        )
+        queries = make_documents(args.queries, args.vocabulary, 15, args.seed + 1)
+    print(
+        "### sparse: %d books, %d terms, %d postings, built in %.2f sec"
+        % (len(engine), len(engine.terms), len(engine.doc_ids), build_seconds)
+    )
+
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "sparse_index.npz")
+        engine.save(path)
+        loaded, load_seconds = timed(lambda: sparse_engine.SparseSearchEngine.load(path))
+        print(
+            "### sparse: cold start %.1f ms (%.1f MB index)"
+            % (load_seconds * 1000, os.path.getsize(path) / 2**20)
+        )
+    latency = per_query_ms(lambda lexemes: loaded.search(lexemes, topn=args.topn), queries)
+    print("### sparse: %.3f ms/query" % latency)
+    if "gensim" in sys.modules:
+        print("### gensim was imported by the sparse engine")
+        sys.exit(1)
+
+    if args.doc2vec:
+        measure_doc2vec(queries, args.topn)
@@ -0,0 +1,75 @@
+# 形態素解析のスループット（tokens/sec）のベンチマーク
+# 従来の「毎回Taggerを生成してparseの出力を正規表現で分割する」方法と、
+# api.utils.tokenizer（スレッドごとのTagger + parseToNode、LRUキャッシュあり/なし）を比べる
+# $ python -m api.benchmarks.tokenizer --json-dir api/json --repeat 5
+import glob
+import json
+import os
+import re
+import time
+from argparse import ArgumentParser
+
+import MeCab
+
+import api.crawling.get_from_s3 as crawling
+from api.utils import tokenizer
+
+
+def legacy_parse_text(text):
+    # 以前の predict_similar_book.parse_text と同じ処理（呼び出しごとにTaggerを生成）
+    mecab_tag = MeCab.Tagger(tokenizer.DICTIONARY)
+    lexemes = []
+    for line in mecab_tag.parse(text.replace("　", " ")).split("\n"):
+        if line == "EOS" or line == "":
+            continue
+        words = re.split(r"[,\t]", line)
+        if words[2] == "サ変接続" and words[7] == "*":
+            pass
+        elif words[2] == "記号" or words[1] == "記号":
+            pass
+        elif words[1] == "助詞":
+            pass
+        else:
+            lexemes.append(words[0])
+    return lexemes
+
+
+def uncached_parse_text(text):
+    return list(tokenizer._parse_surfaces.__wrapped__(text.replace("　", " "), True))
+
+
+def load_texts(json_dir):
+    texts = [news["title"] + news["summary"] for news in crawling.make_news_for_demo()]
+    if json_dir:
+        for json_file in glob.glob(os.path.join(json_dir, "id_*.json")):
+            with open(json_file, "r") as json_f:
+                description = json.load(json_f).get("description")
+            if isinstance(description, str) and description:
+                texts.append(description)
+    return texts
+
+
+def measure(name, parse, texts, repeat):
+    tokens = 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            tokens += len(parse(text))
+    elapsed = time.perf_counter() - started
+    print("%-28s %10.0f tokens/sec (%d texts x %d)" % (name, tokens / elapsed, len(texts), repeat))
+
+
+def parse_args():
+    parser = ArgumentParser(description="tokens/sec of the MeCab tokenizer")
+    parser.add_argument("--json-dir", dest="json_dir", default=None, help="add book descriptions from id_*.json")
+    parser.add_argument("--repeat", type=int, default=5)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    texts = load_texts(args.json_dir)
+    measure("legacy (regex, new Tagger)", legacy_parse_text, texts, args.repeat)
+    measure("parseToNode (no cache)", uncached_parse_text, texts, args.repeat)
+    measure("parseToNode + LRU cache", tokenizer.parse_text, texts, args.repeat)
+    print(tokenizer.cache_info())
@@ -1,6 +1,9 @@
 import json
 
+from api.crawling.news_snapshot import compression_of, write_snapshot
+
 # クローリングしたニュースのデータをjson形式にしてフォルダーに格納するクラス
+# file_pathが .jsonl.gz / .jsonl.zst の場合は、圧縮したJSON Lines（news_snapshot.py）で格納する
 class ConvertNewsData:
     def __init__(self, news_data, file_path):
         self.news_data = news_data
@@ -20,6 +23,10 @@ class ConvertNewsData:
                 (["title", data[0]], ["summary", data[1]], ["link", data[2]])
             )
 
+        if compression_of(self.file_path) is not None:
+            write_snapshot(self.file_path, news_dict)
+            return news_dict
+
         # 辞書型のデータをjson形式に変換して、指定されたパスに格納する
         with open(self.file_path, "w", encoding="utf-8") as f:
             json.dump(news_dict, f, indent=4, ensure_ascii=False)
@@ -1,10 +1,11 @@
 import os
 from api.crawling.crawl import CrawlingNews
 from api.crawling.convert_to_json import ConvertNewsData
-import datetime
+from api.crawling.news_snapshot import snapshot_key, snapshot_now, is_snapshot_key, crawled_at_of, load_news_file
 import json
 import glob
 from api.utils.text import replaceTextFromNewsText, convert_full_width_to_half_width
+import api.settings as settings
 
 # ニュース記事のRSSのURL
 URL = "https://www.news24.jp/rss/index.rdf"
@@ -20,27 +21,56 @@ def crawl_news_data():
 
 def convert_news_to_json(news_list):
     # 現在時刻をjsonファイルのファイル名にする
-    datetime_now = datetime.datetime.now()
+    datetime_now = snapshot_now()
     formated_time = datetime_now.strftime("%Y年%m月%d日%H時%M分%S秒")
     file_name = f"news_{formated_time}"
-    file_path = f"./news_files/{file_name}.json"
+    if settings.NEWS_SNAPSHOT_FORMAT == "json":
+        key = f"{file_name}.json"
+    else:
+        key = snapshot_key(datetime_now, settings.NEWS_SNAPSHOT_FORMAT)
+    file_path = os.path.join(settings.NEWS_FILES_DIR, key)
 
     # ニュースデータのjsonファイルへの変換処理
     json_data = ConvertNewsData(news_list, file_path)
     json_data.convert()
 
+    # S3にアップロードし、最新のニュースを指すポインタ（latest.json）を更新する
+    if settings.S3_UPLOAD_NEWS:
+        from api.crawling.get_from_s3 import upload_news_snapshot
+
+        upload_news_snapshot(file_path, key)
+
+    # 続けて、ニュースごとの類似する本を計算してjsonファイルの隣に書き出しておく
+    # （gensimなどの読み込みが重いため、ここでimportする）
+    # ニュースは保存済みのため、モデルやgensimがないなどで失敗してもクローリングは失敗にしない（APIがその場で推論する）
+    try:
+        from api.doc2vec.precompute import write_recommendations
+
+        write_recommendations(file_path)
+    except Exception as e:
+        print(f"### failed to precompute recommendations for {file_path}: {e!r}")
+
+
+def list_news_files(news_dir):
+    # 以前の形式（news_<日時>.json）と、日付ごとのフォルダーに置いた圧縮したJSON Linesの両方を探す
+    # 同じディレクトリには事前計算の結果（*.recommend.json）も置かれるため、それは除く
+    return [
+        f for f in glob.glob(os.path.join(news_dir, "*.json")) if not f.endswith(".recommend.json")
+    ] + [
+        f for f in glob.glob(os.path.join(news_dir, "news", "**", "*.jsonl.*"), recursive=True) if is_snapshot_key(f)
+    ]
+
 
 def fetch_updated_news_data_by_json(limit):
     news_array = []
-    # print(glob.glob('api/crawling/news_files/*.json'))
+    news_files = list_news_files(settings.NEWS_FILES_DIR)
     sorted_files = sorted(
-        glob.glob("api/crawling/news_files/*.json"),
+        news_files,
         key=lambda f: os.stat(f).st_mtime,
         reverse=True,
     )  # 最新順にリスト
-    crawled_at = sorted_files[0][16:-5]  # ＠TODO:S3からではファイル名変わるため修正（もしくはファイル名から取る必要なさそう）
-    with open(sorted_files[0], "r") as json_file:
-        json_dict = json.load(json_file)
+    crawled_at = crawled_at_of_file(sorted_files[0])
+    json_dict = load_news_file(sorted_files[0])
     for num in range(limit):
         news = json_dict["news" + str(num)]
         news_dict = {
@@ -54,3 +84,31 @@ def fetch_updated_news_data_by_json(limit):
     return news_array
 
 
+def crawled_at_of_file(news_file):
+    # クローリングした日時（%Y年%m月%d日%H時%M分%S秒。辞書順が時刻順）
+    if is_snapshot_key(news_file):
+        return crawled_at_of(news_file)
+    return os.path.basename(news_file)[5:-5]  # news_<日時>.json
+
+
+def fetch_news_range_by_json(since, until):
+    # since〜untilにクローリングしたニュースのファイルを新しい順に読み、ファイルごとのニュースのリストを返すジェネレータ
+    # 同じURLのニュースは最新のものだけを返す（get_from_s3.fetch_news_rangeと同じ）
+    from api.crawling.get_from_s3 import convert_news_to_correct_schema
+
+    since_stamp = since.strftime("%Y年%m月%d日%H時%M分%S秒")
+    until_stamp = until.strftime("%Y年%m月%d日%H時%M分%S秒")
+    news_files = [
+        (crawled_at_of_file(news_file), news_file)
+        for news_file in list_news_files(settings.NEWS_FILES_DIR)
+    ]
+    seen_urls = set()
+    for crawled_at, news_file in sorted(news_files, reverse=True):
+        if not since_stamp <= crawled_at <= until_stamp:
+            continue
+        news_data = load_news_file(news_file)
+        news_list = convert_news_to_correct_schema(news_data, len(news_data), crawled_at)
+        unique_news_list = [news for news in news_list if news["url"] not in seen_urls]
+        seen_urls.update(news["url"] for news in unique_news_list)
+        if unique_news_list:
+            yield unique_news_list
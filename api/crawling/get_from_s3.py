@@ -1,49 +1,70 @@
-from pathlib import Path
-
-import io
 import json
-from boto3.session import Session
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from api.utils.text import replaceTextFromNewsText, convert_full_width_to_half_width
+from api.crawling.news_snapshot import (
+    SNAPSHOT_PREFIX,
+    CONTENT_TYPES,
+    STAMP_FORMAT,
+    compression_of,
+    crawled_at_of,
+    is_snapshot_key,
+    read_news_items,
+)
 
 
 import api.settings as settings
 
-session = Session(
-    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY_ID,
-)
 s3_bucket = "crawling-news-bucket"
+# クローラーが最新のニュースのキーを書き込むポインタのオブジェクト
+LATEST_POINTER_KEY = "latest.json"
+# S3のbodyを読み込む単位
+READ_CHUNK_BYTES = 64 * 1024
+
+# プロセス内で共有するS3クライアント（最初に使うときに作る。boto3のクライアントはスレッドセーフ）
+# boto3のimportとセッションの作成は重いため、API起動時ではなく最初にS3を使うときに行う
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                from boto3.session import Session
+                from botocore.config import Config
+
+                session = Session(
+                    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY_ID,
+                )
+                # 同時リクエスト数に合わせてコネクションプールを大きくし、接続を使い回す
+                config = Config(
+                    max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+                    retries={"max_attempts": 3, "mode": "standard"},
+                )
+                _s3_client = session.client("s3", config=config)
+    return _s3_client
+
 
 # @TODO:全体的に関数分けてリファクタしたい
-def fetch_updated_news_data_from_s3(limit):
-    s3 = session.resource("s3")
-    bucket = s3.Bucket(s3_bucket)
-
-    # ファイルリストオブジェクトを作成
-    objs = bucket.meta.client.list_objects_v2(Bucket=bucket.name)
-    # ディレクトリ配下のファイルについてLOOP処理
-    loop_first_f = True
-    for o in objs.get("Contents"):
-        # LOOP初回処理
-        if loop_first_f:
-            download_target_file = o.get("Key")
-            modified_datetime_mid = o.get("LastModified")
-            loop_first_f = False
-        # 2回目以降
-        else:
-            # 最新更新日時のファイルにターゲットを移動する
-            if modified_datetime_mid <= o.get("LastModified"):
-                modified_datetime_mid = o.get("LastModified")
-                download_target_file = o.get("Key")
+def fetch_updated_news_data_from_s3(limit, client=None):
+    client = client or get_s3_client()
+    download_target_file = resolve_latest_news_key(client)
 
     try:
-        # S3からファイルのbodyを取得
-        obj = bucket.Object(download_target_file)
-        body = obj.get()["Body"].read()
-        news_data = json.loads(body.decode("utf-8"))
+        # S3からファイルのbodyを少しずつ読み、limit件のニュースを読んだところで打ち切る
+        news_data = read_news_object(client, download_target_file, limit)
         print(f"download {download_target_file} is completed.")
 
-        crawled_at = download_target_file[:-5]
+        if is_snapshot_key(download_target_file):
+            crawled_at = crawled_at_of(download_target_file)
+        else:
+            crawled_at = download_target_file[:-5]
 
         result = convert_news_to_correct_schema(news_data, limit, crawled_at)
 
@@ -53,6 +74,239 @@ def fetch_updated_news_data_from_s3(limit):
         print(f"download {download_target_file} is failed.")
 
 
+def read_news_object(client, key, limit):
+    # {"news0": {...}, "news1": {...}, ...} の先頭からlimit件を返す（残りはダウンロードしない）
+    # 圧縮したJSON Lines（news/YYYY/MM/DD/HHMMSS.jsonl.gz）と以前のjson形式のどちらも読める
+    body = client.get_object(Bucket=s3_bucket, Key=key)["Body"]
+    try:
+        return read_news_items(body.iter_chunks(READ_CHUNK_BYTES), key, limit)
+    finally:
+        body.close()
+
+
+# 期間を指定してニュースを取得する処理で、一覧の取得とダウンロードを並列に行うスレッドプール
+# 全てのリクエストで共有し、S3への同時接続数をS3_FETCH_WORKERSまでに抑える
+_fetch_executor = None
+_fetch_executor_lock = threading.Lock()
+
+
+def get_fetch_executor():
+    global _fetch_executor
+    if _fetch_executor is None:
+        with _fetch_executor_lock:
+            if _fetch_executor is None:
+                _fetch_executor = ThreadPoolExecutor(
+                    max_workers=settings.S3_FETCH_WORKERS, thread_name_prefix="s3-fetch"
+                )
+    return _fetch_executor
+
+
+def list_snapshot_keys(since, until, client=None):
+    # since〜untilにクローリングしたスナップショットのキーを新しい順に返す
+    # since・untilはキーと同じタイムゾーン（news_snapshot.SNAPSHOT_TIMEZONE）のnaiveな日時（to_snapshot_timeで変換する）
+    # 日付の接頭辞（news/YYYY/MM/DD/）ごとの一覧を並列に取得するため、期間外のオブジェクトは走査しない
+    client = client or get_s3_client()
+    since_stamp = since.strftime(STAMP_FORMAT)
+    until_stamp = until.strftime(STAMP_FORMAT)
+    prefixes = []
+    day = since.date()
+    while day <= until.date():
+        prefixes.append(day.strftime(SNAPSHOT_PREFIX + "%Y/%m/%d/"))
+        day += timedelta(days=1)
+
+    def list_day(prefix):
+        return [o["Key"] for o in _list_all(client, prefix, "Contents")]
+
+    keys = []
+    for day_keys in get_fetch_executor().map(list_day, prefixes):
+        for key in day_keys:
+            if is_snapshot_key(key) and since_stamp <= key[: len(since_stamp)] <= until_stamp:
+                keys.append(key)
+    return sorted(keys, reverse=True)
+
+
+def read_snapshot_news(key, client=None):
+    # スナップショットのニュースを全件読み、APIのスキーマに変換して返す
+    client = client or get_s3_client()
+    news_data = read_news_object(client, key, None)
+    return convert_news_to_correct_schema(news_data, len(news_data), crawled_at_of(key))
+
+
+def fetch_news_range(keys, client=None):
+    # keysのスナップショットを並列にダウンロードし、keysの順にニュースのリストを返すジェネレータ
+    # 同じURLのニュースは最初に出てきたもの（keysが新しい順であれば最新のもの）だけを返す
+    # 読み終わっていない結果がメモリに溜まりすぎないよう、先読みはスレッド数の2倍までにする
+    client = client or get_s3_client()
+    executor = get_fetch_executor()
+    pending_keys = iter(keys)
+    futures = deque()
+    seen_urls = set()
+
+    def submit_next():
+        key = next(pending_keys, None)
+        if key is not None:
+            futures.append((key, executor.submit(read_snapshot_news, key, client)))
+
+    for _ in range(settings.S3_FETCH_WORKERS * 2):
+        submit_next()
+    try:
+        while futures:
+            key, future = futures.popleft()
+            submit_next()
+            try:
+                news_list = future.result()
+            except Exception as e:
+                print(f"download {key} is failed ({e}).")
+                continue
+            unique_news_list = []
+            for news in news_list:
+                if news["url"] not in seen_urls:
+                    seen_urls.add(news["url"])
+                    unique_news_list.append(news)
+            if unique_news_list:
+                yield unique_news_list
+    finally:
+        # 途中で読むのをやめた場合（クライアントの切断など）は、始まっていないダウンロードを取り消す
+        for _, future in futures:
+            future.cancel()
+
+
+# 最新のニュースのキーのキャッシュ（毎リクエストでS3に問い合わせないようにする）
+_latest_cache = {"key": None, "expires_at": 0.0}
+_latest_lock = threading.Lock()
+
+
+def resolve_latest_news_key(client=None):
+    # 最新のニュースのキーを返す
+    # 1. プロセス内のキャッシュ（S3_LATEST_TTL_SECONDS秒の間有効）
+    # 2. クローラーが書き込んだポインタ（latest.json）。ポインタを更新せずに書き込まれた、より新しいスナップショットがあればそちら
+    # 3. ポインタがない場合は、日付で分けたキー（news/YYYY/MM/DD/）を接頭辞ごとに辿って最新のものを探す
+    # 4. 新しい形式のニュースがない場合は、バケット全体をページングしながら走査して最終更新日時が最新のものを探す
+    now = time.monotonic()
+    if _latest_cache["key"] is not None and now < _latest_cache["expires_at"]:
+        return _latest_cache["key"]
+
+    with _latest_lock:
+        if _latest_cache["key"] is not None and now < _latest_cache["expires_at"]:
+            return _latest_cache["key"]
+        client = client or get_s3_client()
+        key = read_latest_pointer(client)
+        if key is not None:
+            key = find_newer_snapshot_key(client, key) or key
+        else:
+            key = find_latest_snapshot_key(client)
+        if key is None:
+            key = scan_latest_news_key(client)
+        _latest_cache.update(key=key, expires_at=time.monotonic() + settings.S3_LATEST_TTL_SECONDS)
+        return key
+
+
+def read_latest_pointer(client):
+    # ポインタが指すキー。ポインタがない場合はNone（認証やネットワークのエラーはそのまま送出する）
+    try:
+        body = client.get_object(Bucket=s3_bucket, Key=LATEST_POINTER_KEY)["Body"].read()
+    except client.exceptions.NoSuchKey:
+        return None
+    return json.loads(body.decode("utf-8"))["key"]
+
+
+def find_newer_snapshot_key(client, key):
+    # keyより新しいスナップショットのうち最新のキー（ない場合はNone）
+    # ポインタを更新しない方法でアップロードされたスナップショットがあっても、古いニュースを返し続けないようにする
+    if is_snapshot_key(key):
+        # キーの辞書順が時刻順のため、keyより後のキーの一覧を1回取得するだけで分かる（通常は空）
+        keys = [
+            o["Key"]
+            for o in _list_all(client, SNAPSHOT_PREFIX, "Contents", StartAfter=key)
+            if is_snapshot_key(o["Key"])
+        ]
+        return max(keys) if keys else None
+    latest_key = find_latest_snapshot_key(client)
+    if latest_key is not None and crawled_stamp(latest_key) > crawled_stamp(key):
+        return latest_key
+    return None
+
+
+def crawled_stamp(key):
+    # 新旧どちらの形式のキーでも、クローリングした日時の文字列（%Y年%m月%d日%H時%M分%S秒。辞書順が時刻順）
+    if is_snapshot_key(key):
+        return crawled_at_of(key)
+    return key.split("/")[-1][len("news_") : -len(".json")]
+
+
+def find_latest_snapshot_key(client):
+    # news/ -> news/YYYY/ -> news/YYYY/MM/ -> news/YYYY/MM/DD/ の順に、辞書順で最大の接頭辞を辿る
+    # キーの辞書順が時刻順のため、バケット全体を走査せずに数回の一覧の取得で最新のキーが分かる
+    prefix = SNAPSHOT_PREFIX
+    for _ in range(3):
+        prefixes = [p["Prefix"] for p in _list_all(client, prefix, "CommonPrefixes", Delimiter="/")]
+        if not prefixes:
+            return None
+        prefix = max(prefixes)
+    keys = [o["Key"] for o in _list_all(client, prefix, "Contents") if is_snapshot_key(o["Key"])]
+    return max(keys) if keys else None
+
+
+def _list_all(client, prefix, field, **kwargs):
+    kwargs.update(Bucket=s3_bucket, Prefix=prefix)
+    while True:
+        objs = client.list_objects_v2(**kwargs)
+        yield from objs.get(field, [])
+        if not objs.get("IsTruncated"):
+            return
+        kwargs["ContinuationToken"] = objs["NextContinuationToken"]
+
+
+def scan_latest_news_key(client):
+    # list_objects_v2は1回で最大1000件しか返さないため、続きがある限りページングする
+    download_target_file = None
+    modified_datetime_mid = None
+    kwargs = {"Bucket": s3_bucket}
+    while True:
+        objs = client.list_objects_v2(**kwargs)
+        for o in objs.get("Contents", []):
+            if not is_news_key(o.get("Key")):
+                continue
+            # 最新更新日時のファイルにターゲットを移動する
+            if modified_datetime_mid is None or modified_datetime_mid <= o.get("LastModified"):
+                modified_datetime_mid = o.get("LastModified")
+                download_target_file = o.get("Key")
+        if not objs.get("IsTruncated"):
+            break
+        kwargs["ContinuationToken"] = objs["NextContinuationToken"]
+    return download_target_file
+
+
+def is_news_key(key):
+    # ポインタや、事前計算した推薦結果のファイルはニュースではない
+    if is_snapshot_key(key):
+        return True
+    return key != LATEST_POINTER_KEY and key.endswith(".json") and not key.endswith(".recommend.json")
+
+
+def publish_latest_pointer(key, client=None):
+    # ニュースをアップロードした後に呼び出し、最新のニュースのキーをポインタに書き込む
+    client = client or get_s3_client()
+    pointer = {"key": key, "updated_at": datetime.now(timezone.utc).isoformat()}
+    client.put_object(
+        Bucket=s3_bucket,
+        Key=LATEST_POINTER_KEY,
+        Body=json.dumps(pointer).encode("utf-8"),
+        ContentType="application/json",
+    )
+    _latest_cache.update(key=key, expires_at=time.monotonic() + settings.S3_LATEST_TTL_SECONDS)
+
+
+def upload_news_snapshot(file_path, key, client=None):
+    # クローリングしたニュースのファイルをアップロードし、ポインタを更新する
+    client = client or get_s3_client()
+    content_type = CONTENT_TYPES.get(compression_of(key), "application/json")
+    with open(file_path, "rb") as f:
+        client.put_object(Bucket=s3_bucket, Key=key, Body=f.read(), ContentType=content_type)
+    publish_latest_pointer(key, client)
+    print(f"upload {key} is completed.")
+
+
 def convert_news_to_correct_schema(news_data, limit, crawled_at):
     news_array = []
 
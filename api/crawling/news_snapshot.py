@@ -0,0 +1,137 @@
+import gzip
+import json
+import os
+import re
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from api.utils.json_stream import read_object_items
+
+try:
+    import zstandard
+except ImportError:  # zstdは任意（インストールされていない場合はgzipのみ使える）
+    zstandard = None
+
+# クローリングしたニュースのスナップショットの形式
+# ・新しい形式: 1行に1件のニュースを書いたJSON Linesをgzipまたはzstdで圧縮し、
+#   日付で分けたキー（news/YYYY/MM/DD/HHMMSS.jsonl.gz）に置く
+#   キーの辞書順が時刻順になるため、最新のスナップショットは接頭辞ごとの一覧で探せる
+# ・以前の形式: {"news0": {...}, "news1": {...}} をindent=4で書いたJSON（news_<日時>.json）
+# 読み込みはどちらの形式でも {"news0": {...}, ...} の辞書を返す
+# キー・ファイル名の日時は、実行するマシンのタイムゾーンによらず日本時間（SNAPSHOT_TIMEZONE）で書く
+SNAPSHOT_TIMEZONE = timezone(timedelta(hours=9))
+SNAPSHOT_PREFIX = "news/"
+EXTENSIONS = {"gz": ".jsonl.gz", "zst": ".jsonl.zst"}
+CONTENT_TYPES = {"gz": "application/gzip", "zst": "application/zstd"}
+# 拡張子を除いたキーの書式（辞書順で比較すると時刻順になる）
+STAMP_FORMAT = "news/%Y/%m/%d/%H%M%S"
+ZSTD_LEVEL = 10
+READ_CHUNK_BYTES = 64 * 1024
+# 一度に展開する圧縮データの大きさ（展開後のデータが一度に大きくなりすぎないようにする）
+DECOMPRESS_INPUT_BYTES = 4 * 1024
+
+_KEY_PATTERN = re.compile(r"news/(\d{4})/(\d{2})/(\d{2})/(\d{6})\.jsonl\.(gz|zst)$")
+
+
+def snapshot_now():
+    # キー・ファイル名に使う現在の日時（SNAPSHOT_TIMEZONEのnaiveなdatetime）
+    return datetime.now(SNAPSHOT_TIMEZONE).replace(tzinfo=None)
+
+
+def to_snapshot_time(value):
+    # キーと比べる日時にする。タイムゾーン付きの日時はSNAPSHOT_TIMEZONEに変換し、naiveな日時はSNAPSHOT_TIMEZONEの日時とみなす
+    if value.tzinfo is not None:
+        value = value.astimezone(SNAPSHOT_TIMEZONE).replace(tzinfo=None)
+    return value
+
+
+def snapshot_key(crawled_at, compression="gz"):
+    return crawled_at.strftime(STAMP_FORMAT) + EXTENSIONS[compression]
+
+
+def compression_of(key):
+    # 新しい形式のキー・パスであれば圧縮方式（"gz"/"zst"）を、以前の形式であればNoneを返す
+    for compression, extension in EXTENSIONS.items():
+        if key.endswith(extension):
+            return compression
+    return None
+
+
+def is_snapshot_key(key):
+    return _KEY_PATTERN.search(key) is not None
+
+
+def crawled_at_of(key):
+    # キーからクローリングした日時を、以前のファイル名と同じ書式の文字列で返す
+    year, month, day, hms, _ = _KEY_PATTERN.search(key).groups()
+    crawled_at = datetime.strptime(year + month + day + hms, "%Y%m%d%H%M%S")
+    return crawled_at.strftime("%Y年%m月%d日%H時%M分%S秒")
+
+
+def encode_snapshot(news_dict, compression):
+    lines = "".join(json.dumps(news, ensure_ascii=False) + "\n" for news in news_dict.values())
+    data = lines.encode("utf-8")
+    if compression == "gz":
+        return gzip.compress(data)
+    return _zstandard().ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+
+def write_snapshot(path, news_dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(encode_snapshot(news_dict, compression_of(path)))
+
+
+def iter_snapshot_news(chunks, compression):
+    # 圧縮されたJSON Linesを少しずつ展開し、ニュースを1件ずつ返す
+    decompress = _decompressor(compression)
+    pending = b""
+    for chunk in chunks:
+        for start in range(0, len(chunk), DECOMPRESS_INPUT_BYTES):
+            pending += decompress(chunk[start : start + DECOMPRESS_INPUT_BYTES])
+            lines = pending.split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+    if pending.strip():
+        yield json.loads(pending)
+
+
+def read_news_items(chunks, key, limit):
+    # 新旧どちらの形式でも、先頭からlimit件を {"news0": {...}, ...} にして返す
+    # limit件を読んだところで読み込みをやめる（Noneの場合は全て読む）
+    compression = compression_of(key)
+    if compression is None:
+        return read_object_items(chunks, limit)
+    items = {}
+    if limit is not None and limit <= 0:
+        return items
+    for num, news in enumerate(iter_snapshot_news(chunks, compression)):
+        items[f"news{num}"] = news
+        if limit is not None and len(items) >= limit:
+            break
+    return items
+
+
+def load_news_file(path):
+    # ローカルのニュースのファイルを全件読み込む
+    compression = compression_of(path)
+    if compression is None:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    with open(path, "rb") as f:
+        chunks = iter(lambda: f.read(READ_CHUNK_BYTES), b"")
+        return {f"news{num}": news for num, news in enumerate(iter_snapshot_news(chunks, compression))}
+
+
+def _decompressor(compression):
+    if compression == "gz":
+        return zlib.decompressobj(zlib.MAX_WBITS | 16).decompress
+    return _zstandard().ZstdDecompressor().decompressobj().decompress
+
+
+def _zstandard():
+    if zstandard is None:
+        raise RuntimeError("zstandard is not installed (pip install zstandard), use gzip instead")
+    return zstandard
@@ -0,0 +1,204 @@
+import os
+import time
+
+import numpy as np
+
+from api.doc2vec.search_engine import normalize_rows, top_k
+
+
+# 文書ベクトルに対する近似最近傍探索（ANN）のインデックス
+# IVF（inverted file）方式: 球面k-meansでベクトルをnlist個のクラスタに分け、
+# 検索時はクエリに近いnprobe個のクラスタに属するベクトルだけをコサイン類似度で採点する
+# インデックス（重心とクラスタごとの行番号）はモデルファイルの隣に保存して再利用する
+# ベクトル自体は持たず、検索エンジンのvectors(rows)で候補の行だけを取り出す
+# （精度を落とした検索エンジン（quantized_store）では候補の行だけがfloat32に戻り、行列全体の複製を持たない）
+INDEX_SUFFIX = ".ivf.npz"
+# 重心の学習に使うサンプル数の上限
+MAX_TRAINING_ROWS = 100000
+# 巨大な行列を一度に掛け算しないように分割する行数
+CHUNK_ROWS = 65536
+# 種類ごとのインデックスを作る行数の下限（これより少ない種類は範囲の全ての行を調べても十分速い）
+MIN_GROUP_ROWS = 10000
+
+
+class IvfIndex:
+    def __init__(self, centroids, order, offsets, fingerprint, nprobe=16):
+        self.centroids = centroids
+        # order: クラスタ順に並べた行番号、offsets: クラスタiの行はorder[offsets[i]:offsets[i + 1]]
+        self.order = order
+        self.offsets = offsets
+        self.fingerprint = fingerprint
+        self.nprobe = nprobe
+        # attachで設定する検索エンジンと、インデックスを作った範囲の先頭の行
+        self.engine = None
+        self.start = 0
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, engine, start=0, end=None, nlist=None, iterations=10, seed=0, nprobe=16):
+        # 検索エンジン（VectorSearchEngine）のstart〜endの範囲の行から作る
+        # 行はvectors(rows)でL2正規化済みのfloat32として取り出し、全体はCHUNK_ROWS行ずつ割り当てる
+        end = len(engine) if end is None else end
+        count = end - start
+        if nlist is None:
+            # クラスタ数を指定しない場合はベクトル数の平方根の4倍程度にする
+            nlist = max(1, int(4 * np.sqrt(count)))
+        nlist = min(nlist, count)
+        random = np.random.RandomState(seed)
+
+        if count > MAX_TRAINING_ROWS:
+            sample = np.sort(random.choice(count, MAX_TRAINING_ROWS, replace=False))
+            training = engine.vectors(start + sample)
+        else:
+            training = engine.vectors(slice(start, end))
+        centroids = training[random.choice(len(training), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = _assign(training, centroids)
+            counts = np.bincount(assignment, minlength=nlist)
+            filled = counts > 0
+            # クラスタ順に並べてから、クラスタごとのベクトルの和をまとめて計算する
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[filled]
+            sums = np.zeros_like(centroids)
+            sums[filled] = np.add.reduceat(
+                training[np.argsort(assignment, kind="stable")], starts, axis=0
+            )
+            # 空になったクラスタは学習データからランダムに選び直す
+            sums[~filled] = training[random.choice(len(training), int((~filled).sum()))]
+            centroids = normalize_rows(sums)
+
+        assignment = np.empty(count, dtype=np.int64)
+        for chunk_start in range(start, end, CHUNK_ROWS):
+            chunk = engine.vectors(slice(chunk_start, min(chunk_start + CHUNK_ROWS, end)))
+            assignment[chunk_start - start:chunk_start - start + len(chunk)] = _assign(chunk, centroids)
+        order = np.argsort(assignment, kind="stable").astype(np.int64)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignment, minlength=nlist))
+        index = cls(centroids, order, offsets, engine_fingerprint(engine, start, end), nprobe)
+        index.attach(engine, start)
+        return index
+
+    @classmethod
+    def load(cls, path, nprobe=16):
+        with np.load(path) as data:
+            return cls(
+                data["centroids"],
+                data["order"],
+                data["offsets"],
+                str(data["fingerprint"]),
+                nprobe,
+            )
+
+    def save(self, path):
+        # np.savezは拡張子.npzを自動で付けるため、ファイルオブジェクトに書き込む
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                order=self.order,
+                offsets=self.offsets,
+                fingerprint=np.array(self.fingerprint),
+            )
+
+    def attach(self, engine, start=0):
+        # 候補の行を取り出す検索エンジンと、インデックスの行番号0に当たる行を設定する
+        self.engine = engine
+        self.start = start
+
+    def search(self, normalized_queries, topn=10, nprobe=None):
+        # 各クエリについて (行番号の配列, スコアの配列) を返す
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        centroid_scores = normalized_queries @ self.centroids.T
+        probes = top_k(centroid_scores, nprobe)
+
+        results = []
+        for query, lists in zip(normalized_queries, probes):
+            slices = [slice(self.offsets[i], self.offsets[i + 1]) for i in lists]
+            positions = np.concatenate([np.arange(s.start, s.stop) for s in slices])
+            if len(positions) == 0:
+                results.append((np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)))
+                continue
+            rows = self.order[positions]
+            scores = self.engine.vectors(self.start + rows) @ query
+            best = top_k(scores[np.newaxis, :], topn)[0]
+            results.append((rows[best], scores[best]))
+        return results
+
+
+def index_path(model_path):
+    return model_path + INDEX_SUFFIX
+
+
+def group_index_path(model_path, group):
+    # 種類groupの範囲のインデックス（<モデル>.ivf.<種類>.npz）
+    return model_path + INDEX_SUFFIX[: -len(".npz")] + "." + group + ".npz"
+
+
+def load_or_build(path, engine, start=0, end=None, nlist=None, nprobe=16):
+    # 検索エンジンのstart〜endの範囲の行のインデックスを、保存済みで同じベクトルから作られたものであれば読み込む
+    # ない場合や、モデルが更新されていた場合は作り直して保存する
+    end = len(engine) if end is None else end
+    fingerprint = engine_fingerprint(engine, start, end)
+    if os.path.exists(path):
+        index = IvfIndex.load(path, nprobe)
+        if index.fingerprint == fingerprint:
+            index.attach(engine, start)
+            return index
+        print(f"### ANN index {path} is stale, rebuilding")
+
+    started = time.perf_counter()
+    index = IvfIndex.build(engine, start, end, nlist=nlist, nprobe=nprobe)
+    print(
+        "### ANN index built in %.2f sec (%d vectors, nlist=%d)"
+        % (time.perf_counter() - started, end - start, index.nlist)
+    )
+    try:
+        index.save(path)
+    except OSError as e:
+        print(f"### failed to save ANN index to {path}: {e}")
+    return index
+
+
+def load_or_build_groups(model_path, engine, min_rows=MIN_GROUP_ROWS, nlist=None, nprobe=16):
+    # group_byで並べ替えた検索エンジンに、種類ごとの範囲の行だけから作ったインデックスを付ける
+    # 全体のインデックスでは種類を指定した検索（search_groups）を絞り込めないため、種類ごとに作る
+    for group, (start, end) in engine.groups.items():
+        if group is None or end - start < min_rows:
+            continue
+        index = load_or_build(
+            group_index_path(model_path, group), engine, start, end, nlist, nprobe
+        )
+        engine.attach_group_index(group, index)
+    return engine
+
+
+def matrix_fingerprint(matrix):
+    # 行列の形と、一部の行から計算したチェックサムで、インデックスが古くなっていないかを判定する
+    # 行の順番が変わった場合（group_byで並べ替えた場合など）も変わるよう、行の位置で重み付けした和も含める
+    step = max(1, len(matrix) // 1024)
+    return _fingerprint(len(matrix), matrix[::step])
+
+
+def engine_fingerprint(engine, start=0, end=None):
+    # 検索エンジンのstart〜endの範囲の行のmatrix_fingerprint（一部の行だけを取り出して計算する）
+    end = len(engine) if end is None else end
+    step = max(1, (end - start) // 1024)
+    return _fingerprint(end - start, engine.vectors(slice(start, end, step)))
+
+
+def _fingerprint(count, sample):
+    sample = np.asarray(sample, dtype=np.float64)
+    checksum = float(sample.sum())
+    weighted = float(np.arange(1, len(sample) + 1) @ sample.sum(axis=1))
+    return "%d:%d:%.6f:%.6f" % (count, sample.shape[1], checksum, weighted)
+
+
+def _assign(vectors, centroids):
+    # 各ベクトルを最もコサイン類似度が高い重心に割り当てる
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), CHUNK_ROWS):
+        chunk = vectors[start:start + CHUNK_ROWS]
+        assignment[start:start + CHUNK_ROWS] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignment
@@ -0,0 +1,59 @@
+import numpy as np
+
+import api.settings as settings
+from api.doc2vec import fast_infer
+from api.doc2vec import model_registry
+from api.doc2vec import sparse_engine
+
+
+# ニュースに類似する本を求める検索方法（バックエンド）
+# どちらも「語彙素からクエリを作る（encode）」「クエリをまとめて検索する（search）」の2つで使える
+# ・Doc2VecBackend: 語彙素からベクトルを推論し、文書ベクトルをコサイン類似度で検索する
+# ・SparseBackend: 語彙素のままBM25の転置インデックスで検索する（gensimを使わない）
+class Doc2VecBackend:
+    name = "doc2vec"
+    # 推論したベクトルと検索結果をvector_cacheに保存する
+    cacheable = True
+
+    def __init__(self, model, mode="infer", infer_params=None):
+        self.model = model
+        self.mode = mode
+        self.infer_params = infer_params or {}
+        self.engine = model_registry.get_search_engine()
+        self.fingerprint = model_registry.get_fingerprint()
+
+    def encode(self, lexemes):
+        return fast_infer.infer_vector(self.model, lexemes, self.mode, **self.infer_params)
+
+    def search(self, queries, topn=1):
+        return self.engine.search(np.array(queries), topn=topn)
+
+
+class SparseBackend:
+    name = "sparse"
+    # 検索が速いため、キャッシュは使わない
+    cacheable = False
+
+    def __init__(self, engine=None):
+        self.engine = engine or sparse_engine.get_engine()
+        self.fingerprint = None
+
+    def encode(self, lexemes):
+        return lexemes
+
+    def search(self, queries, topn=1):
+        return self.engine.search(list(queries), topn=topn)
+
+
+def get_backend(mode="infer", infer_params=None):
+    # 設定（SIMILARITY_BACKEND）のバックエンドを返す
+    # Doc2Vecの場合、SIMILARITY_FALLBACKが有効であれば、モデルの読み込み中や読み込みに失敗した場合に
+    # 読み込みを待たずにBM25で検索する（無効の場合は今まで通り読み込みを待つ）
+    if settings.SIMILARITY_BACKEND == "sparse":
+        return SparseBackend()
+    if not settings.SIMILARITY_FALLBACK:
+        return Doc2VecBackend(model_registry.get_model(), mode, infer_params)
+    model = model_registry.try_get_model()
+    if model is None:
+        return SparseBackend()
+    return Doc2VecBackend(model, mode, infer_params)
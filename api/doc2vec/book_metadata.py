@@ -0,0 +1,156 @@
+import glob
+import json
+import os
+import sqlite3
+import threading
+from argparse import ArgumentParser
+
+import api.settings as settings
+
+
+# 推薦結果に表示する本の情報（タイトル、著者、説明など）をまとめたストア
+# リクエストのたびに api/json/id_<ISBN>.json を開いて読むのではなく、
+# 事前にSQLiteのファイルへ切り詰め済みの値をまとめておき、起動後に一度だけメモリに読み込む
+# ストアには作ったときのid_*.jsonのファイル数と最終更新時刻を記録しておき、JSONが追加・編集・削除されていれば作り直す
+# 表示用に切り詰める文字数
+FIELD_LENGTH = 150
+COLUMNS = ("title", "author", "description", "publisher", "published_year", "location", "isbn")
+
+
+def build_store(json_dir, db_path):
+    # api/json配下のid_*.jsonからストアのファイルを作る（作り終わってから置き換える）
+    json_files = sorted(glob.glob(os.path.join(json_dir, "id_*.json")))
+    fingerprint = source_fingerprint(json_files)
+    rows = []
+    for json_file in json_files:
+        with open(json_file, "r") as json_f:
+            json_dict = json.load(json_f)
+        # ファイル名 id_<ISBN>.json から、Doc2Vecのタグ（ID:<ISBN>）を作る
+        tag = "ID:" + os.path.basename(json_file)[3:-5]
+        rows.append((tag,) + _explanation_columns(json_dict))
+
+    tmp_path = db_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    connection = sqlite3.connect(tmp_path)
+    try:
+        connection.execute(
+            "CREATE TABLE books (tag TEXT PRIMARY KEY, %s)"
+            % ", ".join(f"{column} TEXT" for column in COLUMNS)
+        )
+        connection.executemany(
+            "INSERT INTO books VALUES (%s)" % ", ".join("?" * (len(COLUMNS) + 1)), rows
+        )
+        connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        connection.execute("INSERT INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(tmp_path, db_path)
+    print(f"### book metadata store {db_path} built from {len(rows)} files")
+    return len(rows)
+
+
+def source_fingerprint(json_files):
+    # id_*.jsonのファイル数と最終更新時刻の最大値（追加・削除は数、編集は時刻の変化でわかる）
+    mtimes = [os.stat(json_file).st_mtime_ns for json_file in json_files]
+    return "%d:%d" % (len(mtimes), max(mtimes, default=0))
+
+
+def stored_fingerprint(db_path):
+    # ストアを作ったときのfingerprint（ファイルがない、または記録していない古いストアの場合はNone）
+    if not os.path.exists(db_path):
+        return None
+    connection = sqlite3.connect(db_path)
+    try:
+        row = connection.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        connection.close()
+    return row[0] if row else None
+
+
+def read_json_book(json_dir, tag):
+    # ストアにない本を、id_<ISBN>.jsonから直接読む（ファイルもない場合はNone）
+    json_file = os.path.join(json_dir, "id_" + tag[3:] + ".json")
+    if not os.path.exists(json_file):
+        return None
+    with open(json_file, "r") as json_f:
+        return dict(zip(COLUMNS, _explanation_columns(json.load(json_f))))
+
+
+def _explanation_columns(json_dict):
+    return (
+        json_dict["title"],
+        json_dict["biblio_authors"],
+        json_dict["description"][0:FIELD_LENGTH],
+        json_dict["biblio_publisher"][0:FIELD_LENGTH],
+        json_dict["biblio_year_published"][0:FIELD_LENGTH],
+        json_dict["biblio_location"][0:FIELD_LENGTH],
+        json_dict["identifier"][0:FIELD_LENGTH],
+    )
+
+
+class BookMetadataStore:
+    def __init__(self, db_path, json_dir=None):
+        self.db_path = db_path
+        # ストアのファイルがない場合や、JSONが更新されている場合は、このディレクトリから作る
+        self.json_dir = json_dir
+        self._books = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        # 初回のみファイルから読み込み、以降はタグをキーにした辞書で引く
+        if self._books is not None:
+            return self._books
+        with self._lock:
+            if self._books is None:
+                if self.json_dir and self.is_stale():
+                    build_store(self.json_dir, self.db_path)
+                connection = sqlite3.connect(self.db_path)
+                try:
+                    rows = connection.execute(
+                        "SELECT tag, %s FROM books" % ", ".join(COLUMNS)
+                    ).fetchall()
+                finally:
+                    connection.close()
+                self._books = {row[0]: dict(zip(COLUMNS, row[1:])) for row in rows}
+        return self._books
+
+    def is_stale(self):
+        json_files = glob.glob(os.path.join(self.json_dir, "id_*.json"))
+        return stored_fingerprint(self.db_path) != source_fingerprint(json_files)
+
+    def get(self, tag):
+        # ストアを作った後に追加された本は、JSONファイルから読む（どちらにもない場合はNone）
+        book = self.load().get(tag)
+        if book is None and self.json_dir and tag.startswith("ID:"):
+            book = read_json_book(self.json_dir, tag)
+        return book
+
+    def get_many(self, tags):
+        return [self.get(tag) for tag in tags]
+
+
+_store = None
+
+
+def get_store():
+    # プロセス内で共有するストア
+    global _store
+    if _store is None:
+        _store = BookMetadataStore(settings.BOOK_METADATA_PATH, settings.BOOK_JSON_DIR)
+    return _store
+
+
+def parse_args():
+    parser = ArgumentParser(description="build the book metadata store from id_*.json files")
+    parser.add_argument("--json-dir", dest="json_dir", default=settings.BOOK_JSON_DIR)
+    parser.add_argument("--db", dest="db_path", default=settings.BOOK_METADATA_PATH)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    build_store(args.json_dir, args.db_path)
@@ -0,0 +1,77 @@
+import threading
+
+import numpy as np
+
+from api.doc2vec.search_engine import normalize_rows
+
+
+# infer_vectorを使わない、単語ベクトルの重み付き平均による高速な推論
+# モデルはdbow_words=1で単語ベクトルも文書ベクトルと同じ空間で学習しているため、
+# 正規化した単語ベクトルをIDFで重み付けして平均したものを、文書ベクトルの近似として検索に使える
+# infer_vectorのような学習ループがないため、1件あたり語彙素の数だけの足し算で済む
+MODES = ("infer", "fast")
+
+_lock = threading.Lock()
+_encoders = {}
+
+
+class WordAverageEncoder:
+    def __init__(self, words, vectors, counts=None, doc_count=None):
+        self.word_index = {word: i for i, word in enumerate(words)}
+        # C連続・float32・L2正規化済みの単語ベクトル
+        self.matrix = normalize_rows(vectors)
+        if counts is None:
+            self.idf = np.ones(len(self.matrix), dtype=np.float32)
+        else:
+            self.idf = idf_weights(counts, doc_count)
+
+    @classmethod
+    def from_model(cls, model):
+        # gensimのDoc2Vecから作る。コーパスでの出現回数がない場合は重みを全て1にする
+        # （gensimのVocabは出現回数がないと0になる。出現回数のない推論用のファイルから読み込んだ場合など）
+        words = model.wv.index2word
+        counts = [getattr(model.wv.vocab[word], "count", 0) for word in words]
+        if not any(counts):
+            counts = None
+        return cls(words, model.wv.vectors, counts, len(model.docvecs.vectors_docs))
+
+    def encode(self, lexemes):
+        # 語彙にある語彙素のベクトルの重み付き平均（語彙にない語彙素しかない場合はNone）
+        indices = [self.word_index[lexeme] for lexeme in lexemes if lexeme in self.word_index]
+        if not indices:
+            return None
+        weights = self.idf[indices]
+        return weights @ self.matrix[indices] / weights.sum()
+
+
+def idf_weights(counts, doc_count):
+    # gensimの語彙は文書頻度ではなくコーパス全体での出現回数しか持たないため、出現回数で近似したIDF
+    # log((文書数 + 1) / (出現回数 + 1)) + 1（どの単語も重みが正になるようにする）
+    counts = np.asarray(counts, dtype=np.float64)
+    return (np.log((doc_count + 1) / (counts + 1)) + 1.0).clip(min=1e-3).astype(np.float32)
+
+
+def get_encoder(model):
+    # モデルごとに一度だけ作る（正規化済みの単語ベクトルの行列を持つため、最初に使うときに作る）
+    key = id(model)
+    encoder = _encoders.get(key)
+    if encoder is not None and encoder[0] is model:
+        return encoder[1]
+    with _lock:
+        encoder = _encoders.get(key)
+        if encoder is None or encoder[0] is not model:
+            encoder = (model, WordAverageEncoder.from_model(model))
+            _encoders[key] = encoder
+    return encoder[1]
+
+
+def infer_vector(model, lexemes, mode="infer", **infer_params):
+    # mode="fast"の場合は単語ベクトルの平均を、"infer"の場合（または語彙にない語彙素しかない場合）は
+    # gensimのinfer_vectorを使う
+    if mode not in MODES:
+        raise ValueError(f"unknown inference mode {mode!r} (expected one of {MODES})")
+    if mode == "fast":
+        vector = get_encoder(model).encode(lexemes)
+        if vector is not None:
+            return vector
+    return model.infer_vector(lexemes, **infer_params)
@@ -0,0 +1,187 @@
+import resource
+import threading
+import time
+
+import api.settings as settings
+from api.doc2vec.search_engine import VectorSearchEngine
+from api.doc2vec import ann_index
+from api.doc2vec import quantized_store
+from api.doc2vec import slim_model
+from api.doc2vec.vector_cache import file_fingerprint
+
+
+# プロセス内で共有するDoc2Vecモデルのレジストリ
+# リクエストごとにモデルを読み込むのではなく、起動時に一度だけ読み込んで同じインスタンスを使い回す
+_lock = threading.Lock()
+_models = {}
+_engines = {}
+_fingerprints = {}
+_reports = {}
+# 読み込み中のモデルと、読み込みに失敗したモデルの例外（try_get_modelで待たずに判定するため）
+_loading = set()
+_errors = {}
+
+
+def get_model(model_path=None):
+    # 読み込み済みのモデルを返す。未読み込みの場合のみディスクから読み込む
+    model_path = model_path or settings.DOC2VEC_MODEL_PATH
+    model = _models.get(model_path)
+    if model is not None:
+        return model
+
+    with _lock:
+        # 他のスレッドが先に読み込んでいる可能性があるためロック内で再確認する
+        if model_path not in _models:
+            _loading.add(model_path)
+            try:
+                _models[model_path] = _load(model_path)
+                _errors.pop(model_path, None)
+            except Exception as e:
+                _errors[model_path] = e
+                raise
+            finally:
+                _loading.discard(model_path)
+    return _models[model_path]
+
+
+def try_get_model(model_path=None):
+    # 読み込み済みのモデルを返す。読み込み中・読み込みに失敗した場合は待たずにNoneを返す
+    # まだ誰も読み込んでいない場合は、別スレッドで読み込みを始めてNoneを返す
+    model_path = model_path or settings.DOC2VEC_MODEL_PATH
+    model = _models.get(model_path)
+    if model is not None or model_path in _loading or model_path in _errors:
+        return model
+    # 同時に来たリクエストが何度も読み込みを始めないよう、スレッドを作る前に読み込み中にする
+    _loading.add(model_path)
+    threading.Thread(
+        target=_load_in_background, args=(model_path,), name="doc2vec-load", daemon=True
+    ).start()
+    return None
+
+
+def load_error(model_path=None):
+    # 読み込みに失敗した場合の例外（失敗していない場合はNone）
+    return _errors.get(model_path or settings.DOC2VEC_MODEL_PATH)
+
+
+def _load_in_background(model_path):
+    try:
+        get_model(model_path)
+    except Exception as e:
+        print(f"### failed to load model from {model_path}: {e!r}")
+    finally:
+        _loading.discard(model_path)
+
+
+def get_search_engine(model_path=None):
+    # モデルの文書ベクトルから作った検索エンジンを返す（モデルの読み込み時に一緒に作られる）
+    model_path = model_path or settings.DOC2VEC_MODEL_PATH
+    get_model(model_path)
+    return _engines[model_path]
+
+
+def get_fingerprint(model_path=None):
+    # 読み込んだモデルファイルの指紋（キャッシュのキーに使う）
+    model_path = model_path or settings.DOC2VEC_MODEL_PATH
+    get_model(model_path)
+    return _fingerprints[model_path]
+
+
+def load_report(model_path=None):
+    # モデル読み込みにかかった時間とメモリ使用量のレポートを返す
+    model_path = model_path or settings.DOC2VEC_MODEL_PATH
+    return _reports.get(model_path)
+
+
+def _load(model_path):
+    print(f"### load model from {model_path}")
+    rss_before = _max_rss_bytes()
+    started = time.perf_counter()
+
+    # ベクトルの配列はメモリマップで読み込み、複数リクエストで同じページを共有する
+    # 推論用に学習用の状態を除いたモデル（*.slim.npz）の場合はそちらから組み立てる
+    # （gensimの読み込みは重いため、slim_modelの中でモデルを読み込むときにimportする）
+    model = slim_model.load_model(model_path, mmap=settings.DOC2VEC_MMAP_MODE)
+    load_seconds = time.perf_counter() - started
+    _fingerprints[model_path] = file_fingerprint(model_path)
+    if settings.DOC2VEC_VECTOR_STORE:
+        # 精度を落とした文書ベクトルでは検索結果が変わりうるため、キャッシュのキーを分ける
+        _fingerprints[model_path] += ":" + settings.DOC2VEC_VECTOR_STORE
+
+    # 検索用の正規化済み行列もここで一度だけ作る
+    started = time.perf_counter()
+    if settings.DOC2VEC_VECTOR_STORE:
+        engine = quantized_store.load_or_export(model, model_path, settings.DOC2VEC_VECTOR_STORE)
+    else:
+        engine = VectorSearchEngine.from_docvecs(model.docvecs)
+    if settings.DOC2VEC_SEARCH_INDEX == "ivf":
+        engine.attach_index(
+            ann_index.load_or_build(
+                ann_index.index_path(model_path),
+                engine,
+                nprobe=settings.DOC2VEC_IVF_NPROBE,
+            )
+        )
+    _engines[model_path] = engine
+
+    report = {
+        "model_path": model_path,
+        "mmap": settings.DOC2VEC_MMAP_MODE,
+        "search_index": settings.DOC2VEC_SEARCH_INDEX,
+        "vector_store": settings.DOC2VEC_VECTOR_STORE or "float32",
+        "search_matrix_bytes": int(engine.nbytes),
+        "load_seconds": load_seconds,
+        "search_engine_build_seconds": time.perf_counter() - started,
+        "arrays": _array_report(model),
+        "max_rss_bytes_before": rss_before,
+        "max_rss_bytes_after": _max_rss_bytes(),
+    }
+    _reports[model_path] = report
+    print_report(report)
+    return model
+
+
+def _array_report(model):
+    # モデルが持つ主要な配列のサイズと、メモリマップされているかどうか
+    arrays = {
+        "wv.vectors": getattr(model.wv, "vectors", None),
+        "docvecs.vectors_docs": getattr(model.docvecs, "vectors_docs", None),
+        "trainables.syn1neg": getattr(model.trainables, "syn1neg", None),
+    }
+    report = {}
+    for name, array in arrays.items():
+        if array is None:
+            continue
+        report[name] = {
+            "shape": list(array.shape),
+            "bytes": int(array.nbytes),
+            "memory_mapped": type(array).__name__ == "memmap",
+        }
+    return report
+
+
+def _max_rss_bytes():
+    # Linuxではru_maxrssはKB単位
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def print_report(report):
+    print(
+        "### model loaded in %.2f sec, search engine built in %.2f sec (mmap=%s, max rss %.1f MB -> %.1f MB)"
+        % (
+            report["load_seconds"],
+            report["search_engine_build_seconds"],
+            report["mmap"],
+            report["max_rss_bytes_before"] / 1024 / 1024,
+            report["max_rss_bytes_after"] / 1024 / 1024,
+        )
+    )
+    for name, array in report["arrays"].items():
+        print(
+            "###   %s: shape=%s, %.1f MB, memory_mapped=%s"
+            % (name, array["shape"], array["bytes"] / 1024 / 1024, array["memory_mapped"])
+        )
+    print(
+        "###   search matrix: %s, %.1f MB"
+        % (report["vector_store"], report["search_matrix_bytes"] / 1024 / 1024)
+    )
@@ -0,0 +1,131 @@
+import glob
+import json
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+import api.settings as settings
+from api.crawling.news_snapshot import EXTENSIONS, compression_of, load_news_file
+
+
+# クローリング直後に、ニュースごとの類似する本をまとめて計算しておくパイプラインの処理
+# ニュースのJSON（news_<日時>.json）の隣に、ニュースのURLをキーにした結果（*.recommend.json）を書き出す
+# /news-similar-books はこのファイルの結果を返し、ファイルにないニュースだけをその場で推論する
+# 最新の結果ファイルはNEWS_RECOMMENDATIONS_DIRのポインタ（latest.recommend.json）が指すため、
+# リクエストのたびにこれまでの全ての結果ファイルを探さずに済む
+SUFFIX = ".recommend.json"
+LATEST_NAME = "latest" + SUFFIX
+# ポインタがない場合（ポインタを書く前の結果しかない場合）に、結果ファイルを探し直す間隔
+SCAN_SECONDS = 60.0
+
+
+def recommendations_path(news_path):
+    # news_<日時>.json -> news_<日時>.recommend.json, HHMMSS.jsonl.gz -> HHMMSS.recommend.json
+    compression = compression_of(news_path)
+    if compression is not None:
+        return news_path[: -len(EXTENSIONS[compression])] + SUFFIX
+    return os.path.splitext(news_path)[0] + SUFFIX
+
+
+def write_recommendations(news_path):
+    # 循環importと、クローラーからgensimを読み込まないようにここでimportする
+    import api.doc2vec.predict_similar_book as doc2vec
+    from api.doc2vec import backends
+    from api.doc2vec import model_registry
+    from api.crawling.get_from_s3 import convert_news_to_correct_schema
+
+    news_data = load_news_file(news_path)
+    news_list = convert_news_to_correct_schema(news_data, len(news_data), "")
+    # 計算しておく結果はどのmodeのリクエストにも返すため、常にDoc2Vecのinfer_vectorで求める
+    model = model_registry.get_model()
+    backend = backends.Doc2VecBackend(model, "infer", doc2vec.infer_vector_params())
+    books = doc2vec.predict_similar_books_by_news_list(news_list, backend=backend)
+
+    result = {
+        "model": model_registry.get_fingerprint(),
+        "books": {news["url"]: book for news, book in zip(news_list, books) if book is not None},
+    }
+    path = recommendations_path(news_path)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    print(f"### recommendations for {len(news_list)} news are written to {path}")
+    write_latest_pointer(path)
+    return path
+
+
+def write_latest_pointer(path):
+    # 最後に書き出した結果ファイルを、NEWS_RECOMMENDATIONS_DIRからの相対パスで記録する
+    directory = settings.NEWS_RECOMMENDATIONS_DIR
+    os.makedirs(directory, exist_ok=True)
+    pointer_path = os.path.join(directory, LATEST_NAME)
+    tmp_path = pointer_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"path": os.path.relpath(os.path.abspath(path), os.path.abspath(directory))}, f)
+    os.replace(tmp_path, pointer_path)
+
+
+_scanned = {"path": None, "at": None}
+
+
+def latest_recommendations_path():
+    # ポインタが指す最新の結果ファイル（結果がない場合はNone）
+    directory = settings.NEWS_RECOMMENDATIONS_DIR
+    try:
+        with open(os.path.join(directory, LATEST_NAME), "r", encoding="utf-8") as f:
+            return os.path.join(directory, json.load(f)["path"])
+    except FileNotFoundError:
+        pass
+    # ポインタがない場合は結果ファイルを探すが、SCAN_SECONDSの間は前回見つけたものを使う
+    # 圧縮したJSON Linesの結果は日付ごとのフォルダーにあるため、サブフォルダーも探す
+    now = time.monotonic()
+    if _scanned["at"] is None or now - _scanned["at"] >= SCAN_SECONDS:
+        files = [
+            f
+            for f in glob.glob(os.path.join(directory, "**", "*" + SUFFIX), recursive=True)
+            if os.path.basename(f) != LATEST_NAME
+        ]
+        _scanned.update(path=max(files, key=os.path.getmtime) if files else None, at=now)
+    return _scanned["path"]
+
+
+_loaded = {"path": None, "mtime": None, "books": {}}
+
+
+def load_latest_recommendations(model_fingerprint):
+    # 最新の結果ファイルを読み込み、ニュースのURLをキーにした本の辞書を返す
+    # ファイルが更新されていなければ前回読み込んだ内容を使う。別のモデルで計算した結果は使わない
+    path = latest_recommendations_path()
+    if path is None or not os.path.exists(path):
+        return {}
+    mtime = os.path.getmtime(path)
+    if _loaded["path"] != path or _loaded["mtime"] != mtime:
+        with open(path, "r", encoding="utf-8") as f:
+            result = json.load(f)
+        books = result["books"] if result.get("model") == model_fingerprint else {}
+        _loaded.update(path=path, mtime=mtime, books=books)
+    return _loaded["books"]
+
+
+def parse_args():
+    parser = ArgumentParser(description="precompute similar books for crawled news files")
+    parser.add_argument(
+        "news_files",
+        nargs="+",
+        help="news_<datetime>.json or news/YYYY/MM/DD/HHMMSS.jsonl.gz written by the crawler",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    failed = False
+    for news_file in args.news_files:
+        try:
+            write_recommendations(news_file)
+        except Exception as e:
+            print(f"### failed to precompute recommendations for {news_file}: {e}")
+            failed = True
+    sys.exit(1 if failed else 0)
@@ -1,88 +1,139 @@
-#!/usr/bin/python
-# coding: UTF-8
-
-import random
-import gensim
-from gensim.models.doc2vec import Doc2Vec
-from gensim.models.doc2vec import TaggedDocument
-import sys
-import atexit
-import os
-import readline
-import re
-import shlex
-from optparse import OptionParser
-import MeCab
-import json
-from api.utils.text import replaceTextFromNewsText, convert_full_width_to_half_width
-
-
-# @TODO: 全てreturn値や引数の型定義する
-def predict_similar_book_by_news(news):
-    text = news["title"] + news["summary"]
-    # 準備
-    model = Doc2Vec.load("api/doc2vec/d2v_ipsj_desc_0.model")
-    mt = MeCab.Tagger("mecab-ipadic-neologd")
-
-    lexemes = parse_text(text, mt)
-    lexemes = lexemes[:30]
-    print(lexemes)
-
-    # モデルを使うときではなく、新しい文章のベクトルを図るもの
-    # 単語なら不要、今まで出てきた単語の範囲で新しい文章のベクトルを予測する
-    vector = model.infer_vector(lexemes, alpha=0.1, min_alpha=0.0001, steps=10)  #
-    # positiveはニュースのコサイン類似度が高い1個出して、そのコサイン類似度の高い本を出力する
-    nominates = model.docvecs.most_similar(positive=[vector], topn=1)
-
-    for nominate in nominates:
-        explanation_dict = get_explanation(nominate)
-
-    return explanation_dict
-
-def parse_text(text, mecab_tag):
-    lexemes = []
-
-    text = convert_full_width_to_half_width(text)
-    print(text)
-
-    for line in mecab_tag.parse(text).split("\n"):
-        if line == "EOS" or line == "":
-            continue
-        words = re.split(r"[,\t]", line)
-        # 助詞が重要ではない
-        if words[2] == "サ変接続" and words[7] == "*":
-            pass  # print("zz " + line)
-        elif words[2] == "記号" or words[1] == "記号":
-            pass
-        elif words[1] == "助詞":
-            pass
-        else:
-            lexemes.append(words[0])
-    return lexemes
-
-# Get explanation from JSON text (out of Doc2Vec model)
-def get_explanation(nominate):
-    print(nominate)
-    word = nominate[0]
-    similarity = nominate[1]
-    # @TODO: ここはID以外も可能性があるのか確認する
-    if word[0:3] == "ID:":
-        json_file = "api/json/id_" + word[3:] + ".json"
-        # json_file = word[3:]
-        with open(json_file, "r") as json_f:
-            json_dict = json.load(json_f)
-        explanation_dict = {
-            "title": json_dict["title"],
-            "author": json_dict["biblio_authors"],
-            "description": json_dict["description"][0:150],
-            "publisher": json_dict["biblio_publisher"][0:150],
-            "published_year": json_dict["biblio_year_published"][0:150],
-            "location": json_dict["biblio_location"][0:150],
-            "isbn": json_dict["identifier"][0:150],
-            "similarity": similarity,
-        }
-    return explanation_dict
-
-
-# tt = "消される天安門事件の記憶。香港の大学、親中派が圧力。香港の大学で、民主化を求める学生らが北京で武力弾圧された1989年の天安門事件"
-# predict_similar_book_by_news(tt)
+#!/usr/bin/python
+# coding: UTF-8
+
+from concurrent.futures import ThreadPoolExecutor
+import api.settings as settings
+from api.utils import tokenizer
+from api.doc2vec import book_metadata
+from api.doc2vec import vector_cache
+from api.doc2vec import precompute
+from api.doc2vec import backends
+
+# 推論に使う語彙素の数と、infer_vectorのパラメータ
+MAX_LEXEMES = 30
+INFER_PARAMS = {"alpha": 0.1, "min_alpha": 0.0001, "steps": 10, "max_lexemes": MAX_LEXEMES}
+
+# 推論を並列に行うスレッドプール（読み込み済みのモデルを全スレッドで共有する）
+# gensimのinfer_vectorは学習ループの間GILを解放するため、スレッドで並列化できる
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.DOC2VEC_INFER_WORKERS)
+    return _executor
+
+
+# @TODO: 全てreturn値や引数の型定義する
+def predict_similar_book_by_news(news, mode=None):
+    return predict_similar_books_by_news_list([news], mode=mode)[0]
+
+
+def find_similar_books_by_news_list(news_list, mode=None, executor=None):
+    # クローリング後に計算しておいた結果があればそれを使い、ないニュースだけをその場で推論する
+    # （計算済みの結果はinfer_vectorで求めたもので、どちらの推論方法よりも速いため、modeによらず使う）
+    # Doc2Vecのモデルが読み込み中などでBM25で検索する場合は、計算済みの結果の指紋が合わないため使わない
+    backend = get_backend(mode)
+    precomputed = {}
+    if backend.name == "doc2vec":
+        precomputed = precompute.load_latest_recommendations(backend.fingerprint)
+    books = [precomputed.get(news["url"]) for news in news_list]
+    missing = [i for i, book in enumerate(books) if book is None]
+    predicted = predict_similar_books_by_news_list(
+        [news_list[i] for i in missing], executor=executor, backend=backend
+    )
+    for i, book in zip(missing, predicted):
+        books[i] = book
+    return books
+
+
+def predict_similar_books_by_news_list(news_list, executor=None, mode=None, backend=None):
+    # 複数のニュースに類似する本をまとめて求める（類似する本がないニュースはNone）
+    # 形態素解析と推論はスレッドプールで並列に行い、類似度の計算は1回の行列積で行う
+    # 推論済みのニュースはキャッシュの検索結果を使い、推論を省略する
+    # mode: "infer"（infer_vector）または "fast"（単語ベクトルの重み付き平均）。Noneの場合は設定に従う
+    # backend: 検索方法（api.doc2vec.backends）。Noneの場合は設定とモデルの読み込み状況から選ぶ
+    if not news_list:
+        return []
+    # 準備（モデルはプロセス内で一度だけ読み込んだものを使う）
+    backend = backend or get_backend(mode)
+    executor = executor or get_executor()
+    cache = vector_cache.get_cache() if backend.cacheable else None
+
+    keys = [news_cache_key(news, backend) for news in news_list] if cache else []
+    nominates_list = [None] * len(news_list)
+    for i, key in enumerate(keys):
+        cached = cache.get(key)
+        if cached is not None:
+            nominates_list[i] = cached[1]
+
+    missing = [i for i, nominates in enumerate(nominates_list) if nominates is None]
+    if missing:
+        queries = list(
+            executor.map(encode_news, [news_list[i] for i in missing], [backend] * len(missing))
+        )
+        # positiveはニュースのコサイン類似度が高い1個出して、そのコサイン類似度の高い本を出力する
+        found = backend.search(queries, topn=1)
+        for i, query, nominates in zip(missing, queries, found):
+            nominates_list[i] = nominates
+            if cache:
+                cache.put(keys[i], query, nominates)
+
+    # BM25で検索した場合、語彙素が1つも一致しないニュースは類似する本がない（None）
+    return [get_explanation(nominates[0]) if nominates else None for nominates in nominates_list]
+
+
+def get_backend(mode=None):
+    return backends.get_backend(mode or settings.DOC2VEC_INFER_MODE, infer_vector_params())
+
+
+def infer_vector_params():
+    # infer_vectorに渡すパラメータ
+    return {key: INFER_PARAMS[key] for key in ("alpha", "min_alpha", "steps")}
+
+
+def news_cache_key(news, backend):
+    # 推論・検索のパラメータと検索方法もキーに含め、設定を変えた場合は別のキーになるようにする
+    params = dict(INFER_PARAMS, topn=1, search_index=settings.DOC2VEC_SEARCH_INDEX)
+    if backend.mode != "infer":
+        # 以前から保存されているinfer_vectorの結果のキーは変えない
+        params["mode"] = backend.mode
+    return vector_cache.cache_key(news_text(news), backend.fingerprint, params)
+
+
+def news_text(news):
+    # キャッシュのキーと推論に使う、正規化したタイトル+要約（同じ文章ならキャッシュにヒットする）
+    return vector_cache.normalize_text(news["title"] + news["summary"])
+
+
+def encode_news(news, backend):
+    text = news_text(news)
+
+    lexemes = tokenizer.parse_text(text)
+    lexemes = lexemes[:MAX_LEXEMES]
+    print(lexemes)
+
+    # モデルを使うときではなく、新しい文章のベクトルを図るもの
+    # 単語なら不要、今まで出てきた単語の範囲で新しい文章のベクトルを予測する
+    # （BM25で検索する場合は語彙素のまま検索する）
+    return backend.encode(lexemes)
+
+# Get explanation from the book metadata store (out of Doc2Vec model)
+def get_explanation(nominate):
+    print(nominate)
+    word = nominate[0]
+    similarity = nominate[1]
+    # @TODO: ここはID以外も可能性があるのか確認する
+    if word[0:3] == "ID:":
+        # 本の情報は切り詰め済みの値がストアに入っているため、通常はJSONファイルは読まない
+        book = book_metadata.get_store().get(word)
+        if book is None:
+            raise KeyError(f"book {word} is not in the metadata store nor {settings.BOOK_JSON_DIR}")
+        explanation_dict = dict(book)
+        explanation_dict["similarity"] = similarity
+    return explanation_dict
+
+
+# tt = "消される天安門事件の記憶。香港の大学、親中派が圧力。香港の大学で、民主化を求める学生らが北京で武力弾圧された1989年の天安門事件"
+# predict_similar_book_by_news(tt)
@@ -0,0 +1,185 @@
+import os
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from api.doc2vec.search_engine import normalize_rows
+
+
+# 文書ベクトルの2次元の座標（可視化用）
+# 以前は検索結果のベクトルをそのまま返し、ブラウザで毎回t-SNEで2次元にしていた
+# L2正規化した文書ベクトルの主成分分析（PCA）の第1・第2主成分への射影を、全てのタグについて求めておき、
+# モデルファイルの隣（<モデル>.xy.npz）に保存して再利用する
+# モデルが更新された場合は、保存した主成分をそのまま使い、変わった行と新しい行だけを射影する
+# （座標の配置が変わらないため、前回の画面と比べやすい）。変わった行が多い場合は主成分を求め直す
+SUFFIX = ".xy.npz"
+# 変わった行の割合がこれを超えた場合（学習し直した場合など）は、主成分を求め直す
+REFIT_FRACTION = 0.3
+# 主成分の計算に使うサンプル数の上限
+MAX_TRAINING_ROWS = 200000
+# 巨大な行列を一度に掛け算しないように分割する行数
+CHUNK_ROWS = 65536
+
+
+class Projection:
+    def __init__(self, tags, coordinates, mean, components, digests):
+        self.tags = list(tags)
+        self.tag_index = {tag: i for i, tag in enumerate(self.tags)}
+        self.coordinates = coordinates  # (タグ数, 2)
+        self.mean = mean
+        # 第1・第2主成分（座標がおおむね-1〜1の範囲になるよう拡大・縮小してある）
+        self.components = components
+        # 各行のベクトルのダイジェスト（モデルが更新されたときに、変わった行を見つけるのに使う）
+        self.digests = digests
+
+    @classmethod
+    def fit(cls, tags, vectors, digests=None, seed=0):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        rows = np.arange(len(vectors))
+        if len(rows) > MAX_TRAINING_ROWS:
+            rows = np.sort(np.random.RandomState(seed).choice(rows, MAX_TRAINING_ROWS, replace=False))
+        sample = normalize_rows(vectors[rows]).astype(np.float64)
+        mean = sample.mean(axis=0)
+        sample -= mean
+        # 共分散行列の固有ベクトルのうち、固有値が大きい2つ
+        _, eigenvectors = np.linalg.eigh(sample.T @ sample)
+        components = eigenvectors[:, ::-1][:, :2].T
+        # 実行するたびに向きが反転しないよう、絶対値が最大の要素を正にする
+        signs = np.sign(components[np.arange(2), np.argmax(np.abs(components), axis=1)])
+        components *= signs[:, np.newaxis]
+        # 99%の点が-1〜1に入るようにする
+        scale = np.percentile(np.abs(sample @ components.T), 99, axis=0)
+        components /= np.maximum(scale, 1e-12)[:, np.newaxis]
+
+        if digests is None:
+            digests = row_digests(vectors)
+        projection = cls(tags, None, mean.astype(np.float32), components.astype(np.float32), digests)
+        projection.coordinates = projection.transform(vectors)
+        return projection
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                data["tags"].tolist(),
+                data["coordinates"],
+                data["mean"],
+                data["components"],
+                data["digests"],
+            )
+
+    def save(self, path):
+        # np.savezは拡張子.npzを自動で付けるため、ファイルオブジェクトに書き込む
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                tags=np.array(self.tags),
+                coordinates=self.coordinates,
+                mean=self.mean,
+                components=self.components,
+                digests=self.digests,
+            )
+
+    def __len__(self):
+        return len(self.tags)
+
+    @property
+    def nbytes(self):
+        return self.coordinates.nbytes + self.digests.nbytes
+
+    def transform(self, vectors):
+        # ベクトル（1件または複数件）の座標。入力した単語や概要のベクトルなど、タグのないベクトルにも使う
+        vectors = np.asarray(vectors, dtype=np.float32)
+        single = vectors.ndim == 1
+        if single:
+            vectors = vectors[np.newaxis, :]
+        coordinates = np.empty((len(vectors), 2), dtype=np.float32)
+        for start in range(0, len(vectors), CHUNK_ROWS):
+            chunk = normalize_rows(vectors[start:start + CHUNK_ROWS])
+            coordinates[start:start + CHUNK_ROWS] = (chunk - self.mean) @ self.components.T
+        return coordinates[0] if single else coordinates
+
+    def coordinates_of(self, tags):
+        return self.coordinates[[self.tag_index[tag] for tag in tags]]
+
+    def update(self, tags, vectors, digests):
+        # 前回と同じタグ・同じベクトルの行は座標をそのまま使い、変わった行と新しい行だけを射影する
+        # (新しいProjection, 変わった行数) を返す。変わった行が多く主成分を求め直す必要がある場合はNone
+        rows = np.array([self.tag_index.get(tag, -1) for tag in tags], dtype=np.int64)
+        same = rows >= 0
+        same[same] = self.digests[rows[same]] == digests[same]
+        changed = np.flatnonzero(~same)
+        if vectors.shape[1] != len(self.mean) or len(changed) > REFIT_FRACTION * len(tags):
+            return None, len(changed)
+        coordinates = np.empty((len(tags), 2), dtype=np.float32)
+        coordinates[same] = self.coordinates[rows[same]]
+        if len(changed):
+            coordinates[changed] = self.transform(np.asarray(vectors)[changed])
+        return Projection(tags, coordinates, self.mean, self.components, digests), len(changed)
+
+
+def projection_path(model_path):
+    return model_path + SUFFIX
+
+
+def row_digests(vectors):
+    # 各行のfloat32のビット列に固定の乱数を掛けて足し合わせた64ビットの値（オーバーフローは切り捨て）
+    vectors = np.asarray(vectors, dtype=np.float32)
+    weights = np.random.RandomState(0).randint(1, 2**62, size=vectors.shape[1], dtype=np.int64)
+    weights = weights.astype(np.uint64) * np.uint64(2) + np.uint64(1)
+    digests = np.empty(len(vectors), dtype=np.uint64)
+    for start in range(0, len(vectors), CHUNK_ROWS):
+        bits = np.ascontiguousarray(vectors[start:start + CHUNK_ROWS]).view(np.uint32)
+        digests[start:start + CHUNK_ROWS] = (bits.astype(np.uint64) * weights).sum(axis=1)
+    return digests
+
+
+def load_or_build(path, tags, vectors):
+    # 保存済みの座標を読み込み、モデルが更新されていた場合は変わった行だけを射影し直して保存する
+    # ない場合や、変わった行が多い場合は主成分から求め直して保存する
+    digests = row_digests(vectors)
+    projection = None
+    if os.path.exists(path):
+        cached = Projection.load(path)
+        projection, changed = cached.update(tags, vectors, digests)
+        if projection is not None and changed == 0 and len(cached) == len(tags):
+            return projection
+        if projection is not None:
+            print(f"### projection {path}: projected {changed} changed of {len(tags)} vectors")
+        else:
+            print(f"### projection {path} is stale ({changed} of {len(tags)} vectors changed), fitting again")
+
+    if projection is None:
+        started = time.perf_counter()
+        projection = Projection.fit(tags, vectors, digests)
+        print(
+            "### projection fitted in %.2f sec (%d vectors)"
+            % (time.perf_counter() - started, len(projection))
+        )
+    try:
+        projection.save(path)
+    except OSError as e:
+        print(f"### failed to save projection to {path}: {e}")
+    return projection
+
+
+def model_tags(model):
+    vectors = model.docvecs.vectors_docs
+    return [model.docvecs.index_to_doctag(i) for i in range(len(vectors))], vectors
+
+
+def parse_args():
+    parser = ArgumentParser(description="precompute 2-D coordinates of the doc vectors (PCA)")
+    parser.add_argument("model_paths", nargs="+", help="Doc2Vec models (or *.slim.npz)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from api.doc2vec import slim_model
+
+    args = parse_args()
+    for model_path in args.model_paths:
+        tags, vectors = model_tags(slim_model.load_model(model_path))
+        projection = load_or_build(projection_path(model_path), tags, vectors)
+        print("### wrote %s: %d tags" % (projection_path(model_path), len(projection)))
@@ -0,0 +1,238 @@
+import os
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+from api.doc2vec.search_engine import VectorSearchEngine, normalize_rows
+from api.doc2vec.ann_index import matrix_fingerprint
+
+
+# 文書ベクトルを精度を落として保存した、モデルとは別のファイル（<モデル>.float16.npz / <モデル>.int8.npz）
+# ・float16: 正規化済みのベクトルをそのままfloat16にする（float32の1/2）
+# ・int8: 正規化済みのベクトルをベクトルごとのスケール（最大の絶対値/127）で割って丸める（float32の約1/4）
+# 検索はQuantizedSearchEngineで、ブロックごとにfloat32に戻しながら行うため、float32の行列全体をメモリに持たない
+# （行列全体を戻すmatrixは持たず、行の取り出し（vectors）とブロックごとのスコア（scores）だけを提供する。
+# 近似最近傍探索のインデックスも候補の行だけをvectorsで取り出す）
+# float16はメモリを減らせるが、ブロックごとの変換の分だけfloat32より検索が遅い（api.benchmarks.quantized_search）
+# メモリを減らす場合は、誤差は大きいがさらに小さいint8を使う
+# 元のモデルの文書ベクトルは、メモリマップで読み込めば（DOC2VEC_MMAP_MODE）作り直しと指紋の計算のときしか読まない
+DTYPES = ("float16", "int8")
+# 一度にfloat32に戻す行数
+CHUNK_ROWS = 65536
+
+
+class QuantizedSearchEngine(VectorSearchEngine):
+    def __init__(self, tags, codes, scales, norms=None, fingerprint=None):
+        self.tags = list(tags)
+        self.tag_index = {tag: i for i, tag in enumerate(self.tags)}
+        self.codes = codes
+        self.scales = np.asarray(scales, dtype=np.float32)
+        # 元のベクトルのノルム（元の大きさのベクトルが必要な場合に使う）
+        self.norms = norms
+        # 元のモデルの文書ベクトルの指紋（モデルが更新されたかどうかの判定に使う）
+        self.fingerprint = fingerprint
+        self.ann_index = None
+        self.groups = {}
+        self.group_indexes = {}
+
+    @classmethod
+    def from_matrix(cls, tags, matrix, dtype, norms=None, fingerprint=None):
+        # matrixはL2正規化済みの行列（VectorSearchEngine.matrix）を想定している
+        codes, scales = quantize(matrix, dtype)
+        return cls(tags, codes, scales, norms, fingerprint)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                data["tags"].tolist(),
+                data["codes"],
+                data["scales"],
+                data["norms"],
+                str(data["fingerprint"]),
+            )
+
+    def save(self, path):
+        # np.savezは拡張子.npzを自動で付けるため、ファイルオブジェクトに書き込む
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                tags=np.array(self.tags),
+                codes=self.codes,
+                scales=self.scales,
+                norms=self.norms if self.norms is not None else np.ones(len(self.tags), np.float32),
+                fingerprint=np.array(self.fingerprint or ""),
+            )
+
+    @property
+    def dtype(self):
+        return self.codes.dtype.name
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scales.nbytes
+
+    def vector(self, tag):
+        i = self.tag_index[tag]
+        return self.vectors(slice(i, i + 1))[0]
+
+    def _take(self, order):
+        self.tags = [self.tags[i] for i in order]
+        self.tag_index = {tag: i for i, tag in enumerate(self.tags)}
+        self.codes = self.codes[order]
+        self.scales = self.scales[order]
+        if self.norms is not None:
+            self.norms = self.norms[order]
+
+    def vectors(self, rows):
+        # 指定した行（行番号の配列またはスライス）だけをfloat32に戻す
+        vectors = self.codes[rows].astype(np.float32)
+        if self.dtype == "int8":
+            vectors *= self.scales[rows, np.newaxis]
+        return vectors
+
+    def scores(self, normalized_queries, clip_start=0, clip_end=None):
+        # ブロックごとにfloat32に戻して行列積を計算し、int8の場合は行ごとのスケールを掛ける
+        codes = self.codes[clip_start:clip_end]
+        scales = self.scales[clip_start:clip_end]
+        scores = np.empty((len(normalized_queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), CHUNK_ROWS):
+            block = codes[start:start + CHUNK_ROWS].astype(np.float32)
+            scores[:, start:start + len(block)] = normalized_queries @ block.T
+        if self.dtype == "int8":
+            scores *= scales
+        return scores
+
+
+def quantize(matrix, dtype):
+    # (codes, ベクトルごとのスケール) を返す。float16のスケールは全て1
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if dtype == "float16":
+        return matrix.astype(np.float16), np.ones(len(matrix), dtype=np.float32)
+    if dtype == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0.0] = 1.0
+        codes = np.clip(np.rint(matrix / scales[:, np.newaxis]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"unsupported dtype {dtype!r} (expected one of {DTYPES})")
+
+
+def store_path(model_path, dtype):
+    return f"{model_path}.{dtype}.npz"
+
+
+def load_or_export(model, model_path, dtype):
+    # モデルの隣に保存した文書ベクトルのファイルを読み込む
+    # ない場合や、モデルが更新されていた場合は、読み込み済みのモデルから作り直して保存する
+    path = store_path(model_path, dtype)
+    fingerprint = matrix_fingerprint(model.docvecs.vectors_docs)
+    if os.path.exists(path):
+        engine = QuantizedSearchEngine.load(path)
+        if engine.fingerprint == fingerprint:
+            return engine
+        print(f"### vector store {path} is stale, exporting again")
+    engine = export(model, dtype)
+    try:
+        engine.save(path)
+    except OSError as e:
+        print(f"### failed to save vector store to {path}: {e}")
+    return engine
+
+
+def export(model, dtype):
+    # Doc2Vecモデルの文書ベクトルから、精度を落とした検索エンジンを作る
+    vectors = model.docvecs.vectors_docs
+    tags = [model.docvecs.index_to_doctag(i) for i in range(len(vectors))]
+    norms = np.linalg.norm(np.asarray(vectors, dtype=np.float32), axis=1).astype(np.float32)
+    return QuantizedSearchEngine.from_matrix(
+        tags, normalize_rows(vectors), dtype, norms, matrix_fingerprint(vectors)
+    )
+
+
+def accuracy_report(reference, engine, queries, topn=10):
+    # float32の検索エンジン（reference）の結果と比べた、上位topn件の一致率とメモリ
+    queries = normalize_rows(queries)
+    started = time.perf_counter()
+    expected = reference.search(queries, topn, exact=True)
+    reference_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    actual = engine.search(queries, topn, exact=True)
+    seconds = time.perf_counter() - started
+
+    overlaps = []
+    top1 = []
+    score_errors = []
+    for expected_row, actual_row in zip(expected, actual):
+        expected_tags = [tag for tag, _ in expected_row]
+        actual_scores = dict(actual_row)
+        overlaps.append(len(set(expected_tags) & set(actual_scores)) / len(expected_tags))
+        top1.append(expected_tags[0] == actual_row[0][0])
+        score_errors.extend(
+            abs(score - actual_scores[tag]) for tag, score in expected_row if tag in actual_scores
+        )
+    return {
+        "dtype": engine.dtype,
+        "vectors": len(reference),
+        "float32_bytes": int(reference.nbytes),
+        "bytes": int(engine.nbytes),
+        "saved_ratio": 1.0 - engine.nbytes / reference.nbytes,
+        "topn": topn,
+        "overlap": float(np.mean(overlaps)),
+        "top1_agreement": float(np.mean(top1)),
+        "max_score_error": float(max(score_errors)) if score_errors else 0.0,
+        "float32_search_ms": reference_seconds / len(queries) * 1000,
+        "search_ms": seconds / len(queries) * 1000,
+    }
+
+
+def print_report(report):
+    print(
+        "### %-7s %d vectors: %.1f MB -> %.1f MB (%.0f%% saved), overlap@%d %.3f, "
+        "top1 %.3f, max score error %.4f, search %.2f ms/query (float32 %.2f ms)"
+        % (
+            report["dtype"],
+            report["vectors"],
+            report["float32_bytes"] / 2**20,
+            report["bytes"] / 2**20,
+            report["saved_ratio"] * 100,
+            report["topn"],
+            report["overlap"],
+            report["top1_agreement"],
+            report["max_score_error"],
+            report["search_ms"],
+            report["float32_search_ms"],
+        )
+    )
+
+
+def sample_queries(matrix, count, noise=0.5, seed=0):
+    # 文書ベクトルにノイズを加えたものを、ニュースなどから推論したベクトルの代わりに使う
+    random = np.random.RandomState(seed)
+    rows = matrix[random.choice(len(matrix), min(count, len(matrix)), replace=False)]
+    scale = noise / np.sqrt(matrix.shape[1])
+    return rows + random.standard_normal(rows.shape).astype(np.float32) * scale
+
+
+def parse_args():
+    parser = ArgumentParser(description="export doc vectors as float16 / int8 and report accuracy")
+    parser.add_argument("model_path", help="Doc2Vec model file (d2v_ipsj_desc_*.model)")
+    parser.add_argument("--dtype", choices=DTYPES, nargs="+", default=list(DTYPES))
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--topn", type=int, default=10)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from gensim.models.doc2vec import Doc2Vec
+
+    args = parse_args()
+    model = Doc2Vec.load(args.model_path)
+    reference = VectorSearchEngine.from_docvecs(model.docvecs)
+    queries = sample_queries(reference.matrix, args.queries)
+    for dtype in args.dtype:
+        engine = export(model, dtype)
+        path = store_path(args.model_path, dtype)
+        engine.save(path)
+        print(f"### wrote {path}")
+        print_report(accuracy_report(reference, engine, queries, args.topn))
@@ -0,0 +1,178 @@
+import numpy as np
+
+
+# Doc2Vecの文書ベクトル（doc tag）に対する完全一致のコサイン類似度検索エンジン
+# gensimのmost_similarは検索のたびにノルムの計算と全件ソートを行うため、
+# モデル読み込み時に正規化済みの行列を一度だけ作り、行列積とargpartitionで上位k件を取り出す
+class VectorSearchEngine:
+    def __init__(self, tags, vectors):
+        self.tags = list(tags)
+        self.tag_index = {tag: i for i, tag in enumerate(self.tags)}
+        # C連続・float32・L2正規化済みの行列（BLASの行列積をそのまま使える形にしておく）
+        self.matrix = normalize_rows(vectors)
+        # 近似最近傍探索のインデックス（attach_indexで設定した場合のみ使う）
+        self.ann_index = None
+        # group_byで並べ替えた場合の、種類ごとの行の範囲 {種類: (開始行, 終了行)}
+        self.groups = {}
+        # 種類の範囲の行だけから作った近似最近傍探索のインデックス（attach_group_indexで設定した場合のみ使う）
+        self.group_indexes = {}
+
+    @classmethod
+    def from_docvecs(cls, docvecs):
+        # gensimのDoc2VecKeyedVectorsから、行番号順のタグと文書ベクトルを取り出して作る
+        vectors = docvecs.vectors_docs
+        tags = [docvecs.index_to_doctag(i) for i in range(len(vectors))]
+        return cls(tags, vectors)
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __contains__(self, tag):
+        return tag in self.tag_index
+
+    @property
+    def nbytes(self):
+        # 検索のために持つ行列の大きさ
+        return self.matrix.nbytes
+
+    def vector(self, tag):
+        return self.matrix[self.tag_index[tag]]
+
+    def vectors(self, rows):
+        # 指定した行（行番号の配列またはスライス）の正規化済みベクトル
+        return self.matrix[rows]
+
+    def attach_index(self, ann_index):
+        self.ann_index = ann_index
+
+    def attach_group_index(self, group, ann_index):
+        # search_groupsで種類groupを検索するときに使う（インデックスの行番号は種類の範囲の先頭からの位置）
+        self.group_indexes[group] = ann_index
+
+    def group_by(self, key):
+        # タグをkey(tag)の値（タグの種類）ごとに連続した行に並べ替え、種類ごとの行の範囲をgroupsに記録する
+        # その範囲だけを検索すれば、全件から多めに取って種類で絞り込まなくても、種類の中での正確な上位k件が求まる
+        # 行の順番が変わるため、近似最近傍探索のインデックスを付ける前（検索に使い始める前）に呼ぶ
+        if self.ann_index is not None or self.group_indexes:
+            raise ValueError("group_by must be called before attach_index")
+        rows_by_group = {}
+        for i, tag in enumerate(self.tags):
+            rows_by_group.setdefault(key(tag), []).append(i)
+        order = []
+        self.groups = {}
+        for group, rows in rows_by_group.items():
+            self.groups[group] = (len(order), len(order) + len(rows))
+            order.extend(rows)
+        self._take(np.array(order, dtype=np.int64))
+        return self
+
+    def _take(self, order):
+        self.tags = [self.tags[i] for i in order]
+        self.tag_index = {tag: i for i, tag in enumerate(self.tags)}
+        self.matrix = np.ascontiguousarray(self.matrix[order])
+
+    def search(self, queries, topn=10, clip_start=0, clip_end=None, exact=False):
+        # 1件（1次元）または複数件（2次元）のクエリベクトルに類似するタグを返す
+        # 複数件の場合は1回の行列積でまとめてスコアを計算する
+        queries = np.asarray(queries, dtype=np.float32)
+        single = queries.ndim == 1
+        if single:
+            queries = queries[np.newaxis, :]
+
+        # 範囲指定のない検索は、インデックスがあれば近似最近傍探索で行う
+        if self.ann_index is not None and not exact and clip_start == 0 and clip_end is None:
+            results = [
+                [(self.tags[i], float(score)) for i, score in zip(row_indices, row_scores)]
+                for row_indices, row_scores in self.ann_index.search(normalize_rows(queries), topn)
+            ]
+            return results[0] if single else results
+
+        scores = self.scores(normalize_rows(queries), clip_start, clip_end)
+        indices = top_k(scores, topn)
+        results = [
+            [(self.tags[clip_start + i], float(row_scores[i])) for i in row_indices]
+            for row_scores, row_indices in zip(scores, indices)
+        ]
+        return results[0] if single else results
+
+    def search_groups(self, queries, groups, topn=10):
+        # 指定した種類（group_byのkeyの値）の範囲だけを検索し、スコアの高い順にまとめて上位topn件を返す
+        # 種類のインデックスがある場合は近似最近傍探索で、ない場合は範囲の全ての行を調べる
+        queries = np.asarray(queries, dtype=np.float32)
+        single = queries.ndim == 1
+        if single:
+            queries = queries[np.newaxis, :]
+        merged = [[] for _ in range(len(queries))]
+        for group in dict.fromkeys(groups):
+            if group not in self.groups:
+                continue
+            start, end = self.groups[group]
+            index = self.group_indexes.get(group)
+            if index is None:
+                found = self.search(queries, topn, start, end, exact=True)
+            else:
+                found = [
+                    [(self.tags[start + i], float(score)) for i, score in zip(row_indices, row_scores)]
+                    for row_indices, row_scores in index.search(normalize_rows(queries), topn)
+                ]
+            for row, results in zip(merged, found):
+                row.extend(results)
+        results = [sorted(row, key=lambda result: -result[1])[:topn] for row in merged]
+        return results[0] if single else results
+
+    def scores(self, normalized_queries, clip_start=0, clip_end=None):
+        # 正規化済みクエリと clip_start〜clip_end の範囲の行とのコサイン類似度
+        return normalized_queries @ self.matrix[clip_start:clip_end].T
+
+    def rows_scores(self, normalized_queries, rows):
+        # 指定した行だけとのコサイン類似度（キーワードで絞り込んだ候補だけを採点する場合など）
+        return normalized_queries @ self.vectors(rows).T
+
+    def query_vector(self, positive=(), negative=()):
+        # gensimのmost_similarと同じく、正は+1、負は-1の重みで平均して正規化する
+        # （タグは正規化済みのベクトルを、ベクトルを直接渡した場合はそのままの値を使う）
+        weighted = [self._as_vector(item) for item in positive]
+        weighted += [-self._as_vector(item) for item in negative]
+        if not weighted:
+            raise ValueError("cannot compute similarity with no input")
+        return normalize_rows(np.array(weighted).mean(axis=0)[np.newaxis, :])[0]
+
+    def most_similar(self, positive=(), negative=(), topn=10, clip_start=0, clip_end=None, groups=None):
+        # gensimのdocvecs.most_similarの置き換え。入力にタグを渡した場合はそのタグを結果から除く
+        # groupsを指定した場合は、その種類（group_byのkeyの値）のタグだけを検索する
+        query = self.query_vector(positive, negative)
+        exclude = {item for item in list(positive) + list(negative) if isinstance(item, str)}
+        if groups is not None:
+            results = self.search_groups(query, groups, topn + len(exclude))
+        else:
+            results = self.search(query, topn + len(exclude), clip_start, clip_end)
+        return [result for result in results if result[0] not in exclude][:topn]
+
+    def _as_vector(self, item):
+        if isinstance(item, str):
+            return self.vector(item)
+        return np.asarray(item, dtype=np.float32)
+
+
+def normalize_rows(vectors):
+    # 各行をL2正規化したC連続のfloat32配列を返す（ゼロベクトルはゼロのまま）
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    return np.ascontiguousarray(vectors / norms, dtype=np.float32)
+
+
+def top_k(scores, k):
+    # 各行のスコア上位k件の列番号を、スコアの降順に並べて返す
+    # 全件ソートせず、argpartitionで上位k件を選んでからその中だけをソートする
+    count = scores.shape[1]
+    k = min(k, count)
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < count:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(count), (scores.shape[0], 1))
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=1)
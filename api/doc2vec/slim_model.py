@@ -0,0 +1,232 @@
+import json
+import os
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+
+# 推論（infer_vector）と文書ベクトルの検索だけに使う、学習用の状態を除いたモデル（<モデル>.slim.npz）
+# Doc2Vec.loadは語彙の出現回数やDoctagなどのPythonオブジェクトを全て復元するため、読み込みが遅くファイルも大きい
+# このファイルには推論と検索に必要な配列（単語ベクトル、syn1neg、負例サンプリングの累積表、
+# ダウンサンプリングの閾値、単語の出現回数、文書ベクトル）と設定だけを保存し、読み込み時にgensimのDoc2Vecを組み立て直す
+# infer_vectorはgensimの実装をそのまま使うため、同じ乱数の状態から推論すれば元のモデルと同じベクトルになる
+# 大きな配列はgensimと同じように別のファイル（<モデル>.slim.<名前>.npy）に保存し、mmapを指定した場合はメモリマップで読み込む
+SUFFIX = ".slim.npz"
+# 別のファイルに保存する配列
+MAPPED_ARRAYS = ("word_vectors", "syn1neg", "cum_table", "doc_vectors")
+# gensimは常に残す（ダウンサンプリングしない）単語のsample_intを2**32にする
+ALWAYS_KEEP = 2**32
+
+
+def slim_path(model_path):
+    return model_path + SUFFIX
+
+
+def array_path(path, name):
+    # <モデル>.slim.npz の配列nameを保存するファイル（<モデル>.slim.<name>.npy）
+    return path[: -len(".npz")] + "." + name + ".npy"
+
+
+def is_slim_path(path):
+    return path.endswith(SUFFIX)
+
+
+def export(model, path):
+    # 読み込み済みのDoc2Vecモデルから、推論用のファイルを書き出す
+    if model.hs:
+        raise ValueError("hierarchical softmax models are not supported (train with hs=0)")
+    if model.docvecs.max_rawint >= 0:
+        raise ValueError("models with plain int doc tags are not supported")
+
+    config = {
+        "vector_size": int(model.docvecs.vector_size),
+        "dm": int(model.dm),
+        "dm_mean": int(model.cbow_mean),
+        "dm_concat": int(model.dm_concat),
+        "dm_tag_count": int(model.dm_tag_count),
+        "dbow_words": int(getattr(model, "dbow_words", 0)),
+        "window": int(model.window),
+        "negative": int(model.negative),
+        "sample": float(model.vocabulary.sample),
+        "seed": int(model.trainables.seed),
+        "alpha": float(model.alpha),
+        "min_alpha": float(model.min_alpha),
+        "epochs": int(model.epochs),
+    }
+    words = model.wv.index2word
+    tags = model.docvecs.offset2doctag
+    arrays = {
+        "word_vectors": np.asarray(model.wv.vectors, dtype=np.float32),
+        "syn1neg": np.asarray(model.trainables.syn1neg, dtype=np.float32),
+        "cum_table": np.asarray(model.vocabulary.cum_table),
+        "doc_vectors": np.asarray(model.docvecs.vectors_docs, dtype=np.float32),
+    }
+    for name in MAPPED_ARRAYS:
+        np.save(array_path(path, name), arrays[name])
+    with open(path, "wb") as f:
+        np.savez(
+            f,
+            config=np.array(json.dumps(config)),
+            words=_encode_strings(words),
+            # 2**32（ALWAYS_KEEP）が入るため、32ビットには収まらない
+            sample_ints=np.array(
+                [model.wv.vocab[word].sample_int for word in words], dtype=np.uint64
+            ),
+            counts=np.array([model.wv.vocab[word].count for word in words], dtype=np.int64),
+            tags=_encode_strings(tags),
+            doc_counts=np.array(
+                [model.docvecs.doctags[tag].doc_count for tag in tags], dtype=np.int32
+            ),
+        )
+
+
+def load(path, mmap=None):
+    # 推論用のファイルからDoc2Vecを組み立てる（学習用の状態は持たないため、学習の続きはできない）
+    # mmap（"r"など）を指定すると、大きな配列をメモリマップで読み込み、同じファイルを読む複数のプロセスでページを共有する
+    from gensim.models.doc2vec import Doc2Vec, Doctag
+    from gensim.models.keyedvectors import Vocab
+
+    with np.load(path) as data:
+        config = json.loads(str(data["config"]))
+        words = _decode_strings(data["words"])
+        # 以前はuint32で保存していたため、2**32が0になっている（0はgensimが計算する値としては現れない）
+        sample_ints = data["sample_ints"].astype(np.uint64)
+        sample_ints[sample_ints == 0] = ALWAYS_KEEP
+        sample_ints = sample_ints.tolist()
+        # 単語の出現回数（fast_inferのIDFの重みに使う）
+        # 出現回数を保存する前のファイルにはないため、gensimのVocabの既定値（0）にする（IDFの重み付けは無効になる）
+        if "counts" in data.files:
+            counts = data["counts"].tolist()
+        else:
+            print(f"### {path} has no word counts, fast inference will not weight words by IDF; export it again")
+            counts = [0] * len(words)
+        tags = _decode_strings(data["tags"])
+        doc_counts = data["doc_counts"].tolist()
+        arrays = {name: data[name] for name in MAPPED_ARRAYS if name in data.files}
+
+    if arrays and mmap:
+        # 以前の形式（全ての配列を1つの.npzに保存したファイル）はメモリマップできない
+        print(f"### {path} stores all arrays in one file and cannot be memory-mapped; export it again")
+    for name in MAPPED_ARRAYS:
+        if name not in arrays:
+            arrays[name] = np.load(array_path(path, name), mmap_mode=mmap)
+    word_vectors = arrays["word_vectors"]
+    syn1neg = arrays["syn1neg"]
+    cum_table = arrays["cum_table"]
+    doc_vectors = arrays["doc_vectors"]
+
+    # 文書を渡さずに作ると、語彙の構築や学習を行わずにパラメータだけを持つモデルになる
+    model = Doc2Vec(
+        vector_size=config["vector_size"],
+        dm=config["dm"],
+        dm_mean=config["dm_mean"],
+        dm_concat=config["dm_concat"],
+        dm_tag_count=config["dm_tag_count"],
+        dbow_words=config["dbow_words"],
+        window=config["window"],
+        negative=config["negative"],
+        hs=0,
+        sample=config["sample"],
+        seed=config["seed"],
+        alpha=config["alpha"],
+        min_alpha=config["min_alpha"],
+        epochs=config["epochs"],
+        min_count=1,
+        workers=1,
+    )
+
+    model.wv.index2word = words
+    model.wv.vocab = {
+        word: Vocab(index=i, sample_int=sample_int, count=count)
+        for i, (word, sample_int, count) in enumerate(zip(words, sample_ints, counts))
+    }
+    model.wv.vectors = word_vectors
+    model.trainables.syn1neg = syn1neg
+    model.trainables.vectors_lockf = np.ones(len(words), dtype=np.float32)
+    model.vocabulary.cum_table = cum_table
+
+    model.docvecs.offset2doctag = tags
+    model.docvecs.doctags = {
+        tag: Doctag(i, 0, doc_count) for i, (tag, doc_count) in enumerate(zip(tags, doc_counts))
+    }
+    model.docvecs.max_rawint = -1
+    model.docvecs.count = len(tags)
+    model.docvecs.vectors_docs = doc_vectors
+    model.trainables.vectors_docs_lockf = np.ones(len(tags), dtype=np.float32)
+    return model
+
+
+def load_model(path, mmap=None):
+    # 推論用のファイル（*.slim.npz）とgensimのモデルファイルのどちらでも読み込む
+    if is_slim_path(path):
+        return load(path, mmap=mmap)
+    from gensim.models.doc2vec import Doc2Vec
+
+    return Doc2Vec.load(path, mmap=mmap)
+
+
+def model_files_bytes(model_path):
+    # gensimのモデルファイルと、大きな配列を分けて保存したファイル（<モデル>.*.npy）の合計
+    # （推論用のファイルの配列 <モデル>.slim.*.npy は含めない）
+    directory = os.path.dirname(model_path) or "."
+    name = os.path.basename(model_path)
+    slim_prefix = os.path.basename(slim_path(model_path))[: -len(".npz")] + "."
+    return sum(
+        os.path.getsize(os.path.join(directory, file_name))
+        for file_name in os.listdir(directory)
+        if file_name == name
+        or (
+            file_name.startswith(name + ".")
+            and file_name.endswith(".npy")
+            and not file_name.startswith(slim_prefix)
+        )
+    )
+
+
+def slim_files_bytes(path):
+    # 推論用のファイル（*.slim.npz）と、別に保存した配列のファイルの合計
+    return os.path.getsize(path) + sum(
+        os.path.getsize(array_path(path, name))
+        for name in MAPPED_ARRAYS
+        if os.path.exists(array_path(path, name))
+    )
+
+
+def _encode_strings(strings):
+    # 単語やタグは改行を含まないため、改行で連結したUTF-8のバイト列として保存する
+    return np.frombuffer("\n".join(strings).encode("utf-8"), dtype=np.uint8)
+
+
+def _decode_strings(array):
+    text = array.tobytes().decode("utf-8")
+    return text.split("\n") if text else []
+
+
+def parse_args():
+    parser = ArgumentParser(description="trim a Doc2Vec model to an inference-only artifact")
+    parser.add_argument(
+        "model_paths", nargs="+", help="models written by d2v_model_gen_onlydescript.py"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from gensim.models.doc2vec import Doc2Vec
+
+    args = parse_args()
+    for model_path in args.model_paths:
+        model = Doc2Vec.load(model_path)
+        path = slim_path(model_path)
+        export(model, path)
+        started = time.perf_counter()
+        load(path)
+        print(
+            "### wrote %s: %.1f MB -> %.1f MB, loaded in %.2f sec"
+            % (
+                path,
+                model_files_bytes(model_path) / 2**20,
+                slim_files_bytes(path) / 2**20,
+                time.perf_counter() - started,
+            )
+        )
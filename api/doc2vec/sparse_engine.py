@@ -0,0 +1,235 @@
+import glob
+import json
+import os
+import re
+import threading
+import time
+from argparse import ArgumentParser
+from collections import Counter
+
+import numpy as np
+
+import api.settings as settings
+from api.doc2vec.book_metadata import source_fingerprint
+from api.doc2vec.search_engine import top_k
+
+
+# 本の語彙素（id_*.jsonのlexemes）に対するBM25の検索エンジン
+# Doc2Vecと同じ入力から、語彙素ごとの転置インデックス（CSR形式の疎行列）を作っておき、
+# クエリの語彙素のポスティングだけを足し合わせてスコアを求める
+# gensimを使わず、保存したインデックス（npz）を読むだけで使えるため、起動はミリ秒単位で済む
+# Doc2Vecのモデルが読み込み中・読み込めない場合の代わりの検索方法として使う（api.doc2vec.backends）
+# インデックスには作ったときのid_*.jsonのファイル数・最終更新時刻と項目（fields）を記録しておき、変わっていれば作り直す
+K1 = 1.2
+B = 0.75
+# 所在・出版社などの書誌情報の項目を語に分ける区切り文字
+FIELD_SEPARATORS = re.compile(r"[\s　,，、;；:：/／・()（）\[\]]+")
+
+
+class SparseSearchEngine:
+    def __init__(self, tags, terms, indptr, doc_ids, weights, idf, fingerprint=""):
+        self.tags = list(tags)
+        self.terms = list(terms)
+        self.term_index = {term: i for i, term in enumerate(self.terms)}
+        # 語彙素iのポスティングは doc_ids[indptr[i]:indptr[i + 1]]（文書の行番号）と、
+        # 同じ範囲のweights（その文書でのBM25の重み）
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.idf = idf
+        # インデックスを作った元のファイルと項目（index_fingerprint）
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def from_documents(cls, tags, documents, k1=K1, b=B):
+        # documents: 文書ごとの語彙素のリスト
+        term_index = {}
+        postings = []
+        lengths = np.array([len(lexemes) for lexemes in documents], dtype=np.float32)
+        average_length = float(lengths.mean()) if len(lengths) else 0.0
+        for doc_id, lexemes in enumerate(documents):
+            for term, count in Counter(lexemes).items():
+                i = term_index.setdefault(term, len(term_index))
+                if i == len(postings):
+                    postings.append([])
+                postings[i].append((doc_id, count))
+
+        doc_count = len(documents)
+        indptr = np.zeros(len(postings) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(posting) for posting in postings])
+        doc_ids = np.empty(indptr[-1], dtype=np.int32)
+        counts = np.empty(indptr[-1], dtype=np.float32)
+        for i, posting in enumerate(postings):
+            doc_ids[indptr[i]:indptr[i + 1]] = [doc_id for doc_id, _ in posting]
+            counts[indptr[i]:indptr[i + 1]] = [count for _, count in posting]
+
+        # BM25のIDF（log(1 + (N - df + 0.5) / (df + 0.5))）と、文書の長さで正規化した語彙素の重み
+        document_frequencies = np.diff(indptr).astype(np.float32)
+        idf = np.log1p((doc_count - document_frequencies + 0.5) / (document_frequencies + 0.5))
+        norms = k1 * (1.0 - b + b * lengths[doc_ids] / max(average_length, 1e-6))
+        weights = np.repeat(idf, np.diff(indptr)) * counts * (k1 + 1.0) / (counts + norms)
+        return cls(
+            tags,
+            list(term_index),
+            indptr,
+            doc_ids,
+            weights.astype(np.float32),
+            (idf * (k1 + 1.0)).astype(np.float32),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                data["tags"].tolist(),
+                data["terms"].tolist(),
+                data["indptr"],
+                data["doc_ids"],
+                data["weights"],
+                data["idf"],
+                # 記録する前に保存したインデックスにはない
+                str(data["fingerprint"]) if "fingerprint" in data.files else "",
+            )
+
+    def save(self, path):
+        # np.savezは拡張子.npzを自動で付けるため、ファイルオブジェクトに書き込む
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                tags=np.array(self.tags),
+                terms=np.array(self.terms),
+                indptr=self.indptr,
+                doc_ids=self.doc_ids,
+                weights=self.weights,
+                idf=self.idf,
+                fingerprint=np.array(self.fingerprint),
+            )
+
+    def __len__(self):
+        return len(self.tags)
+
+    def search(self, queries, topn=10):
+        # 1件（語彙素のリスト）または複数件（語彙素のリストのリスト）のクエリに類似するタグを返す
+        # VectorSearchEngine.searchと同じ形式（スコアの降順の (タグ, スコア) のリスト）で返す
+        # クエリの語彙素を1つも含まない文書（スコア0）は返さないため、topn件より少ない（空の）場合がある
+        single = not queries or isinstance(queries[0], str)
+        if single:
+            queries = [queries]
+        scores = np.vstack([self.scores(lexemes) for lexemes in queries])
+        indices = top_k(scores, topn)
+        results = [
+            [(self.tags[i], float(row_scores[i])) for i in row_indices if row_scores[i] > 0.0]
+            for row_scores, row_indices in zip(scores, indices)
+        ]
+        return results[0] if single else results
+
+    def scores(self, lexemes):
+        # クエリの語彙素ごとにポスティングの重みを足し合わせる
+        # コサイン類似度と同じく0〜1の範囲になるよう、クエリの語彙素で取りうる最大のスコアで割る
+        scores = np.zeros(len(self.tags), dtype=np.float32)
+        max_score = 0.0
+        for term in set(lexemes):
+            i = self.term_index.get(term)
+            if i is None:
+                continue
+            start, end = self.indptr[i], self.indptr[i + 1]
+            scores[self.doc_ids[start:end]] += self.weights[start:end]
+            max_score += self.idf[i]
+        if max_score > 0.0:
+            scores /= max_score
+        return scores
+
+
+def build_engine(json_dir, fields=()):
+    # api/json配下のid_*.jsonの語彙素から検索エンジンを作る
+    # fieldsを指定した場合は、その項目（biblio_locationなど）の語も検索できるようにする
+    tags = []
+    documents = []
+    json_files = sorted(glob.glob(os.path.join(json_dir, "id_*.json")))
+    for json_file in json_files:
+        with open(json_file, "r", encoding="utf-8") as json_f:
+            json_dict = json.load(json_f)
+        lexemes = list(json_dict.get("lexemes") or [])
+        for field in fields:
+            lexemes += field_terms(json_dict.get(field))
+        if lexemes:
+            # ファイル名 id_<ISBN>.json から、Doc2Vecのタグ（ID:<ISBN>）を作る
+            tags.append("ID:" + os.path.basename(json_file)[3:-5])
+            documents.append(lexemes)
+    engine = SparseSearchEngine.from_documents(tags, documents)
+    engine.fingerprint = index_fingerprint(json_files, fields)
+    return engine
+
+
+def index_fingerprint(json_files, fields=()):
+    # id_*.jsonのファイル数・最終更新時刻（book_metadataと同じ）と、語を加えた項目
+    return "%s:%s" % (source_fingerprint(json_files), ",".join(fields))
+
+
+def field_terms(value):
+    # 項目の値全体と、区切り文字で分けた語（"東京 : 岩波書店" -> ["東京:岩波書店", "東京", "岩波書店"]）
+    if not value or not isinstance(value, str):
+        return []
+    words = [word for word in FIELD_SEPARATORS.split(value) if word]
+    whole = "".join(value.split())
+    return ([whole] if len(words) > 1 else []) + words
+
+
+def load_or_build(index_path, json_dir, fields=()):
+    # 保存したインデックスがあり、今のjson_dirと同じ項目から作られたものであれば読み込む
+    # ない場合や、JSONが追加・編集・削除されていた場合、項目が違う場合はjson_dirから作り直して保存する
+    if os.path.exists(index_path):
+        engine = SparseSearchEngine.load(index_path)
+        json_files = glob.glob(os.path.join(json_dir, "id_*.json"))
+        if engine.fingerprint == index_fingerprint(json_files, fields):
+            return engine
+        print(f"### sparse index {index_path} is stale, rebuilding")
+    started = time.perf_counter()
+    engine = build_engine(json_dir, fields)
+    print(
+        "### sparse index built from %d books in %.2f sec"
+        % (len(engine), time.perf_counter() - started)
+    )
+    try:
+        engine.save(index_path)
+    except OSError as e:
+        print(f"### failed to save sparse index to {index_path}: {e}")
+    return engine
+
+
+_lock = threading.Lock()
+_engine = None
+
+
+def get_engine():
+    # プロセス内で共有する検索エンジン（最初に使うときに読み込む）
+    global _engine
+    if _engine is None:
+        with _lock:
+            if _engine is None:
+                _engine = load_or_build(settings.SPARSE_INDEX_PATH, settings.BOOK_JSON_DIR)
+    return _engine
+
+
+def parse_args():
+    parser = ArgumentParser(description="build the BM25 index from id_*.json lexemes")
+    parser.add_argument("--json-dir", dest="json_dir", default=settings.BOOK_JSON_DIR)
+    parser.add_argument("--index", dest="index_path", default=settings.SPARSE_INDEX_PATH)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    started = time.perf_counter()
+    engine = build_engine(args.json_dir)
+    engine.save(args.index_path)
+    print(
+        "### wrote %s: %d books, %d terms, %.1f MB in %.2f sec"
+        % (
+            args.index_path,
+            len(engine),
+            len(engine.terms),
+            os.path.getsize(args.index_path) / 2**20,
+            time.perf_counter() - started,
+        )
+    )
@@ -0,0 +1,165 @@
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+import api.settings as settings
+
+
+# ニュースから推論したベクトルと、類似する本の検索結果をディスクに保存するキャッシュ
+# キーは「正規化したタイトル+要約」「モデルの指紋」「推論・検索のパラメータ」のハッシュのため、
+# 同じニュースへの再リクエストでは推論を省略でき、モデルを入れ替えた場合は自然に無効になる
+# 合計サイズが上限を超えた場合は、最後に使われたのが古いものから削除する
+# ヒットのたびにlast_usedを書き込むとディスクへの書き込みが直列に並ぶため、
+# ヒットした時刻はメモリに記録しておき、一定の件数・時間ごと（と書き込み・削除の前）にまとめて書き込む
+# api.serveでは複数のワーカープロセスが同じファイルに書き込むため、
+# ・合計サイズはメモリに持たず、書き込みのトランザクションの中で数え直してから削除するかを決める
+# ・WALモードにし、他のプロセスが書き込み中の場合はBUSY_TIMEOUT_SECONDSまで待つ
+# ・それでも読み書きに失敗した場合はキャッシュになかったものとして扱い、リクエストはエラーにしない
+TOUCH_FLUSH_COUNT = 256
+TOUCH_FLUSH_SECONDS = 60.0
+BUSY_TIMEOUT_SECONDS = 5.0
+
+
+class VectorCache:
+    def __init__(self, db_path, max_bytes):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            db_path, timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS vectors ("
+            "key TEXT PRIMARY KEY, vector BLOB, results TEXT, size INTEGER, last_used REAL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS vectors_last_used ON vectors (last_used)"
+        )
+        self._connection.commit()
+        # まだ書き込んでいないヒットの時刻 {キー: 時刻}
+        self._touched = {}
+        self._flushed_at = time.time()
+
+    def get(self, key):
+        # (ベクトル, 検索結果) を返す。キャッシュにない場合（読み込めなかった場合も）はNone
+        with self._lock:
+            try:
+                row = self._connection.execute(
+                    "SELECT vector, results FROM vectors WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                print(f"### failed to read the vector cache {self.db_path}: {e}")
+                return None
+            if row is None:
+                return None
+            now = time.time()
+            self._touched[key] = now
+            if len(self._touched) >= TOUCH_FLUSH_COUNT or now - self._flushed_at >= TOUCH_FLUSH_SECONDS:
+                self._write(self._flush_touched)
+        vector = np.frombuffer(row[0], dtype=np.float32)
+        results = [tuple(result) for result in json.loads(row[1])]
+        return vector, results
+
+    def put(self, key, vector, results):
+        vector_bytes = np.asarray(vector, dtype=np.float32).tobytes()
+        results_text = json.dumps(results, ensure_ascii=False)
+        size = len(vector_bytes) + len(results_text.encode("utf-8"))
+        row = (key, vector_bytes, results_text, size, time.time())
+        with self._lock:
+            self._touched.pop(key, None)
+            self._write(self._insert, row)
+
+    def flush(self):
+        with self._lock:
+            self._write(self._flush_touched)
+
+    def _write(self, func, *args):
+        # funcの書き込みを1つのトランザクションで行う。失敗した場合は取り消し、キャッシュに書かなかったことにする
+        try:
+            func(*args)
+            self._connection.commit()
+        except sqlite3.Error as e:
+            self._connection.rollback()
+            print(f"### failed to write the vector cache {self.db_path}: {e}")
+
+    def _insert(self, row):
+        self._flush_touched()
+        self._connection.execute("INSERT OR REPLACE INTO vectors VALUES (?, ?, ?, ?, ?)", row)
+        # 書き込みのロックを持っている間に数え直すため、他のプロセスの書き込みも含めた合計になる
+        total_bytes = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM vectors"
+        ).fetchone()[0]
+        if total_bytes > self.max_bytes:
+            self._evict(total_bytes)
+
+    def _flush_touched(self):
+        # ヒットした時刻をまとめて書き込む（コミットは呼び出し側で行う）
+        if self._touched:
+            self._connection.executemany(
+                "UPDATE vectors SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in self._touched.items()],
+            )
+            self._touched = {}
+        self._flushed_at = time.time()
+
+    def _evict(self, total_bytes):
+        # 上限の9割に収まるまで、最後に使われたのが古いものから削除する
+        target = self.max_bytes * 0.9
+        rows = self._connection.execute(
+            "SELECT key, size FROM vectors ORDER BY last_used"
+        ).fetchall()
+        evicted = []
+        for key, size in rows:
+            if total_bytes <= target:
+                break
+            evicted.append((key,))
+            total_bytes -= size
+        self._connection.executemany("DELETE FROM vectors WHERE key = ?", evicted)
+
+
+def normalize_text(text):
+    # 全角・半角の揺れと空白の違いを吸収する
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def cache_key(normalized_text, model_fingerprint, params):
+    # normalized_textはnormalize_textで正規化済みの文章（推論にも同じ文章を使う）
+    payload = json.dumps(
+        [normalized_text, model_fingerprint, params], ensure_ascii=False, sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def file_fingerprint(path):
+    # ファイルのパス・サイズ・更新時刻からモデルの指紋を作る（モデルを保存し直すと変わる）
+    stat = os.stat(path)
+    return "%s:%d:%d" % (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    # プロセス内で共有するキャッシュ。DOC2VEC_VECTOR_CACHE_PATHが空の場合は使わない（Noneを返す）
+    global _cache
+    if not settings.DOC2VEC_VECTOR_CACHE_PATH:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = VectorCache(
+                    settings.DOC2VEC_VECTOR_CACHE_PATH,
+                    settings.DOC2VEC_VECTOR_CACHE_MAX_BYTES,
+                )
+                # 書き込んでいないヒットの時刻は終了時に書き込む
+                atexit.register(_cache.flush)
+    return _cache
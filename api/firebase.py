@@ -1,14 +1,27 @@
-import firebase_admin
-from firebase_admin import credentials
-from firebase_admin import firestore
+import threading
 
-cred = credentials.Certificate("admin.json")
-firebase_admin.initialize_app(cred)
+# Firestoreのクライアント（最初に使うときに初期化する）
+# import時に初期化やusersの読み込みを行うと、このモジュールをimportするだけでAPIの起動が遅くなるため
+_db = None
+_db_lock = threading.Lock()
 
 
-db = firestore.client()
+def get_db():
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                import firebase_admin
+                from firebase_admin import credentials
+                from firebase_admin import firestore
 
-# doc_ref = db.collection(u'users').document(u'aturing')
+                cred = credentials.Certificate("admin.json")
+                firebase_admin.initialize_app(cred)
+                _db = firestore.client()
+    return _db
+
+
+# doc_ref = get_db().collection(u'users').document(u'aturing')
 # doc_ref.set({
 #     u'first': u'Alan',
 #     u'middle': u'Mathison',
@@ -17,8 +30,13 @@ db = firestore.client()
 # })
 
 
-users_ref = db.collection(u'users')
-docs = users_ref.stream()
+def print_users():
+    users_ref = get_db().collection(u'users')
+    docs = users_ref.stream()
+
+    for doc in docs:
+        print(f'{doc.id} => {doc.to_dict()}')
+
 
-for doc in docs:
-    print(f'{doc.id} => {doc.to_dict()}')
\ No newline at end of file
+if __name__ == "__main__":
+    print_users()
@@ -1,9 +1,15 @@
+import threading
+
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from api.routers import book
 from api.routers import news_book
+from api.doc2vec import model_registry
+from api.doc2vec import book_metadata
+from api.doc2vec import sparse_engine
+import api.settings as settings
 
 
 app = FastAPI()
@@ -22,5 +28,41 @@ app.add_middleware(
 app.include_router(book.router)
 app.include_router(news_book.router)
 
+
+@app.on_event("startup")
+def load_doc2vec_model():
+    # 最初のリクエストを待たずに、起動時にDoc2Vecモデルと本の情報を読み込んでおく
+    # --reloadなどで頻繁に再起動する場合は、DOC2VEC_PRELOADで起動後の読み込みや遅延読み込みにできる
+    # Doc2Vecのモデルを待たずに起動する場合、読み込むまではBM25で検索する
+    # backgroundではBM25のインデックスを先に読み込む（ない場合は作る）。lazyでは最初に使うときに読み込む
+    if settings.DOC2VEC_PRELOAD == "lazy":
+        return
+    if settings.DOC2VEC_PRELOAD == "background":
+        threading.Thread(target=preload_in_background, name="doc2vec-preload", daemon=True).start()
+        return
+    preload_doc2vec_model()
+
+
+def preload_in_background():
+    if settings.SIMILARITY_FALLBACK:
+        sparse_engine.get_engine()
+    preload_doc2vec_model()
+
+
+def preload_doc2vec_model():
+    if settings.SIMILARITY_BACKEND == "sparse":
+        sparse_engine.get_engine()
+    else:
+        try:
+            model_registry.get_model()
+        except Exception as e:
+            # 代わりにBM25で検索できる場合は、モデルが読み込めなくても起動する
+            if not settings.SIMILARITY_FALLBACK:
+                raise
+            print(f"### failed to load model, falling back to the sparse index: {e!r}")
+            sparse_engine.get_engine()
+    book_metadata.get_store().load()
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,28 +1,141 @@
-from typing import Any, List
-from fastapi import APIRouter, Depends
-from datetime import datetime
+import asyncio
+import functools
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+from datetime import datetime, timedelta
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 
 # import api.crawling.get_from_json_file as crawling 
 import api.crawling.get_from_s3 as crawling
 import api.doc2vec.predict_similar_book as doc2vec
+from api.crawling.news_snapshot import snapshot_now, to_snapshot_time
+from api.doc2vec.fast_infer import MODES as INFER_MODES
+import api.settings as settings
 
 import api.schemas.news_book as schemas_news_book
 
 router = APIRouter()
 
+# ニュースのベクトルの推論方法（"infer"/"fast"）を選ぶクエリパラメータ。省略した場合は設定（DOC2VEC_INFER_MODE）に従う
+INFER_MODE_QUERY = Query(None, regex="^(%s)$" % "|".join(INFER_MODES))
+
+# 類似する本を求める処理（検索・本の情報の取得と、形態素解析・推論）を行う専用のスレッドプール
+# FastAPIの同期エンドポイント（/booksなど）やrun_in_threadpoolが使うスレッドプールとは分け、
+# /news-similar-booksが混んでいても他が詰まらないようにする（スレッド数はNEWS_BOOK_INFERENCE_THREADSで決まる）
+_inference_executor = None
+# 同時に処理するリクエスト数の上限（イベントループ上で作る必要があるため最初のリクエストで作る）
+_inference_semaphore = None
+
+
+def inference_threads():
+    # 処理全体を実行するスレッドと、そこから投げる形態素解析・推論を実行するスレッドの両方が要るため、2以上にする
+    return max(2, settings.NEWS_BOOK_INFERENCE_THREADS)
+
+
+def get_inference_executor():
+    global _inference_executor
+    if _inference_executor is None:
+        _inference_executor = ThreadPoolExecutor(
+            max_workers=inference_threads(),
+            thread_name_prefix="inference",
+        )
+    return _inference_executor
+
+
+def get_inference_semaphore():
+    # 処理全体はプールのスレッドの半分までしか使わないようにする
+    # 残りのスレッドは必ず形態素解析・推論に使えるため、全てのスレッドが推論の結果を待って止まることがない
+    global _inference_semaphore
+    if _inference_semaphore is None:
+        _inference_semaphore = asyncio.Semaphore(max(1, inference_threads() // 2))
+    return _inference_semaphore
+
+
+async def find_similar_books(news_list, mode=None):
+    # 類似する本を求める処理全体を専用のスレッドプールで実行し、イベントループから外す
+    # 形態素解析・推論も同じプールに投げる（executor）ため、CPUを使う処理は全てこのプールの中で行われる
+    loop = asyncio.get_running_loop()
+    executor = get_inference_executor()
+    async with get_inference_semaphore():
+        return await loop.run_in_executor(
+            executor,
+            functools.partial(
+                doc2vec.find_similar_books_by_news_list, news_list, mode, executor=executor
+            ),
+        )
+
+
+def fetch_news_list(limit):
+    # 設定（NEWS_SOURCE）に従って、S3またはファイルから最新のニュースを読む
+    if settings.NEWS_SOURCE == "s3":
+        return crawling.fetch_updated_news_data_from_s3(limit)
+    # クローラーの依存（feedparser）を読み込むため、使う場合だけimportする
+    import api.crawling.get_from_json_file as crawling_file
+
+    return crawling_file.fetch_updated_news_data_by_json(limit)
 
 
 @router.get(
     "/news-similar-books", response_model=List[schemas_news_book.NewsSimilarBook]
 )
-def get_news_and_similar_books(limit: int = 10):
+async def get_news_and_similar_books(limit: int = 10, mode: Optional[str] = INFER_MODE_QUERY):
     # newsと、それに関連する本をいくつか（デフォルト10個）返す
-    # news_list = crawling.fetch_updated_news_data_from_s3(limit)
-    # @FIXME: 
-    news_list = crawling.make_news_for_demo()
+    # S3やファイルの読み込みはスレッドで行い、イベントループを止めない
+    # 事前計算した類似する本はクローラーのファイルのURLで引くため、demoのニュースでは使われない
+    if settings.NEWS_SOURCE == "demo":
+        news_list = crawling.make_news_for_demo()
+    else:
+        news_list = await run_in_threadpool(fetch_news_list, limit)
+    # 全てのニュースの類似する本をまとめて求める（計算済みの結果があればそれを使う）
+    similar_book_dicts = await find_similar_books(news_list, mode)
     news_similar_books_array = []
-    for news_dict in news_list:
-        similar_book_dict = doc2vec.predict_similar_book_by_news(news_dict)
+    for news_dict, similar_book_dict in zip(news_list, similar_book_dicts):
+        # 類似する本が見つからなかったニュースは返さない
+        if similar_book_dict is None:
+            continue
         news_similar_book = {"news": news_dict, "book": similar_book_dict}
         news_similar_books_array.append(news_similar_book)
     return news_similar_books_array
+
+
+@router.get("/news-similar-books/history")
+async def get_news_history_and_similar_books(
+    days: int = Query(7, ge=1, le=settings.NEWS_HISTORY_MAX_DAYS),
+    until: Optional[datetime] = None,
+    mode: Optional[str] = INFER_MODE_QUERY,
+):
+    # untilまでのdays日間にクローリングしたニュースと、それぞれに類似する本を返す
+    # スナップショットは並列にダウンロードし、同じURLのニュースは最新のものだけを返す
+    # 結果は1行に1件（{"news": ..., "book": ...}）のNDJSONで、新しいスナップショットから順に流す
+    # untilはスナップショットのキーと同じ日本時間で比べる（タイムゾーン付きの場合は変換し、ない場合は日本時間とみなす）
+    until = to_snapshot_time(until) if until is not None else snapshot_now()
+    since = until - timedelta(days=days)
+    news_batches = await run_in_threadpool(open_news_history, since, until)
+    return StreamingResponse(stream_news_similar_books(news_batches, mode), media_type="application/x-ndjson")
+
+
+def open_news_history(since, until):
+    # 設定（NEWS_SOURCE）に従って、期間のスナップショットごとのニュースのリストを新しい順に返すイテレータを作る
+    # S3の一覧の取得はここで行い、失敗した場合は結果を流し始める前にエラーにする
+    if settings.NEWS_SOURCE == "s3":
+        return crawling.fetch_news_range(crawling.list_snapshot_keys(since, until))
+    if settings.NEWS_SOURCE == "file":
+        import api.crawling.get_from_json_file as crawling_file
+
+        return crawling_file.fetch_news_range_by_json(since, until)
+    return iter([crawling.make_news_for_demo()])
+
+
+async def stream_news_similar_books(news_batches, mode=None):
+    # ダウンロード・読み込みはスレッドで行い、類似する本はスナップショットごとにまとめて求める
+    async for news_list in iterate_in_threadpool(news_batches):
+        similar_book_dicts = await find_similar_books(news_list, mode)
+        lines = [
+            json.dumps({"news": news_dict, "book": similar_book_dict}, ensure_ascii=False) + "\n"
+            for news_dict, similar_book_dict in zip(news_list, similar_book_dicts)
+            if similar_book_dict is not None
+        ]
+        yield "".join(lines)
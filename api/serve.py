@@ -0,0 +1,182 @@
+# 本番用のpre-fork方式のサーバー
+# マスタープロセスでDoc2Vecモデルと本の情報を一度だけ読み込んでから、ワーカーをfork()する
+# ・メモリマップした配列（DOC2VEC_MMAP_MODE）はページキャッシュを、
+#   マスターで作った正規化済みの行列や本の情報はcopy-on-writeで全ワーカーが共有する
+# ・ワーカーは同じソケットでuvicornを動かす（カーネルが接続を振り分ける）
+# ・ワーカーごとの常駐メモリ（RSS）と、そのうち共有されているメモリを /proc/<pid>/smaps_rollup から表示する
+# $ python -m api.serve --workers 4 --port 8000
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+from argparse import ArgumentParser
+
+import api.settings as settings
+
+# smaps_rollupから読む項目（kB）
+MEMORY_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def create_socket(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def preload():
+    # fork()する前に、全ワーカーで共有するものを読み込んでおく
+    # （スレッドプールやS3・SQLiteの接続はfork()後に各ワーカーで作られる）
+    from api.main import preload_doc2vec_model
+
+    started = time.perf_counter()
+    preload_doc2vec_model()
+    elapsed = time.perf_counter() - started
+    print("### master %d preloaded the model in %.2f sec" % (os.getpid(), elapsed))
+    # 読み込んだオブジェクトをGCの対象から外し、ワーカーでのGCによる参照カウント等の書き込みでページがコピーされないようにする
+    gc.collect()
+    gc.freeze()
+
+
+def fork_worker(worker_main, *args):
+    pid = os.fork()
+    if pid != 0:
+        return pid
+    # ワーカー: マスターのシグナルハンドラを元に戻し、処理が終わったらマスターの後処理を実行せずに終了する
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    code = 0
+    try:
+        worker_main(*args)
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    except BaseException as e:
+        print(f"### worker {os.getpid()} failed: {e!r}")
+        code = 1
+    finally:
+        sys.stdout.flush()
+        os._exit(code)
+
+
+def run_uvicorn(sock, args):
+    import uvicorn
+    from api.main import app
+
+    config = uvicorn.Config(app, log_level=args.log_level, timeout_keep_alive=args.keep_alive)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def memory_usage(pid):
+    # /proc/<pid>/smaps_rollup（古いカーネルではsmapsの合計）から、項目ごとのメモリ（バイト）を返す
+    usage = dict.fromkeys(MEMORY_FIELDS, 0)
+    path = f"/proc/{pid}/smaps_rollup"
+    if not os.path.exists(path):
+        path = f"/proc/{pid}/smaps"
+    try:
+        with open(path) as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in usage:
+                    usage[name] += int(value.split()[0]) * 1024
+    except OSError:
+        return None
+    return usage
+
+
+def print_memory_report(pids):
+    # Shared: 他のプロセスと共有しているページ, Private: そのプロセスだけのページ
+    # Pssは共有ページを共有しているプロセス数で割ったもので、全プロセスの合計が実際の使用量になる
+    print(
+        "### %-8s %7s %10s %10s %10s %10s"
+        % ("role", "pid", "RSS MB", "Shared MB", "Private MB", "PSS MB")
+    )
+    total_pss = 0
+    for role, pid in pids:
+        usage = memory_usage(pid)
+        if usage is None:
+            continue
+        shared = usage["Shared_Clean"] + usage["Shared_Dirty"]
+        private = usage["Private_Clean"] + usage["Private_Dirty"]
+        total_pss += usage["Pss"]
+        print(
+            "### %-8s %7d %10.1f %10.1f %10.1f %10.1f"
+            % (
+                role,
+                pid,
+                usage["Rss"] / 2**20,
+                shared / 2**20,
+                private / 2**20,
+                usage["Pss"] / 2**20,
+            )
+        )
+    print("### total PSS %.1f MB" % (total_pss / 2**20))
+
+
+def run_master(worker_main, worker_args, workers, report_interval):
+    # ワーカーをfork()し、終了したワーカーは作り直す。SIGTERM/SIGINTで全ワーカーを止めて終了する
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    children = set(fork_worker(worker_main, *worker_args) for _ in range(workers))
+    print(f"### master {os.getpid()} started {workers} workers: {sorted(children)}")
+    next_report = time.monotonic() + min(report_interval, 5) if report_interval else None
+
+    while not stopping:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid in children:
+            children.discard(pid)
+            print(f"### worker {pid} exited with status {status}, restarting")
+            children.add(fork_worker(worker_main, *worker_args))
+        if next_report is not None and time.monotonic() >= next_report:
+            workers_pids = [("worker", pid) for pid in sorted(children)]
+            print_memory_report([("master", os.getpid())] + workers_pids)
+            next_report = time.monotonic() + report_interval
+        time.sleep(0.5)
+
+    print(f"### master {os.getpid()} stopping workers")
+    for pid in children:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in children:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+
+
+def parse_args():
+    parser = ArgumentParser(description="pre-fork API server sharing one loaded Doc2Vec model")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=settings.API_WORKERS)
+    parser.add_argument(
+        "--report-interval",
+        dest="report_interval",
+        type=float,
+        default=60.0,
+        help="seconds between memory reports (0 disables)",
+    )
+    parser.add_argument("--log-level", dest="log_level", default="info")
+    parser.add_argument("--keep-alive", dest="keep_alive", type=int, default=5)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    sock = create_socket(args.host, args.port)
+    preload()
+    run_master(run_uvicorn, (sock, args), args.workers, args.report_interval)
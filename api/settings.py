@@ -6,3 +6,70 @@ import os
 
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY_ID = os.getenv("AWS_SECRET_ACCESS_KEY_ID")
+# S3の最新のニュースのキーをキャッシュする秒数
+S3_LATEST_TTL_SECONDS = float(os.getenv("S3_LATEST_TTL_SECONDS", "60"))
+# クローリングしたニュースをS3にアップロードするかどうか
+S3_UPLOAD_NEWS = os.getenv("S3_UPLOAD_NEWS", "") == "1"
+# S3クライアントのコネクションプールの大きさ
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "20"))
+# クローリングしたニュースのファイルの形式
+# "gz"/"zst": 圧縮したJSON Lines（news/YYYY/MM/DD/HHMMSS.jsonl.gz）, "json": 以前のjson形式（news_<日時>.json）
+NEWS_SNAPSHOT_FORMAT = os.getenv("NEWS_SNAPSHOT_FORMAT", "gz")
+# 期間を指定してニュースを取得する場合に、スナップショットを並列にダウンロードするスレッド数
+S3_FETCH_WORKERS = int(os.getenv("S3_FETCH_WORKERS", "8"))
+
+# Doc2Vecモデルの設定
+# python -m api.doc2vec.slim_model で作った推論用のモデル（*.slim.npz）も指定できる
+DOC2VEC_MODEL_PATH = os.getenv("DOC2VEC_MODEL_PATH", "api/doc2vec/d2v_ipsj_desc_0.model")
+# 類似する本の検索方法（"doc2vec": Doc2Vecの文書ベクトル, "sparse": 本の語彙素に対するBM25）
+SIMILARITY_BACKEND = os.getenv("SIMILARITY_BACKEND", "doc2vec")
+# Doc2Vecのモデルが読み込み中・読み込めない場合に、待たずにBM25で検索する（"0"で無効）
+SIMILARITY_FALLBACK = os.getenv("SIMILARITY_FALLBACK", "1") == "1"
+# python -m api.doc2vec.sparse_engine で作るBM25のインデックス（ない場合や古い場合は最初に使うときにBOOK_JSON_DIRから作る）
+SPARSE_INDEX_PATH = os.getenv("SPARSE_INDEX_PATH", "api/doc2vec/sparse_index.npz")
+# APIの起動時にモデルを読み込むかどうか
+# "startup": 起動処理の中で読み込む, "background": 起動後に別スレッドで読み込む, "lazy": 最初のリクエストで読み込む
+DOC2VEC_PRELOAD = os.getenv("DOC2VEC_PRELOAD", "startup")
+# api.serve（pre-fork方式のサーバー）のワーカー数
+API_WORKERS = int(os.getenv("API_WORKERS", str(os.cpu_count() or 1)))
+# ベクトルの配列をメモリマップで読み込む（空文字の場合はメモリに全て読み込む）
+DOC2VEC_MMAP_MODE = os.getenv("DOC2VEC_MMAP_MODE", "r") or None
+# 文書ベクトルの検索方法（"exact": 全件のコサイン類似度, "ivf": 近似最近傍探索のインデックス）
+DOC2VEC_SEARCH_INDEX = os.getenv("DOC2VEC_SEARCH_INDEX", "exact")
+# 近似最近傍探索で調べるクラスタ数（大きいほど正確で遅い）
+DOC2VEC_IVF_NPROBE = int(os.getenv("DOC2VEC_IVF_NPROBE", "16"))
+# 文書ベクトルを精度を落として検索する（"float16"/"int8"、空文字の場合はfloat32）
+# モデルの隣の <モデル>.<dtype>.npz を使い、ない場合は起動時に作る。ivfと組み合わせても候補の行だけをfloat32に戻す
+# メモリを減らす目的ではint8を使う（float16はfloat32の半分のメモリだが検索が遅くなる）
+DOC2VEC_VECTOR_STORE = os.getenv("DOC2VEC_VECTOR_STORE", "")
+
+# 推薦する本の情報
+BOOK_JSON_DIR = os.getenv("BOOK_JSON_DIR", "api/json")
+# BOOK_JSON_DIRから作る、切り詰め済みの本の情報のストア（ない場合は起動時に作る）
+BOOK_METADATA_PATH = os.getenv("BOOK_METADATA_PATH", "api/doc2vec/book_metadata.sqlite3")
+
+# ニュースのベクトルの推論方法（リクエストのmodeで上書きできる）
+# "infer": gensimのinfer_vector, "fast": IDFで重み付けした単語ベクトルの平均（api.doc2vec.fast_infer）
+DOC2VEC_INFER_MODE = os.getenv("DOC2VEC_INFER_MODE", "infer")
+# /news-similar-booksで推論を並列に行うスレッド数
+DOC2VEC_INFER_WORKERS = int(os.getenv("DOC2VEC_INFER_WORKERS", str(os.cpu_count() or 1)))
+# 推論したニュースのベクトルと検索結果のキャッシュ（空文字の場合はキャッシュしない）
+DOC2VEC_VECTOR_CACHE_PATH = os.getenv("DOC2VEC_VECTOR_CACHE_PATH", "api/doc2vec/vector_cache.sqlite3")
+DOC2VEC_VECTOR_CACHE_MAX_BYTES = int(os.getenv("DOC2VEC_VECTOR_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# クローリングしたニュースのファイルを置くディレクトリ（crawling-news/run.pyも同じ環境変数を使う）
+NEWS_FILES_DIR = os.getenv("NEWS_FILES_DIR", "api/crawling/news_files")
+# クローリング後に計算しておいた、ニュースごとの類似する本（*.recommend.json）を置くディレクトリ
+# 事前計算はニュースのファイルの隣に書き出すため、通常はNEWS_FILES_DIRと同じにする
+NEWS_RECOMMENDATIONS_DIR = os.getenv("NEWS_RECOMMENDATIONS_DIR", NEWS_FILES_DIR)
+# /news-similar-booksで返すニュース
+# "demo": 固定のデモ用のニュース, "file": NEWS_FILES_DIRの最新のファイル, "s3": S3の最新のニュース
+# 事前計算した結果はニュースのURLで引くため、"demo"ではヒットせず、常にその場で推論する
+NEWS_SOURCE = os.getenv("NEWS_SOURCE", "demo")
+
+# /news-similar-booksの同時実行数の設定
+# 類似する本を求める専用スレッドプールのスレッド数（/news-similar-booksの推論はDOC2VEC_INFER_WORKERSではなくこの数で行う）
+# 同時に処理するリクエスト数はこの半分（2未満の場合は2スレッド・1リクエスト）で、超えた分は順番待ちになる
+NEWS_BOOK_INFERENCE_THREADS = int(os.getenv("NEWS_BOOK_INFERENCE_THREADS", "2"))
+# /news-similar-books/historyで指定できる最大の日数
+NEWS_HISTORY_MAX_DAYS = int(os.getenv("NEWS_HISTORY_MAX_DAYS", "31"))
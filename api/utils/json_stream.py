@@ -0,0 +1,93 @@
+import codecs
+import json
+
+# 大きなJSONオブジェクトを先頭から少しずつ読み、トップレベルのキーと値を順に取り出す
+# {"news0": {...}, "news1": {...}, ...} の形式のニュースのファイルで、必要な件数だけ読んだら
+# 残りをダウンロード・解析せずに打ち切るために使う
+_WHITESPACE = " \t\n\r"
+_decoder = json.JSONDecoder()
+
+
+def iter_object_items(chunks):
+    # chunks: bytesのイテラブル（S3のbody.iter_chunks()など）
+    reader = _ChunkReader(chunks)
+    if reader.next_char() != "{":
+        raise ValueError("top-level JSON value is not an object")
+    reader.advance(1)
+
+    while True:
+        char = reader.next_char()
+        if char == ",":
+            reader.advance(1)
+            char = reader.next_char()
+        if char == "}":
+            return
+        key = reader.decode()
+        if reader.next_char() != ":":
+            raise ValueError("expected ':' after key %r" % key)
+        reader.advance(1)
+        reader.next_char()
+        yield key, reader.decode()
+
+
+def read_object_items(chunks, limit):
+    # 先頭からlimit個のキーと値を辞書にして返す（limit個読んだところで読み込みをやめる）
+    # limitがNoneの場合は全て読む
+    items = {}
+    if limit is not None and limit <= 0:
+        return items
+    for key, value in iter_object_items(chunks):
+        items[key] = value
+        if limit is not None and len(items) >= limit:
+            break
+    return items
+
+
+class _ChunkReader:
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._exhausted = False
+
+    def _read_more(self):
+        # 読み終わった部分は捨て、次のチャンクを追加する
+        self._buffer = self._buffer[self._pos:]
+        self._pos = 0
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._buffer += self._decoder.decode(b"", final=True)
+            self._exhausted = True
+            return False
+        self._buffer += self._decoder.decode(chunk)
+        return True
+
+    def next_char(self):
+        # 空白を読み飛ばし、次の文字を返す（読み込む前に進めない）
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read_more():
+                raise ValueError("unexpected end of JSON data")
+
+    def advance(self, count):
+        self._pos += count
+
+    def decode(self):
+        # 現在位置から1つのJSONの値を読む。値が途中で切れている場合は続きを読み込んでやり直す
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if not self._read_more():
+                    raise
+                continue
+            # 数値などはバッファの末尾で終わると続きがある可能性がある
+            if end == len(self._buffer) and not self._exhausted:
+                self._read_more()
+                continue
+            self._pos = end
+            return value
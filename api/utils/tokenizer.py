@@ -0,0 +1,86 @@
+import threading
+from functools import lru_cache
+
+from api.utils.text import convert_full_width_to_half_width
+
+
+# MeCabによる形態素解析の共通モジュール
+# ・Taggerの生成は重く、またスレッド間で共有できないため、スレッドごとに一つだけ生成して使い回す
+# ・parseの出力文字列を行ごとに正規表現で分割するのではなく、parseToNodeで品詞を直接見る
+# ・同じ文章（ニュースの再取得など）は何度も解析しないように、結果をLRUキャッシュに保持する
+# ・MeCabは最初に解析するときにimportする（importするだけのモジュールの起動を軽くする）
+DICTIONARY = "mecab-ipadic-neologd"
+CACHE_SIZE = 4096
+
+_local = threading.local()
+
+
+def get_tagger():
+    if not hasattr(_local, "tagger"):
+        import MeCab
+
+        _local.tagger = MeCab.Tagger(DICTIONARY)
+    return _local.tagger
+
+
+def parse_text(text, drop_particles=True):
+    # 記号と、原形のないサ変接続（と、drop_particlesの場合は助詞）を除いた表層形のリストを返す
+    return list(_parse_surfaces(convert_full_width_to_half_width(text), drop_particles))
+
+
+def parse_base_forms(text):
+    # IpsjModelで使う語彙素のリスト（代表表記、活用のある語はfeatureの値、それ以外は表層形）
+    if not text:
+        return []
+    return list(_parse_base_forms(text))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse_surfaces(text, drop_particles):
+    lexemes = []
+    for surface, features in _nodes(text):
+        # 助詞が重要ではない
+        if features[1] == "サ変接続" and _feature(features, 6) == "*":
+            continue
+        if features[1] == "記号" or features[0] == "記号":
+            continue
+        if drop_particles and features[0] == "助詞":
+            continue
+        lexemes.append(surface)
+    return tuple(lexemes)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse_base_forms(text):
+    lexemes = []
+    for surface, features in _nodes(text):
+        if _feature(features, 6)[0:5] == "代表表記：":
+            lexemes.append(features[6][6:])
+        elif _feature(features, 4) != "*":
+            lexemes.append(features[4])
+        else:
+            lexemes.append(surface)
+    return tuple(lexemes)
+
+
+def _nodes(text):
+    # 文頭・文末を除いた (表層形, featureのリスト) を順に返す
+    import MeCab
+
+    node = get_tagger().parseToNode(text)
+    while node:
+        if node.stat not in (MeCab.MECAB_BOS_NODE, MeCab.MECAB_EOS_NODE):
+            yield node.surface, node.feature.split(",")
+        node = node.next
+
+
+def _feature(features, index):
+    # 未知語などfeatureの数が少ない場合は"*"として扱う
+    return features[index] if index < len(features) else "*"
+
+
+def cache_info():
+    return {
+        "surfaces": _parse_surfaces.cache_info(),
+        "base_forms": _parse_base_forms.cache_info(),
+    }
@@ -1,4 +1,14 @@
 import json
+import os
+
+import repo_root  # api/をimportできるようにする
+from api.crawling.news_snapshot import compression_of, snapshot_key, write_snapshot
+
+
+# 圧縮したJSON Linesの形式とキーは、APIと同じもの（api/crawling/news_snapshot.py）を使う
+# ニュースのスナップショットのパス（news_files/news/YYYY/MM/DD/HHMMSS.jsonl.gz）を作る
+def snapshot_path(folder_path, crawled_at, compression="gz"):
+    return os.path.join(folder_path, snapshot_key(crawled_at, compression))
 
 
 # クローリングしたニュースのデータをjson形式にしてフォルダーに格納するクラス
@@ -20,6 +30,11 @@ class ConvertNewsData:
             # 空の辞書にニュースのタイトル、要約、リンクを追加していく
             news_dict[filename] = dict((["title", data[0]],["summary", data[1]],["link", data[2]]))
 
+        # 拡張子が .jsonl.gz / .jsonl.zst の場合は、1行に1件のニュースを書いて圧縮して格納する（日付ごとのフォルダーは自動で作成する）
+        if compression_of(self.file_path) is not None:
+            write_snapshot(self.file_path, news_dict)
+            return news_dict
+
         # 辞書型のデータをjson形式に変換して、指定されたパスに格納する
         with open(self.file_path , "w", encoding="utf-8") as f:
             json.dump(news_dict, f, indent=4, ensure_ascii=False)
@@ -0,0 +1,9 @@
+# api/配下の共通モジュール（ニュースのスナップショットの形式、S3へのアップロードなど）を使うため、リポジトリのルートをパスに追加する
+# crawling-newsのスクリプトは、apiをimportする前にこのモジュールをimportする（import repo_root）
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
@@ -3,9 +3,12 @@ import os
 from crawling import CrawlingNews
 from convert_news_data import ConvertNewsData
 from convert_book_data import ConvertBookData
-import datetime
 import json
+import subprocess
+import sys
 
+import repo_root  # api/をimportできるようにする
+from api.crawling.news_snapshot import snapshot_key, snapshot_now
 
 
 # ニュース記事のRSSのURL
@@ -15,21 +18,49 @@ URL = "https://www.news24.jp/rss/index.rdf"
 load_dotenv()
 JSON_PATH = os.environ["FIREBASE_API_KEY"]
 
+# ニュースのファイルの形式（"gz"/"zst": 圧縮したJSON Lines, "json": 以前のjson形式）
+NEWS_SNAPSHOT_FORMAT = os.getenv("NEWS_SNAPSHOT_FORMAT", "gz")
+# ニュースのファイルを置くディレクトリ（リポジトリのルートからの相対パス。APIのNEWS_FILES_DIRと同じ）
+# APIは同じディレクトリから最新のニュースと事前計算した類似する本を読む
+repository_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+NEWS_FILES_DIR = os.path.join(repository_root, os.getenv("NEWS_FILES_DIR", "api/crawling/news_files"))
+# "1"の場合は、ニュースのファイルをS3にアップロードし、最新のニュースを指すポインタ（latest.json）を更新する（APIのS3_UPLOAD_NEWSと同じ）
+S3_UPLOAD_NEWS = os.getenv("S3_UPLOAD_NEWS", "") == "1"
+
 
 # ニュースデータのクローリング
 news_data = CrawlingNews(URL)
 news_list = news_data.crawling()
 
 # 現在時刻をjsonファイルのファイル名にする
-datetime_now = datetime.datetime.now()
+datetime_now = snapshot_now()
 formated_time = datetime_now.strftime("%Y年%m月%d日%H時%M分%S秒")
 file_name= f"news_{formated_time}"
-file_path = f"./news_files/{file_name}.json"
+if NEWS_SNAPSHOT_FORMAT == "json":
+    key = f"{file_name}.json"
+else:
+    key = snapshot_key(datetime_now, NEWS_SNAPSHOT_FORMAT)
+file_path = os.path.join(NEWS_FILES_DIR, key)
 
 # ニュースデータのjsonファイルへの変換処理
 json_data = ConvertNewsData(news_list, file_path)
 json_data.convert()
 
+# S3にアップロードし、ポインタを更新する（APIのクローラーと同じ処理）
+if S3_UPLOAD_NEWS:
+    from api.crawling.get_from_s3 import upload_news_snapshot
+
+    upload_news_snapshot(file_path, key)
+
+# クローリングしたニュースごとに類似する本を計算し、jsonファイルの隣に書き出す（APIはこの結果を返す）
+# モデルはAPI側にあるため、リポジトリのルートでAPIの処理を呼び出す
+result = subprocess.run(
+    [sys.executable, "-m", "api.doc2vec.precompute", os.path.abspath(file_path)],
+    cwd=repository_root,
+)
+if result.returncode != 0:
+    print("類似する本の事前計算に失敗しました。APIはその場で推論します。")
+
 
 # テストデータ1
 isbn_list = [["信長の原理〈上〉","9784041098646"], ["信長の原理〈下〉", "9784041098653"], ["じんかん", "9784065192702"], ["渦 : 妹背山婦女庭訓魂結び", "9784163909875"], ["銀閣の人", "9784041072356"]]